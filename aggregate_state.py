@@ -0,0 +1,213 @@
+import os
+import json
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import List, Tuple
+from aggregation import aggregate_plays, top_k_from_aggregates
+from streaming_history import MIN_MINUTES
+from time_window import TimeWindow
+
+KEYS = ["artistName", "trackName"]
+PODCAST_MINUTES = 10. # same rule as SpotifyUnwrapped.finalise_dataframes
+
+
+def _empty_aggregates() -> pd.DataFrame:
+    index = pd.MultiIndex.from_arrays([pd.Series(dtype=object), pd.Series(dtype=object)], names=KEYS)
+    return pd.DataFrame({"plays" : pd.Series(dtype="int64"), "minutes" : pd.Series(dtype="float64")}, index=index)
+
+
+def _time_keys(times:pd.Series) -> pd.Series:
+    return times.dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def play_identities(df:pd.DataFrame) -> List[Tuple[str, str, str, int]]:
+    """
+    The (endTime, artistName, trackName, msPlayed) identity of each play.
+    """
+    return list(zip(_time_keys(df["endTime"]), df["artistName"], df["trackName"], df["msPlayed"].astype("int64").tolist()))
+
+
+def merge_intervals(intervals:List[Tuple[pd.Timestamp, pd.Timestamp]]) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class AggregateState:
+    """
+    Persisted aggregates of the filtered plays so that a new export can be merged in
+    without reprocessing the earlier ones:
+    - plays and minutes per (artistName, trackName) for the songs and for the podcasts
+    - the albums {(artist, track) : album} and genres {artist : genres} resolved so far
+    - a watermark of the ingested time ranges, plays inside it are skipped as already counted.
+      The history times are only to the minute (second for the extended history) so a later export
+      can have new plays at the very start or end of a range: the identities of the plays at the
+      range ends are kept and only those plays are matched one by one.
+    The state is tied to the window and min_minutes it was built with.
+    """
+
+    def __init__(self, path:str, window:TimeWindow=None, min_minutes:float=MIN_MINUTES) -> None:
+        self.path = path
+        self.window = TimeWindow.wrapped(2023) if window is None else window
+        self.min_minutes = min_minutes
+        self.songs = _empty_aggregates()
+        self.podcasts = _empty_aggregates()
+        self.albums = {}
+        self.genres = {}
+        self.watermark = []
+        self.boundary = Counter() # play identity -> count, for the plays at the watermark ends
+
+    def params(self) -> dict:
+        return {"window" : self.window.params(), "min_minutes" : self.min_minutes}
+
+    @classmethod
+    def load(cls, path:str, window:TimeWindow=None, min_minutes:float=MIN_MINUTES) -> "AggregateState":
+        """
+        The state saved at path, or an empty state if there is none yet.
+        """
+        state = cls(path, window, min_minutes)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return state
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["params"] != json.loads(json.dumps(state.params())):
+            raise ValueError(f"The state at {path} was built with {meta['params']}, not {state.params()}.")
+        state.watermark = [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in meta["watermark"]]
+        state.genres = meta["genres"]
+        state.boundary = Counter({tuple(identity) : count for identity, count in meta.get("boundary", [])})
+        state.songs = state._read_aggregates("songs")
+        state.podcasts = state._read_aggregates("podcasts")
+        albums = pq.read_table(os.path.join(path, "albums.parquet")).to_pandas()
+        state.albums = dict(zip(zip(albums["artistName"], albums["trackName"]), albums["albumName"]))
+        return state
+
+    def _read_aggregates(self, name:str) -> pd.DataFrame:
+        agg = pq.read_table(os.path.join(self.path, f"{name}.parquet")).to_pandas()
+        return agg if len(agg) > 0 else _empty_aggregates()
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        albums = pd.DataFrame({
+            "artistName" : pd.Series([a for a, _ in self.albums], dtype=object),
+            "trackName" : pd.Series([t for _, t in self.albums], dtype=object),
+            "albumName" : pd.Series(list(self.albums.values()), dtype=object),
+        })
+        self._write(pa.Table.from_pandas(self.songs, preserve_index=True), "songs.parquet")
+        self._write(pa.Table.from_pandas(self.podcasts, preserve_index=True), "podcasts.parquet")
+        self._write(pa.Table.from_pandas(albums, preserve_index=False), "albums.parquet")
+        meta = {
+            "params" : self.params(),
+            "watermark" : [(str(start), str(end)) for start, end in self.watermark],
+            "genres" : self.genres,
+            "boundary" : [(list(identity), count) for identity, count in self.boundary.items()],
+        }
+        # meta.json is written last so that a state is only loadable once its tables are complete
+        tmp_path = os.path.join(self.path, f"meta.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def _write(self, table:pa.Table, name:str) -> None:
+        path = os.path.join(self.path, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def ingested(self, df:pd.DataFrame) -> np.ndarray:
+        """
+        Mask of the plays already counted: inside the watermark, except that a play exactly at
+        a range end is only counted if the state has seen that play (as many times) before.
+        """
+        times = df["endTime"].to_numpy(dtype="datetime64[ns]")
+        if len(self.watermark) == 0:
+            return np.zeros(len(times), dtype=bool)
+        starts = np.array([start for start, _ in self.watermark], dtype="datetime64[ns]")
+        ends = np.array([end for _, end in self.watermark], dtype="datetime64[ns]")
+        idx = np.searchsorted(starts, times, side="right") - 1
+        inside = (idx >= 0) & (times <= ends[np.maximum(idx, 0)])
+        at_end = inside & ((times == starts[np.maximum(idx, 0)]) | (times == ends[np.maximum(idx, 0)]))
+        if at_end.any():
+            seen = self.boundary.copy()
+            for i, identity in zip(np.flatnonzero(at_end), play_identities(df[at_end])):
+                if seen[identity] > 0:
+                    seen[identity] -= 1
+                else:
+                    inside[i] = False
+        return inside
+
+    def append(self, dfs:List[pd.DataFrame] | pd.DataFrame) -> int:
+        """
+        Merge the filtered plays of new files (eg. json_batch_update output) into the state and
+        return the number of plays added.  Plays inside the watermark are skipped, the files of
+        one append are checked against the previous watermark only so that an export split
+        over several files is not clipped at the file boundaries.
+        Only the new plays are aggregated, the merge then touches their keys.
+        """
+        dfs = [dfs] if isinstance(dfs, pd.DataFrame) else dfs
+        dfs = [df for df in dfs if len(df) > 0]
+        if len(dfs) == 0:
+            return 0
+        df = pd.concat(dfs, axis=0) if len(dfs) > 1 else dfs[0]
+        new = df[~self.ingested(df)]
+        self.watermark = merge_intervals(self.watermark + [(d["endTime"].min(), d["endTime"].max()) for d in dfs])
+        self._update_boundary(new)
+        if len(new) == 0:
+            return 0
+        songs = (new["minsPlayed"] <= PODCAST_MINUTES).to_numpy()
+        self.songs = self._merge(self.songs, aggregate_plays(new[songs], KEYS))
+        self.podcasts = self._merge(self.podcasts, aggregate_plays(new[~songs], KEYS))
+        return len(new)
+
+    def _update_boundary(self, new:pd.DataFrame) -> None:
+        """
+        Adds the new plays to the boundary identities and keeps only those at the ends of the merged watermark.
+        """
+        ends = set(_time_keys(pd.Series([t for interval in self.watermark for t in interval], dtype="datetime64[ns]")))
+        boundary = self.boundary + Counter(play_identities(new[_time_keys(new["endTime"]).isin(ends)]))
+        self.boundary = Counter({identity : count for identity, count in boundary.items() if identity[0] in ends})
+
+    def _merge(self, agg:pd.DataFrame, new:pd.DataFrame) -> pd.DataFrame:
+        new = new.astype({"plays" : "int64", "minutes" : "float64"})
+        if len(new) == 0:
+            return agg
+        if len(agg) == 0:
+            return new
+        merged = agg.add(new, fill_value=0)
+        return merged.astype({"plays" : "int64"})
+
+    def unresolved_tracks(self) -> List[Tuple[str, str]]:
+        return [key for key in self.songs.index if key not in self.albums]
+
+    def unresolved_artists(self) -> List[str]:
+        artists = self.songs.index.get_level_values("artistName").unique()
+        return [artist for artist in artists if artist not in self.genres]
+
+    def get_top_k(self, kind:str, k:int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        The (Streams, Time (hours)) top k tables of kind "artist", "song", "podcast" or "album"
+        in the same format as the SpotifyUnwrapped.get_yearly_top_* methods.
+        The album tables only count the tracks whose album has been resolved.
+        """
+        if kind == "artist":
+            agg, labels = self.songs.groupby(level="artistName", sort=True).sum(), {"artistName" : "Artist"}
+        elif kind == "song":
+            agg, labels = self.songs.groupby(level="trackName", sort=True).sum(), {"trackName" : "Track"}
+        elif kind == "podcast":
+            agg, labels = self.podcasts.groupby(level="artistName", sort=True).sum(), {"artistName" : "Podcast"}
+        elif kind == "album":
+            albums = pd.Series([self.albums.get(key) for key in self.songs.index], index=self.songs.index, dtype=object)
+            tracks = self.songs.assign(albumName=albums.to_numpy()).reset_index()
+            tracks = tracks[tracks["albumName"].notna()]
+            agg = tracks.groupby(["artistName", "albumName"], sort=True)[["plays", "minutes"]].sum()
+            labels = {"albumName" : "Album", "artistName" : "Artist"}
+        else:
+            raise ValueError(f"Unknown kind {kind}.")
+        return top_k_from_aggregates(agg, k, labels)
@@ -0,0 +1,41 @@
+import pandas as pd
+from typing import Dict, List, Tuple
+
+
+def aggregate_plays(df:pd.DataFrame, keys:List[str]) -> pd.DataFrame:
+    """
+    Number of plays ("plays") and total minutes ("minutes") for every key in one grouped pass.
+    The result is sorted by key.  Categorical keys only produce the observed keys.
+    """
+    agg = df.groupby(keys, sort=True, observed=True)["minsPlayed"].agg(["size", "sum"])
+    return agg.rename(columns={"size" : "plays", "sum" : "minutes"})
+
+
+def top_k_from_aggregates(agg:pd.DataFrame, k:int, labels:Dict[str, str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Selects the top k keys by plays and by minutes with a partial selection (nlargest)
+    rather than sorting every key, and formats them as the Altair ready
+    (label..., "Streams") and (label..., "Time (hours)") frames.
+    Ties are broken by key order.
+    """
+    num_plays = _format(agg["plays"].nlargest(k).rename("Streams"), labels)
+    cum_time = _format(agg["minutes"].nlargest(k).rename("Time (hours)"), labels)
+    cum_time["Time (hours)"] = cum_time["Time (hours)"].astype("float64")/60
+    return num_plays, cum_time
+
+
+def _format(top:pd.Series, labels:Dict[str, str]) -> pd.DataFrame:
+    # categorical keys (compact mode) go back to plain strings so the frames are the same in both modes
+    top = top.reset_index().rename(columns=labels)
+    for label in labels.values():
+        if label in top.columns and isinstance(top[label].dtype, pd.CategoricalDtype):
+            top[label] = top[label].astype(object)
+    return top
+
+
+def top_k_tables(df:pd.DataFrame, keys:List[str], k:int, labels:Dict[str, str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    The top k tables by streams and by time for the keys of df.
+    labels maps the dataframe columns to the output column names eg. {"artistName" : "Artist"}.
+    """
+    return top_k_from_aggregates(aggregate_plays(df, keys), k, labels)
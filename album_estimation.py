@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from typing import Callable, List, Tuple
+
+
+class AlbumShareEstimate:
+    """
+    Estimated share of the total weight (plays or minutes) for each (artist, album),
+    sorted by share, with simultaneous confidence intervals.
+    """
+
+    def __init__(self, shares:pd.DataFrame, lookups:int, draws:int, converged:bool, exact:bool) -> None:
+        self.shares = shares # columns artistName, albumName, share, lower, upper
+        self.lookups = lookups
+        self.draws = draws
+        self.converged = converged
+        self.exact = exact
+
+    def __repr__(self) -> str:
+        return f"AlbumShareEstimate(albums={len(self.shares)}, lookups={self.lookups}, draws={self.draws}, converged={self.converged}, exact={self.exact})"
+
+
+def wilson_interval(counts:np.ndarray, n:int, z:float) -> Tuple[np.ndarray, np.ndarray]:
+    p = counts/n
+    denominator = 1 + z**2/n
+    centre = (p + z**2/(2*n))/denominator
+    half_width = z*np.sqrt(p*(1 - p)/n + z**2/(4*n**2))/denominator
+    return np.clip(centre - half_width, 0, 1), np.clip(centre + half_width, 0, 1)
+
+
+def _is_stable(lower:np.ndarray, upper:np.ndarray, k:int) -> bool:
+    """
+    The top k ranking is stable when the intervals of each of the first k albums
+    are above the interval of the next album.
+    """
+    if len(lower) < k + 1:
+        return False
+    return bool(np.all(lower[:k] > upper[1:k + 1]))
+
+
+def estimate_album_shares(tracks:List[Tuple[str, str]], weights:np.ndarray, resolve:Callable[[List[Tuple[str, str]]], List[str]],
+                          k:int=5, confidence:float=0.95, draws_per_round:int=200, max_lookups:int=None, 
+                          seed:int=235151123) -> AlbumShareEstimate:
+    """
+    Sequentially estimates the album shares of the (artist, track) pairs in tracks.
+    The resolved tracks are counted exactly, the unresolved remainder is estimated:
+    each round draws draws_per_round unresolved tracks with probability proportional to their
+    weight, looks up the albums of the distinct drawn tracks (so each track is looked up at most once)
+    and estimates the remainder's album shares from the fraction of draws in each album, with Wilson
+    intervals Bonferroni corrected over the k comparisons.  The drawn tracks then join the exact part
+    so the intervals shrink as the popular tracks get resolved.
+    Sampling stops once the top k ranking is stable at the chosen confidence, after max_lookups
+    lookups, or when every track is resolved in which case the shares are exact.
+    """
+    n_tracks = len(tracks)
+    weights = np.asarray(weights, dtype=float)
+    total = weights.sum()
+    columns = ["artistName", "albumName", "share", "lower", "upper"]
+    if n_tracks == 0 or total <= 0:
+        return AlbumShareEstimate(pd.DataFrame(columns=columns), 0, 0, True, True)
+    z = NormalDist().inv_cdf(1 - (1 - confidence)/(2*k))
+    rng = np.random.default_rng(seed)
+
+    album_keys = [] # (artist, album) for each album code
+    album_codes = {}
+    track_album = np.full(n_tracks, -1) # -1 for no album
+    unresolved = weights > 0
+    resolved_weight = np.zeros(0) # exact weight of each album from the resolved tracks
+    lookups = draws = 0
+    converged = exact = False
+    while True:
+        remainder = weights[unresolved].sum()
+        if not unresolved.any():
+            share = lower = upper = resolved_weight/total
+            exact = converged = True
+            break
+        candidates = np.flatnonzero(unresolved)
+        cdf = np.cumsum(weights[candidates])/remainder
+        drawn = candidates[np.minimum(np.searchsorted(cdf, rng.random(draws_per_round), side="right"), len(candidates) - 1)]
+        if max_lookups is not None:
+            # shrink the round to the draws before the first track over the budget: a prefix of the
+            # draws is still a random sample, keeping the lowest track indices would not be
+            budget = max(0, max_lookups - lookups)
+            first_draws = np.sort(np.unique(drawn, return_index=True)[1])
+            if len(first_draws) > budget:
+                drawn = drawn[:first_draws[budget]]
+        new = np.unique(drawn)
+        if len(drawn) == 0:
+            break
+        albums = resolve([tracks[i] for i in new])
+        lookups += len(new)
+        for i, album in zip(new, albums):
+            if album is not None:
+                key = (tracks[i][0], album)
+                if key not in album_codes:
+                    album_codes[key] = len(album_keys)
+                    album_keys.append(key)
+                track_album[i] = album_codes[key]
+        draws += len(drawn)
+        resolved_weight = np.pad(resolved_weight, (0, len(album_keys) - len(resolved_weight)))
+
+        # exact part (resolved before this round) plus the estimate of the remainder from this round's draws
+        codes = track_album[drawn]
+        counts = np.bincount(codes[codes >= 0], minlength=len(album_keys))
+        # a zero count album stands in for the albums that have not been drawn yet
+        counts = np.append(counts, 0)
+        draw_lower, draw_upper = wilson_interval(counts, len(drawn), z)
+        exact_part = np.append(resolved_weight, 0)
+        share = (exact_part + remainder*counts/len(drawn))/total
+        lower = (exact_part + remainder*draw_lower)/total
+        upper = (exact_part + remainder*draw_upper)/total
+
+        order = np.argsort(-share, kind="stable")
+        stable = _is_stable(lower[order], upper[order], k)
+        share, lower, upper = share[:-1], lower[:-1], upper[:-1] # drop the stand in
+
+        new_albums = track_album[new]
+        resolved_weight += np.bincount(new_albums[new_albums >= 0], weights=weights[new][new_albums >= 0], minlength=len(album_keys))
+        unresolved[new] = False
+        if stable:
+            converged = True
+            break
+        if max_lookups is not None and lookups >= max_lookups:
+            break
+
+    if len(album_keys) == 0:
+        return AlbumShareEstimate(pd.DataFrame(columns=columns), lookups, draws, converged, exact)
+    shares = pd.DataFrame({
+        "artistName" : [a for a, _ in album_keys],
+        "albumName" : [b for _, b in album_keys],
+        "share" : share,
+        "lower" : lower,
+        "upper" : upper,
+    }, columns=columns)
+    shares = shares.sort_values("share", ascending=False, kind="stable").reset_index(drop=True)
+    return AlbumShareEstimate(shares, lookups, draws, converged, exact)
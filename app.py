@@ -1,24 +1,164 @@
 import os
-import time
 import altair as alt
 import streamlit as st
 import json
 import pandas as pd 
 import numpy as np
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from spotify_unwrapped import SpotifyUnwrapped
+from ingest_cache import IngestCache
+from time_window import TimeWindow
+from artwork_cache import ARTWORK_WIDTH
+from session_memo import StageMemo
+from time_cube import TimeCube, WEEKDAYS
+from instrumentation import metrics, configure_json_logging
 from openai import OpenAI
 
 colours = {
     "artist": alt.value('red'),
     "tracks": alt.value('steelblue'),
     "albums": alt.value('purple'), #"#7D3C98
-    "podcasts": alt.value('chartreuse')
+    "podcasts": alt.value('chartreuse'),
+    "genres": alt.value('#D35400')
 }#, '#F4D03F', '#D35400', '#7D3C98']
 # pd.DataFrame({
 #     'x': range(6),
 #     'color': ['red', 'steelblue', 'chartreuse', '#F4D03F', '#D35400', '#7D3C98']
 # })
 
+def show_timings(summary:dict) -> None:
+    with st.expander("Timings", expanded=True):
+        stages = pd.DataFrame([{"Stage" : k, "Calls" : v["count"], "Seconds" : round(v["seconds"], 3)} for k, v in summary["stages"].items()])
+        st.write("#### Stages")
+        st.dataframe(stages, hide_index=True)
+        endpoints = pd.DataFrame([{"Endpoint" : k, "Requests" : v["count"], "Retries" : v["retries"], "KB" : round(v["bytes"]/1024, 1),
+                                   "p50 (ms)" : v["p50_ms"], "p95 (ms)" : v["p95_ms"], "Statuses" : json.dumps(v["statuses"])} 
+                                  for k, v in summary["endpoints"].items()])
+        st.write("#### Spotify API")
+        st.dataframe(endpoints, hide_index=True)
+        caches = pd.DataFrame([{"Cache" : k, "Hits" : v["hits"], "Misses" : v["misses"], "Hit ratio" : round(v["hit_ratio"], 3)} 
+                               for k, v in summary["caches"].items()])
+        st.write("#### Caches")
+        st.dataframe(caches, hide_index=True)
+
+
+def bar_charts(tables:tuple, label:str, noun:str, colour) -> None:
+    """
+    The top 5 bar charts by streams and by time of a section.
+    """
+    for a, lab in zip(tables, ["Streams", "Time (hours)"]):
+        if lab == "Streams":
+            out = "number of streams"
+        else:
+            out = "total time (hours)"
+        st.write(f"### Your top 5 {noun} by {out} are...")
+        st.write(alt.Chart(a).mark_bar().encode(
+            x=lab,
+            y=alt.Y(label, sort=None), 
+            color=colour
+        ).properties(height=500, width=750))
+
+
+def show_albums(tables:tuple, artwork:dict, confidence:float) -> None:
+    """
+    The top albums, listed first and drawn again with their covers once the artwork is downloaded.
+    """
+    for res, out in zip(tables, ["Streams", "Time (hours)"]):
+        st.write(f"### Your top 5 Albums by {out} are...")
+        found = [row for _, row in res.iterrows() if artwork.get((row['Artist'], row['Album'])) is not None]
+        if len(found) > 0:
+            images = [artwork[(row['Artist'], row['Album'])] for row in found]
+            captions = [f"{row['Artist']} - {row['Album']}" for row in found]
+            st.image(images, caption=captions, width=ARTWORK_WIDTH)
+        else:
+            st.write("\n".join(f"{i + 1}. {row['Artist']} - {row['Album']}" for i, (_, row) in enumerate(res.iterrows())))
+        if "Share lower" in res.columns:
+            intervals = [f"{row['Album']}: {100*row['Share lower']:.1f}% - {100*row['Share upper']:.1f}%" for _, row in res.iterrows()]
+            st.caption(f"Share of your listening ({100*confidence:.0f}% confidence): " + ", ".join(intervals))
+
+
+def show_genres(streams:pd.DataFrame, cum_time:pd.DataFrame, monthly_genres:pd.DataFrame) -> None:
+    bar_charts((streams, cum_time), "Genre", "genres", colours["genres"])
+    if len(monthly_genres) > 0:
+        st.write("### Your top genres month by month")
+        st.write(alt.Chart(monthly_genres).mark_line(point=True).encode(
+            x=alt.X("yearmonth(month):T", title="Month"),
+            y=alt.Y("plays_share:Q", title="Share of streams", axis=alt.Axis(format="%")),
+            color="genre:N"
+        ).properties(height=400, width=750))
+
+
+def load_recommendations(top_artists:pd.DataFrame) -> str:
+    print("Getting the GPT predictions for artists...")
+    top_artists_str = ""
+    for a in top_artists["Artist"]:
+        top_artists_str += a + ", "
+    print(top_artists_str)
+
+    #client = OpenAI()
+    # defaults to getting the key using os.environ.get("OPENAI_API_KEY")
+    # # if you saved the key under a different environment variable name, you can do something like:
+    client = OpenAI(
+      api_key=os.environ.get("OPENAI_API_KEY"),
+    )
+    with metrics.stage("recommendations"):
+        recommender = client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "My top artists are " + top_artists_str + "and I want to listen to more artists like them.  Recommend five more artists."},
+        ]
+        )
+    return recommender.choices[0].message.content
+
+
+def show_recommendations(recs:str) -> None:
+    st.success("### Your recommendations are...\n",)
+    st.success(recs)
+
+
+def show_listening_over_time(cube:TimeCube, top_artists:list) -> None:
+    """
+    The when do you listen charts, all sliced from the precomputed time cube so changing the artist is instant.
+    """
+    st.write("## When do you listen?")
+    streak = cube.longest_streak()
+    if streak is not None:
+        start, end, days = streak
+        st.write(f"Your longest listening streak was {days} days ({start:%d %b %Y} to {end:%d %b %Y}).")
+    artist = st.selectbox("Show the listening of", ["All artists"] + top_artists)
+    entities = None if artist == "All artists" else [artist]
+
+    monthly = cube.rollup(["month"], entities=entities).reset_index()
+    monthly["Time (hours)"] = monthly["minutes"]/60
+    st.write("### Hours per month")
+    st.write(alt.Chart(monthly).mark_line(point=True).encode(
+        x=alt.X("yearmonth(month):T", title="Month"),
+        y="Time (hours)",
+        color=colours["artist"]
+    ).properties(height=300, width=750))
+
+    heatmap = cube.rollup(["weekday", "hour"], entities=entities).reset_index()
+    heatmap["Weekday"] = [WEEKDAYS[d] for d in heatmap["weekday"]]
+    heatmap["Time (hours)"] = heatmap["minutes"]/60
+    st.write("### Hours by weekday and hour of the day")
+    st.write(alt.Chart(heatmap).mark_rect().encode(
+        x=alt.X("hour:O", title="Hour (UTC)"),
+        y=alt.Y("Weekday:N", sort=WEEKDAYS),
+        color=alt.Color("Time (hours):Q", scale=alt.Scale(scheme="greens"))
+    ).properties(height=300, width=750))
+
+    if entities is None:
+        top_monthly = cube.top_k_by_period(1, "month").rename(columns={"entity" : "Artist", "plays" : "Streams"})
+        st.write("### Your top artist each month")
+        st.write(alt.Chart(top_monthly).mark_bar().encode(
+            x=alt.X("yearmonth(month):T", title="Month"),
+            y="Streams",
+            color=alt.Color("Artist:N"),
+            tooltip=["Artist", "Streams"]
+        ).properties(height=300, width=750))
+
+
 def main():
     
     st.title("Unwrapping Spotify's Unwrapped")
@@ -38,140 +178,153 @@ def main():
     )
     st.write('You selected:', option)    
 
+    window_options = {
+        "wrapped" : "Wrapped (January to October)",
+        "year" : "Full calendar year",
+        "custom" : "Custom date range",
+    }
+    window_option = st.selectbox('Which time period would you like?', list(window_options.values()))
+    if window_option == window_options["custom"]:
+        start_date = st.date_input("Start date", date(2023, 1, 1))
+        end_date = st.date_input("End date (inclusive)", date(2023, 12, 31))
+        window = TimeWindow(start_date, pd.Timestamp(end_date) + pd.Timedelta(days=1))
+    else:
+        year = st.number_input("Which year?", min_value=2008, max_value=date.today().year, value=2023)
+        window = TimeWindow.wrapped(year) if window_option == window_options["wrapped"] else TimeWindow.year(year)
+
+    album_modes = {
+        "adaptive" : "Adaptive (look up albums until the top 5 is stable)",
+        "sample" : "Fixed sample rate",
+        "exact" : "Exact (look up every distinct track once)",
+    }
+    album_mode, sample_rate, confidence = "adaptive", 0.01, 0.95
     if option == analysis_options["detailed"]:
-        sample_rate = st.slider('Please select your sample rate.', 0., 0.5, 0.01)
-        st.write(f"Sampling {100*sample_rate}% of input items for the album lookups.")
+        album_mode_option = st.selectbox('How should your top albums be estimated?', list(album_modes.values()))
+        album_mode = [m for m, label in album_modes.items() if label == album_mode_option][0]
+        if album_mode == "sample":
+            sample_rate = st.slider('Please select your sample rate.', 0., 0.5, 0.01)
+            st.write(f"Sampling {100*sample_rate}% of input items for the album lookups.")
+        else:
+            confidence = st.slider('Confidence in the top 5 ranking.', 0.5, 0.99, 0.95)
+            st.write(f"Albums are looked up until the top 5 is stable at {100*confidence:.0f}% confidence.")
 
     # Add a switch (checkbox)
     recommendation_switch = st.checkbox("Do you want artist/song recommendations?")
     st.write("Recommendations will also be provided.  Please be patient with the query.")
+    timings_switch = st.checkbox("Show timings (stage times, API requests and cache hits)")
 
 
     with st.form(key='my_form_to_submit'):
         submit_button = st.form_submit_button(label='Submit')
 
-    if submit_button and uploaded_file is not None:
-        # the main object that we will update with each item
-        unwrapped = SpotifyUnwrapped() # sk_wrap = SketchUnwrapper()
+    # results are memoised per session so that reruns (eg. changing a widget after submitting)
+    # only recompute the stages whose inputs changed
+    memo = StageMemo(st.session_state)
+    if submit_button:
+        st.session_state["submitted"] = True
+
+    if st.session_state.get("submitted") and uploaded_file:
+        # the metrics cover this rerun only, memoised stages do not show up
+        metrics.reset()
+        dataset_key = (tuple(memo.upload_digest(file) for file in uploaded_file), tuple(window.params().items()))
 
-        # stream the data
-        all_dfs = []
-        for file in uploaded_file:
-            #json_data = json.load(file)
-            df = unwrapped.json_batch_update(file)
-            all_dfs.append(df)
+        def load_dataset() -> SpotifyUnwrapped:
+            # the main object that we will update with each item
+            unwrapped = SpotifyUnwrapped(ingest_cache=IngestCache(), window=window) # sk_wrap = SketchUnwrapper()
+            # stream the data
+            all_dfs = []
+            for file in uploaded_file:
+                #json_data = json.load(file)
+                df = unwrapped.json_batch_update(file)
+                all_dfs.append(df)
+            unwrapped.finalise_dataframes(all_dfs)
+            return unwrapped
+
+        with st.spinner('Please wait. Reading your streaming history...'):
+            unwrapped = memo.get("dataset", dataset_key, load_dataset)
     
         # outputs
-        st.write("## Unwrapping your 2023 Spotify Data...")
-        unwrapped.finalise_dataframes(all_dfs)
-        year_top_artist_streams, year_top_artist_time = unwrapped.get_yearly_top_artists()
-        year_top_songs_streams, year_top_songs_time = unwrapped.get_yearly_top_songs()
-        year_top_podcs_streams, year_top_podcs_time = unwrapped.get_yearly_top_podcasts()
-        
-        # artist plots
-        for a, lab in zip([year_top_artist_streams, year_top_artist_time], ["Streams", "Time (hours)"]):
-            if lab == "Streams":
-                out = "number of streams"
-            else:
-                out = "total time (hours)"
-            st.write(f"### Your top 5 artists by {out} are...")
-            st.write(alt.Chart(a).mark_bar().encode(
-                x=lab,
-                y=alt.Y("Artist", sort=None), 
-                color=colours["artist"]
-            ).properties(height=500, width=750))
-
-        # Song summaries and plot
-        for a, lab in zip([year_top_songs_streams, year_top_songs_time], ["Streams", "Time (hours)"]):
-            if lab == "Streams":
-                out = "number of streams"
-            else:
-                out = "total time (hours)"
-            st.write(f"### Your top 5 tracks by {out} are...")
-            st.write(alt.Chart(a).mark_bar().encode(
-                x=lab,
-                y=alt.Y("Track", sort=None),
-                color=colours["tracks"]  
-            ).properties(height=500, width=750))
-
-        # Podcast summaries and plot
-        for a, lab in zip([year_top_podcs_streams, year_top_podcs_time], ["Streams", "Time (hours)"]):
-            if lab == "Streams":
-                out = "number of streams"
-            else:
-                out = "total time (hours)"
-            st.write(f"### Your top 5 podcasts by {out} are...")
-            st.write(alt.Chart(a).mark_bar().encode(
-                x=lab,
-                y=alt.Y("Podcast", sort=None),
-                color=colours["podcasts"]  
-            ).properties(height=500, width=750))
-
-        if option == analysis_options["detailed"]:
-            # Album summaries and plot
-            with st.spinner('Please wait. Calculating your top albums...'):
-                # add a slider in here for the sample rate.
-                time.sleep(5)
-                year_top_artist_streams, year_top_albums_cum_time = unwrapped.get_yearly_top_albums(sample_rate)
-                unwrapped.get_yearly_album_artwork(year_top_artist_streams)
-                unwrapped.get_yearly_album_artwork(year_top_albums_cum_time)
-
-                for res, out in zip([year_top_artist_streams, year_top_albums_cum_time], ["Streams", "Time (hours)"]):
-                    st.write(f"### Your top 5 Albums by {out} are...")
-                    images = [f"album_artwork/{row['Artist']}_{row['Album']}.jpg" for _, row in res.iterrows()]
-                    captions = [f"{row['Artist']} - {row['Album']}" for _, row in res.iterrows()]
-                    st.image(images, caption=captions, width=125)
-                # for _, row in year_top_albums_streams.iterrows():
-                #     st.image(f"album_artwork/{row['Artist']}_{row['Album']}.jpg", caption=f"{row['Artist']} - {row['Album']}") #, use_column_width=True)
-
-            # with st.spinner('Please wait. Calculating your top genres...'):
-            #     time.sleep(5)
-            #     year_top_albums_streams, year_top_albums_cum_time = unwrapped.get_yearly_top_albums(sample_rate=0.01)
-            #     st.write(f"### Your top 5 Albums by {out} are...\n{list(year_top_albums_streams['Album'])}")
-            #     print(year_top_albums_streams)
-            #     print(year_top_albums_cum_time)
-           
-            # for a, lab in zip([year_top_albums_streams, year_top_albums_cum_time], ["Streams", "Time (hours)"]):
-            #     if lab == "Streams":
-            #         out = "number of streams"
-            #     else:
-            #         out = "total time (hours)"
-            #     st.write(f"### Your top 5 albums by {out} are...")
-            #     st.write(alt.Chart(a).mark_bar().encode(
-            #         x=lab,
-            #         y=alt.Y("Album", sort=None),
-            #         color=colours["albums"]  
-            #     ).properties(height=500, width=750))
-
-         
-
-        # to do integrate album and podcasts into the unwrapped app.
-        # album summaries and plot
-
-        if recommendation_switch:
-            print("Getting the GPT predictions for artists...")
-            top_artists_str = ""
-            for a in year_top_artist_streams["Artist"]:
-                top_artists_str += a + ", "
-            print(top_artists_str)
-
-            #client = OpenAI()
-            # defaults to getting the key using os.environ.get("OPENAI_API_KEY")
-            # # if you saved the key under a different environment variable name, you can do something like:
-            client = OpenAI(
-              api_key=os.environ.get("OPENAI_API_KEY"),
-            )
-            with st.spinner('Please wait. Generating recommendations...'):
-                time.sleep(5)
-                recommender = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "My top artists are " + top_artists_str + "and I want to listen to more artists like them.  Recommend five more artists."},
-                ]
-                )
-            recs = recommender.choices[0].message.content
-            st.success("### Your recommendations are...\n",)
-            st.success(recs)
+        st.write(f"## Unwrapping your {window.label} Spotify Data...")
+        detailed = option == analysis_options["detailed"]
+        album_key = (dataset_key, album_mode, sample_rate if album_mode == "sample" else None, 
+                     confidence if album_mode == "adaptive" else None)
+
+        def load_albums() -> tuple:
+            if album_mode == "adaptive":
+                return unwrapped.get_yearly_top_albums(mode="adaptive", confidence=confidence)
+            elif album_mode == "exact":
+                return unwrapped.get_yearly_top_albums(mode="exact")
+            return unwrapped.get_yearly_top_albums(sample_rate)
+
+        def load_genres() -> tuple:
+            streams, cum_time = unwrapped.get_yearly_top_genres()
+            return streams, cum_time, unwrapped.get_monthly_genre_shares(list(streams["Genre"]))
+
+        # every section gets a placeholder in page order and is drawn as soon as its stage is done.
+        # The stages run concurrently.  The listening over time, the artwork and the recommendations
+        # need the result of another stage so they are only submitted once that stage is done,
+        # no worker is held waiting on another stage.
+        sections = ["artists", "songs", "podcasts", "listening"] + (["albums", "genres"] if detailed else []) \
+            + (["recommendations"] if recommendation_switch else [])
+        placeholders = {section : st.empty() for section in sections}
+        for section in sections:
+            placeholders[section].info(f"Please wait. Calculating your {'listening over time' if section == 'listening' else section}...")
+
+        with ThreadPoolExecutor(max_workers=len(sections) + 1, thread_name_prefix="app") as pool:
+            stages = {} # future -> (stage, memo key, section, render)
+            followers = {} # stage -> [(stage, memo key, compute from the stage's result, section, render)]
+            order, pending = [], set()
+            def submit(stage:str, key, compute, section:str, render) -> None:
+                future = memo.submit(stage, key, compute, pool)
+                stages[future] = (stage, key, section, render)
+                order.append(future)
+                pending.add(future)
+
+            def submit_after(after:str, stage:str, key, compute, section:str, render) -> None:
+                followers.setdefault(after, []).append((stage, key, compute, section, render))
+
+            submit("artists", dataset_key, unwrapped.get_yearly_top_artists, "artists",
+                   lambda tables: bar_charts(tables, "Artist", "artists", colours["artist"]))
+            submit_after("artists", "listening", dataset_key, lambda tables: list(tables[0]["Artist"]), "listening",
+                         lambda top_artists: show_listening_over_time(unwrapped.time_cube, top_artists))
+            submit("songs", dataset_key, unwrapped.get_yearly_top_songs, "songs",
+                   lambda tables: bar_charts(tables, "Track", "tracks", colours["tracks"]))
+            submit("podcasts", dataset_key, unwrapped.get_yearly_top_podcasts, "podcasts",
+                   lambda tables: bar_charts(tables, "Podcast", "podcasts", colours["podcasts"]))
+            if detailed:
+                submit("albums", album_key, load_albums, "albums", lambda tables: show_albums(tables, {}, confidence))
+                # one call for both tables so that shared albums are fetched once
+                submit_after("albums", "artwork", album_key,
+                             lambda tables: (tables, unwrapped.get_yearly_album_artwork(pd.concat(tables))), "albums",
+                             lambda result: show_albums(*result, confidence))
+                submit("genres", dataset_key, load_genres, "genres", lambda result: show_genres(*result))
+            if recommendation_switch:
+                submit_after("artists", "recommendations", dataset_key, lambda tables: load_recommendations(tables[0]),
+                             "recommendations", show_recommendations)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # page order when several are done together (eg. the memoised stages)
+                for future in sorted(done, key=order.index):
+                    stage, key, section, render = stages[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"The {stage} stage failed: {e!r}")
+                        placeholders[section].error(f"Sorry, your {stage} could not be calculated.")
+                        for follower, _, _, follower_section, _ in followers.pop(stage, []):
+                            placeholders[follower_section].error(f"Sorry, your {follower} could not be calculated.")
+                        continue
+                    memo.put(stage, key, result)
+                    with placeholders[section].container():
+                        render(result)
+                    for follower, follower_key, compute, follower_section, follower_render in followers.pop(stage, []):
+                        submit(follower, follower_key, lambda compute=compute, result=result: compute(result),
+                               follower_section, follower_render)
+
+        metrics.log_summary()
+        if timings_switch:
+            show_timings(metrics.summary())
 
 
         # else:
@@ -179,6 +332,7 @@ def main():
         
 
 if __name__ == "__main__":
+    configure_json_logging()
     main()
 
 
@@ -0,0 +1,92 @@
+import os
+import hashlib
+import threading
+from typing import Callable, List
+from metadata_cache import DEFAULT_CACHE_DIR, MetadataCache, MISS
+from instrumentation import Metrics, metrics as default_metrics
+
+ARTWORK_WIDTH = 125 # width the app renders the album covers at
+
+
+def select_image(images:List[dict], width:int=ARTWORK_WIDTH) -> dict | None:
+    """
+    The smallest image at least width pixels wide (the largest if none are wide enough).
+    """
+    if len(images) == 0:
+        return None
+    wide_enough = [im for im in images if (im.get("width") or 0) >= width]
+    if len(wide_enough) > 0:
+        return min(wide_enough, key=lambda im: im["width"])
+    return max(images, key=lambda im: im.get("width") or 0)
+
+
+class ArtworkCache:
+    """
+    Content addressed store of the downloaded album artwork.
+    Images are saved as <sha256>.jpg and an index maps each image url to its digest,
+    so an image is downloaded at most once and identical images are stored once.
+    The least recently used images are removed once the store exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir:str=None, max_bytes:int=200*1024**2, metrics:Metrics=None) -> None:
+        self.metrics = default_metrics if metrics is None else metrics
+        self.cache_dir = os.path.join(DEFAULT_CACHE_DIR, "artwork") if cache_dir is None else cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index = MetadataCache(os.path.join(self.cache_dir, "index.sqlite"), ttl=365*24*3600)
+        self._lock = threading.Lock()
+
+    def _path(self, digest:str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.jpg")
+
+    def get(self, url:str) -> str | None:
+        digest = self.index.get("image_url", url)
+        if digest is MISS or digest is None:
+            return None
+        path = self._path(digest)
+        if not os.path.exists(path):
+            return None # evicted
+        os.utime(path)
+        return path
+
+    def put(self, url:str, content:bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        self.index.set("image_url", url, digest)
+        self._evict(keep=path)
+        return path
+
+    def fetch(self, url:str, download:Callable[[str], bytes | None]) -> str | None:
+        """
+        Path of the image at url, calling download(url) only if it is not already stored.
+        """
+        path = self.get(url)
+        self.metrics.record_cache("artwork", path is not None)
+        if path is not None:
+            return path
+        content = download(url)
+        if content is None:
+            return None
+        return self.put(url, content)
+
+    def _evict(self, keep:str) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".jpg"):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path = os.path.join(self.cache_dir, name)
+                if path == keep:
+                    continue
+                os.remove(path)
+                total -= size
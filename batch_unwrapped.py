@@ -0,0 +1,230 @@
+"""
+Headless batch Unwrapped for a directory of exports, one per user.
+
+    python batch_unwrapped.py exports/ results/ --year 2023 --albums --genres --artwork --workers 8
+
+Each entry of the input directory is a user: either a directory holding that user's streaming
+history files or a single json file.  The exports are ingested and aggregated in a process pool,
+then the Spotify lookups of every user are deduplicated (each distinct track and artist is looked
+up once for the whole batch, through one client and its metadata cache) and each user gets
+results/<user>/top_k.json and/or one Parquet file per table, plus the aggregate state that
+SpotifyUnwrapped.append_update can extend later.  results/batch_summary.json has the counts,
+failures and timings.
+"""
+import os
+import sys
+import json
+import fnmatch
+import argparse
+import warnings
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+from aggregate_state import AggregateState
+from genre_matrix import GenreMatrix
+from ingest_cache import IngestCache
+from instrumentation import metrics
+from spotify_client import SpotifyClient
+from spotify_unwrapped import SpotifyUnwrapped, artist_ids_from_uris
+from time_window import TimeWindow
+
+HISTORY_PATTERNS = ("StreamingHistory*.json", "Streaming_History_Audio_*.json", "endsong*.json")
+TOP_K = {"artist" : 5, "song" : 10, "podcast" : 5, "album" : 5, "genre" : 5} # as in SpotifyUnwrapped
+
+
+def discover_users(input_dir:str) -> Dict[str, List[str]]:
+    """
+    {user : history files} for the entries of input_dir.  In a user directory the streaming
+    history files are picked out by name (an export also has eg. Userdata.json), falling back
+    to every json file if none match.
+    """
+    users = {}
+    for name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, name)
+        if os.path.isdir(path):
+            files = sorted(f for f in os.listdir(path) if f.endswith(".json"))
+            history = [f for f in files if any(fnmatch.fnmatch(f, p) for p in HISTORY_PATTERNS)]
+            if len(files) > 0:
+                users[name] = [os.path.join(path, f) for f in (history or files)]
+        elif name.endswith(".json"):
+            users[name[:-len(".json")]] = [path]
+    return users
+
+
+def aggregate_user(user:str, files:List[str], window:TimeWindow, state_path:str,
+                   ingest_cache_dir:str=None) -> Tuple[str, AggregateState, dict]:
+    """
+    The pool task: ingests one user's files into an AggregateState.
+    Also returns the {(artist, track) : track id} of the extended history for the album lookups.
+    No Spotify client is created in the workers.
+    """
+    ingest_cache = IngestCache(ingest_cache_dir) if ingest_cache_dir is not None else None
+    unwrapped = SpotifyUnwrapped(ingest_cache=ingest_cache, window=window)
+    dfs = [unwrapped.json_batch_update(fname, streaming=True) for fname in files]
+    state = AggregateState(state_path, window)
+    state.append(dfs)
+    uris = {}
+    for df in dfs:
+        if "trackUri" in df.columns:
+            known = df[df["trackUri"].notna()]
+            uris.update(zip(zip(known["artistName"], known["trackName"]), known["trackUri"]))
+    return user, state, uris
+
+
+def resolve_albums(client, tracks:List[Tuple[str, str]], uris:dict) -> dict:
+    """
+    {(artist, track) : album} for the distinct tracks of the whole batch, batched by id where
+    the history has the track ids and searched otherwise.
+    """
+    with_uri = [t for t in tracks if t in uris]
+    fetched = client.get_tracks([uris[t] for t in with_uri]) if with_uri else {}
+    albums = {t : None if fetched.get(uris[t]) is None else fetched[uris[t]]["album"] for t in with_uri}
+    searched = [t for t in tracks if t not in uris]
+    albums.update(zip(searched, client.get_albums_for_tracks(searched) if searched else []))
+    return albums
+
+
+def user_tables(state:AggregateState, albums:bool, genre_matrix:GenreMatrix=None) -> Dict[str, pd.DataFrame]:
+    tables = {}
+    kinds = ["artist", "song", "podcast"] + (["album"] if albums else [])
+    for kind in kinds:
+        tables[f"{kind}s_streams"], tables[f"{kind}s_time"] = state.get_top_k(kind, TOP_K[kind])
+    if genre_matrix is not None:
+        artist_agg = state.songs.groupby(level="artistName", sort=True).sum()
+        tables["genres_streams"], tables["genres_time"] = genre_matrix.top_k(artist_agg, TOP_K["genre"])
+    return tables
+
+
+def top_albums(tables:Dict[str, pd.DataFrame]) -> List[Tuple[str, str]]:
+    """
+    The distinct (artist, album) of a user's top album tables.
+    """
+    pairs = [pair for name in ("albums_streams", "albums_time") if name in tables
+             for pair in tables[name][["Artist", "Album"]].itertuples(index=False, name=None)]
+    return list(dict.fromkeys(pairs))
+
+
+def write_user(output_dir:str, user:str, tables:Dict[str, pd.DataFrame], artwork:List[dict], summary:dict, fmt:str) -> None:
+    user_dir = os.path.join(output_dir, user)
+    os.makedirs(user_dir, exist_ok=True)
+    if fmt in ("json", "both"):
+        out = {**summary, "tables" : {name : json.loads(t.to_json(orient="records")) for name, t in tables.items()}, "artwork" : artwork}
+        with open(os.path.join(user_dir, "top_k.json"), "w") as f:
+            json.dump(out, f, indent=2)
+    if fmt in ("parquet", "both"):
+        for name, table in tables.items():
+            pq.write_table(pa.Table.from_pandas(table, preserve_index=False), os.path.join(user_dir, f"{name}.parquet"))
+
+
+def run_batch(input_dir:str, output_dir:str, window:TimeWindow=None, workers:int=None, albums:bool=False, genres:bool=False,
+              artwork:bool=False, fmt:str="both", ingest_cache_dir:str=None, client=None) -> dict:
+    """
+    Runs the batch and returns the summary that is also saved as batch_summary.json.
+    client is the SpotifyClient used for the lookups (the default client if None).
+    A user whose files fail to ingest is reported in "failed" rather than stopping the batch.
+    artwork implies albums.
+    """
+    assert fmt in ("json", "parquet", "both"), f"Unknown format {fmt}."
+    albums = albums or artwork
+    window = TimeWindow.wrapped(2023) if window is None else window
+    users = discover_users(input_dir)
+    metrics.reset()
+    states, uris, failed = {}, {}, {}
+    with metrics.stage("batch_ingest"), ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(aggregate_user, user, files, window, os.path.join(output_dir, user, "state"), ingest_cache_dir) : user
+                   for user, files in users.items()}
+        for future in as_completed(futures):
+            try:
+                user, state, user_uris = future.result()
+            except Exception as e:
+                failed[futures[future]] = repr(e)
+                warnings.warn(f"Failed to ingest {futures[future]}: {e!r}")
+                continue
+            states[user] = state
+            uris.update(user_uris)
+    states = dict(sorted(states.items()))
+
+    # every user's lookups are pooled so each distinct track/artist is looked up once
+    lookups = {"tracks" : 0, "unique_tracks" : 0, "artists" : 0, "unique_artists" : 0}
+    if (albums or genres) and client is None:
+        client = SpotifyClient()
+    if albums:
+        with metrics.stage("batch_albums"):
+            tracks = [state.unresolved_tracks() for state in states.values()]
+            unique_tracks = list(dict.fromkeys(t for user_tracks in tracks for t in user_tracks))
+            lookups["tracks"], lookups["unique_tracks"] = sum(map(len, tracks)), len(unique_tracks)
+            track_albums = resolve_albums(client, unique_tracks, uris)
+            for state in states.values():
+                state.albums.update({t : track_albums[t] for t in state.unresolved_tracks()})
+    genre_matrix = None
+    if genres:
+        with metrics.stage("batch_genres"):
+            artists = [state.unresolved_artists() for state in states.values()]
+            unique_artists = list(dict.fromkeys(a for user_artists in artists for a in user_artists))
+            lookups["artists"], lookups["unique_artists"] = sum(map(len, artists)), len(unique_artists)
+            # the artists with a track id in an extended history are fetched by id rather than searched
+            known_ids = artist_ids_from_uris(client, unique_artists, uris) if unique_artists else {}
+            resp = client.get_genres_from_artist_list(unique_artists, batched=True, known_ids=known_ids) if unique_artists else {}
+            artist_genres = {artist : resp[artist]["genres"] for artist in unique_artists}
+            for state in states.values():
+                state.genres.update({a : artist_genres[a] for a in state.unresolved_artists()})
+            genre_matrix = GenreMatrix.from_genres({a : g for state in states.values() for a, g in state.genres.items()})
+
+    tables = {user : user_tables(state, albums, genre_matrix) for user, state in states.items()}
+    covers = {}
+    if artwork:
+        with metrics.stage("batch_artwork"):
+            pairs = list(dict.fromkeys(pair for t in tables.values() for pair in top_albums(t)))
+            covers = client.get_album_artwork(pairs) if pairs else {}
+
+    with metrics.stage("batch_write"):
+        for user, state in states.items():
+            user_artwork = [{"artist" : a, "album" : b, "path" : covers.get((a, b))} for a, b in top_albums(tables[user])] if artwork else []
+            summary = {"user" : user, "window" : window.params(), "files" : users[user],
+                       "song_plays" : int(state.songs["plays"].sum()), "podcast_plays" : int(state.podcasts["plays"].sum())}
+            write_user(output_dir, user, tables[user], user_artwork, summary, fmt)
+            state.save()
+
+    summary = {"users" : len(users), "succeeded" : len(states), "failed" : failed, "window" : window.params(),
+               "lookups" : lookups, "metrics" : metrics.summary()}
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "batch_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv:List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Run Unwrapped for every export in a directory.")
+    parser.add_argument("input_dir", help="one sub-directory (or json file) per user")
+    parser.add_argument("output_dir")
+    parser.add_argument("--year", type=int, default=2023)
+    parser.add_argument("--window", choices=["wrapped", "year", "all"], default="wrapped",
+                        help="Wrapped window (January to October), full calendar year, or all time")
+    parser.add_argument("--workers", type=int, default=None, help="ingest processes (default: the number of cores)")
+    parser.add_argument("--albums", action="store_true", help="look up the albums for the top albums")
+    parser.add_argument("--genres", action="store_true", help="look up the genres for the top genres")
+    parser.add_argument("--artwork", action="store_true", help="download the artwork of the top albums (implies --albums)")
+    parser.add_argument("--format", choices=["json", "parquet", "both"], default="both")
+    parser.add_argument("--ingest-cache", default=None, help="directory of the Parquet ingest cache")
+    args = parser.parse_args(argv)
+
+    if args.window == "wrapped":
+        window = TimeWindow.wrapped(args.year)
+    elif args.window == "year":
+        window = TimeWindow.year(args.year)
+    else:
+        window = TimeWindow.all_time()
+    summary = run_batch(args.input_dir, args.output_dir, window, args.workers, args.albums, args.genres, args.artwork,
+                        args.format, args.ingest_cache)
+    for name, stage in summary["metrics"]["stages"].items():
+        print(f"{name:<15} {stage['seconds']:8.2f}s")
+    lookups = summary["lookups"]
+    print(f"{summary['succeeded']}/{summary['users']} users, {lookups['unique_tracks']}/{lookups['tracks']} track and "
+          f"{lookups['unique_artists']}/{lookups['artists']} artist lookups after deduplication")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
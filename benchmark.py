@@ -0,0 +1,177 @@
+"""
+Benchmarks of the analytics pipeline on synthetic histories (see synthetic_history.py).
+
+    python benchmark.py --sizes 10000 100000 1000000 --output benchmark_results.json
+    python benchmark.py --sizes 10000 --baseline benchmark_results.json
+
+Every stage is timed (best of --repeats) and then run once more under tracemalloc for its peak
+memory.  Results are saved as json, and with --baseline the run is compared against an earlier
+results file, exiting with 1 if any stage is slower than --tolerance times the baseline.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import Callable, List
+from spotify_unwrapped import SpotifyUnwrapped
+from synthetic_history import write_history, synthetic_albums, synthetic_album, synthetic_track
+from time_window import TimeWindow
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+class SyntheticClient:
+    """
+    Offline stand in for SpotifyClient resolving the synthetic albums, so the album stages
+    measure the pipeline rather than the network.
+    """
+
+    def get_albums_for_tracks(self, pairs:list) -> list:
+        return synthetic_albums(pairs)
+
+    def get_album_from_song_list(self, pairs:list, sample_rate:float=0.1) -> list:
+        rng = np.random.default_rng(235151123)
+        sampled = rng.random(len(pairs)) < sample_rate
+        return [synthetic_album(a, t) if s else None for (a, t), s in zip(pairs, sampled)]
+
+    def get_tracks(self, track_ids:list) -> dict:
+        tracks = {}
+        for track_id in dict.fromkeys(track_ids):
+            artist, track = synthetic_track(track_id)
+            tracks[track_id] = {"album" : synthetic_album(artist, track), "artists" : [artist], "artist_ids" : [artist]}
+        return tracks
+
+
+def measure(fn:Callable, repeats:int=1, memory:bool=True) -> dict:
+    """
+    Best wall time of repeats calls of fn and the peak traced memory of one more call.
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    result = {"seconds" : min(seconds)}
+    if memory:
+        tracemalloc.start()
+        fn()
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1]/1024**2
+        tracemalloc.stop()
+    return result
+
+
+def benchmark_size(n_rows:int, repeats:int=1, memory:bool=True, seed:int=0, workdir:str=None) -> List[dict]:
+    """
+    Runs every stage on a synthetic history of n_rows plays.
+    """
+    window = TimeWindow.year(2023)
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        fname = os.path.join(tmp, "StreamingHistory0.json")
+        file_bytes = write_history(fname, n_rows, seed=seed)
+        unwrapped = SpotifyUnwrapped(spotify_client=SyntheticClient(), window=window)
+        df = unwrapped.json_batch_update(fname)
+        # the same plays in the extended format, whose track ids take the albums through get_tracks
+        extended_fname = os.path.join(tmp, "Streaming_History_Audio_2023.json")
+        write_history(extended_fname, n_rows, extended=True, seed=seed)
+        extended = SpotifyUnwrapped(spotify_client=SyntheticClient(), window=window)
+        extended_df = extended.json_batch_update(extended_fname)
+
+        def finalise():
+            unwrapped.finalise_dataframes([df])
+
+        def finalise_extended():
+            extended.finalise_dataframes([extended_df])
+
+        stages = [
+            ("json_batch_update", lambda: unwrapped.json_batch_update(fname)),
+            ("json_batch_update_streaming", lambda: unwrapped.json_batch_update(fname, streaming=True)),
+            ("json_batch_update_extended", lambda: extended.json_batch_update(extended_fname)),
+            ("json_batch_update_extended_streaming", lambda: extended.json_batch_update(extended_fname, streaming=True)),
+            ("finalise_dataframes", finalise),
+            ("get_yearly_top_artists", unwrapped.get_yearly_top_artists),
+            ("get_yearly_top_songs", unwrapped.get_yearly_top_songs),
+            ("get_yearly_top_podcasts", unwrapped.get_yearly_top_podcasts),
+            ("get_yearly_top_albums_sample", lambda: unwrapped.get_yearly_top_albums(0.01)),
+            ("get_yearly_top_albums_exact", lambda: unwrapped.get_yearly_top_albums(mode="exact")),
+            ("get_yearly_top_albums_adaptive", lambda: unwrapped.get_yearly_top_albums(mode="adaptive")),
+            ("finalise_dataframes_extended", finalise_extended),
+            ("get_yearly_top_albums_exact_extended", lambda: extended.get_yearly_top_albums(mode="exact")),
+            ("get_yearly_top_albums_adaptive_extended", lambda: extended.get_yearly_top_albums(mode="adaptive")),
+        ]
+        for stage, fn in stages:
+            result = {"stage" : stage, "rows" : n_rows, "kept_rows" : len(df), "file_bytes" : file_bytes}
+            result.update(measure(fn, repeats, memory))
+            results.append(result)
+            print(f"{n_rows:>10} {stage:<40} {result['seconds']:9.3f}s" + (f" {result['peak_mb']:9.1f}MB" if memory else ""))
+    return results
+
+
+def run_benchmarks(sizes:List[int]=None, repeats:int=1, memory:bool=True, seed:int=0, workdir:str=None) -> dict:
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    results = []
+    for n_rows in sizes:
+        results.extend(benchmark_size(n_rows, repeats, memory, seed, workdir))
+    return {
+        "meta" : {
+            "time" : pd.Timestamp.now().isoformat(),
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "pandas" : pd.__version__,
+            "numpy" : np.__version__,
+            "repeats" : repeats,
+            "seed" : seed,
+        },
+        "results" : results,
+    }
+
+
+def compare(results:dict, baseline:dict, tolerance:float=1.5) -> List[dict]:
+    """
+    The stages (matched on stage and rows) that are more than tolerance times slower than the baseline.
+    """
+    base = {(r["stage"], r["rows"]) : r for r in baseline["results"]}
+    regressions = []
+    for r in results["results"]:
+        b = base.get((r["stage"], r["rows"]))
+        if b is None or b["seconds"] <= 0:
+            continue
+        ratio = r["seconds"]/b["seconds"]
+        if ratio > tolerance:
+            regressions.append({"stage" : r["stage"], "rows" : r["rows"], "seconds" : r["seconds"], 
+                                "baseline_seconds" : b["seconds"], "ratio" : ratio})
+    return regressions
+
+
+def main(argv:List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the analytics pipeline on synthetic histories.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="history sizes (rows)")
+    parser.add_argument("--repeats", type=int, default=1, help="timed runs per stage, the best is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of each stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="slowdown ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeats, not args.no_memory, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved the results to {args.output}")
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for r in regressions:
+        print(f"Regression: {r['stage']} ({r['rows']} rows) {r['seconds']:.3f}s vs {r['baseline_seconds']:.3f}s ({r['ratio']:.2f}x)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from typing import Iterable, List, Tuple
+from metadata_cache import DEFAULT_CACHE_DIR, normalise_key
+try:
+    from rapidfuzz import fuzz as rapidfuzz_fuzz
+    from rapidfuzz.process import cdist, cpdist
+except ImportError: # fall back to scoring pairs one at a time
+    cdist = cpdist = None
+from thefuzz import fuzz
+
+
+def match_scores(queries:List[str], candidates:List[str]) -> np.ndarray:
+    """
+    fuzz.ratio of every query against every candidate as a len(queries) x len(candidates) matrix,
+    rounded like thefuzz so that the argmax agrees with the per pair loop.
+    """
+    if len(queries) == 0 or len(candidates) == 0:
+        return np.zeros((len(queries), len(candidates)), dtype=int)
+    if cdist is None:
+        return np.array([[fuzz.ratio(q, c) for c in candidates] for q in queries], dtype=int)
+    return np.round(cdist(queries, candidates, scorer=rapidfuzz_fuzz.ratio, dtype=np.float64)).astype(int)
+
+
+def pair_scores(queries:List[str], candidates:List[str]) -> np.ndarray:
+    """
+    fuzz.ratio of each query against the candidate at the same position, rounded like thefuzz.
+    """
+    if len(queries) == 0:
+        return np.zeros(0, dtype=int)
+    if cpdist is None:
+        return np.array([fuzz.ratio(q, c) for q, c in zip(queries, candidates)], dtype=int)
+    return np.round(cpdist(queries, candidates, scorer=rapidfuzz_fuzz.ratio, dtype=np.float64)).astype(int)
+
+
+def best_matches(queries:List[str], candidate_lists:List[List[str]]) -> List[int | None]:
+    """
+    For each query the index of its best scoring candidate in its own candidate list (None if the list is empty).
+    The candidate lists are concatenated and each candidate is scored against its own query only,
+    in one call, then the first best of each list is picked from its slice.
+    """
+    lengths = [len(candidates) for candidates in candidate_lists]
+    flat = [c for candidates in candidate_lists for c in candidates]
+    owners = [q for q, n in zip(queries, lengths) for _ in range(n)]
+    scores = pair_scores(owners, flat)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+    return [None if n == 0 else int(scores[offsets[i]:offsets[i + 1]].argmax()) for i, n in enumerate(lengths)]
+
+
+class EntityIndex:
+    """
+    Local index from normalised artist/album/track names to Spotify ids built up from the
+    API responses and persisted in SQLite, so names resolved in an earlier run need no request.
+    The whole index is held in a dict for fast lookups.
+    Albums and tracks are scoped by their artist id as their names are not unique.
+    The first id recorded for a name is kept.
+    """
+
+    def __init__(self, path:str=None) -> None:
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, "entities.sqlite")
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS entities (
+                    kind TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    PRIMARY KEY (kind, scope, key)
+                )"""
+            )
+            rows = self._conn.execute("SELECT kind, scope, key, name, id FROM entities").fetchall()
+        self._entries = {(kind, scope, key) : (name, entity_id) for kind, scope, key, name, entity_id in rows}
+
+    def get(self, kind:str, name:str, scope:str="") -> Tuple[str, str] | None:
+        """
+        (canonical name, id) for name or None if it has not been resolved before.
+        """
+        return self._entries.get((kind, scope, normalise_key(name)))
+
+    def add(self, kind:str, entries:Iterable[Tuple[str, str, str]], scope:str="") -> None:
+        """
+        Record (query name, canonical name, id) entries, keeping any existing entry for a name.
+        """
+        new = []
+        with self._lock:
+            for query, name, entity_id in entries:
+                if name is None or entity_id is None:
+                    continue
+                key = (kind, scope, normalise_key(query))
+                if key not in self._entries:
+                    self._entries[key] = (name, entity_id)
+                    new.append((kind, scope, key[2], name, entity_id))
+            if new:
+                with self._conn:
+                    self._conn.executemany("INSERT OR IGNORE INTO entities VALUES (?, ?, ?, ?, ?)", new)
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entities")
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,288 @@
+import re
+import json
+import time
+import random
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from typing import List
+from synthetic_history import TRACKS_PER_ALBUM, zipf_probabilities
+
+IMAGE_SIZES = (640, 300, 64) # the sizes Spotify serves album art in, largest first
+ERROR_STATUSES = (500, 502, 503)
+
+
+class Catalog:
+    """
+    Fixture catalog for the fake server: a list of artists, each with genres, a popularity and
+    albums of tracks ({"id", "name", "genres", "popularity", "albums" : [{"id", "name", "tracks" : [{"id", "name"}]}]}).
+    """
+
+    def __init__(self, artists:List[dict]) -> None:
+        self.artists = artists
+        self.artist_by_id = {a["id"] : a for a in artists}
+        self.album_by_id = {}
+        self.track_by_id = {}
+        self.track_by_names = {}
+        for artist in artists:
+            for album in artist["albums"]:
+                self.album_by_id[album["id"]] = (artist, album)
+                for track in album["tracks"]:
+                    self.track_by_id[track["id"]] = (artist, album, track)
+                    self.track_by_names.setdefault((artist["name"].lower(), track["name"].lower()), track["id"])
+        # search results are ranked by popularity like Spotify's
+        self._by_popularity = sorted(artists, key=lambda a: -a["popularity"])
+
+    @classmethod
+    def synthetic(cls, n_artists:int=1000, tracks_per_artist:int=50, n_genres:int=40, seed:int=0) -> "Catalog":
+        """
+        Catalog matching the names of synthetic_history ("Artist i", "Artist i - Track j" on "Artist i - Album k"),
+        with the ids of the tracks matching its trackUri.
+        """
+        rng = random.Random(seed)
+        popularity = zipf_probabilities(n_artists, 1.1)
+        artists = []
+        for i in range(n_artists):
+            albums = []
+            for k in range(-(-tracks_per_artist//TRACKS_PER_ALBUM)):
+                tracks = [{"id" : f"synthetic{i*tracks_per_artist + j}", "name" : f"Artist {i} - Track {j}"} 
+                          for j in range(k*TRACKS_PER_ALBUM, min((k + 1)*TRACKS_PER_ALBUM, tracks_per_artist))]
+                albums.append({"id" : f"album{i}x{k}", "name" : f"Artist {i} - Album {k}", "tracks" : tracks})
+            artists.append({
+                "id" : f"artist{i}",
+                "name" : f"Artist {i}",
+                "genres" : [f"genre {g}" for g in rng.sample(range(n_genres), rng.randint(0, 3))],
+                "popularity" : float(popularity[i]),
+                "albums" : albums,
+            })
+        return cls(artists)
+
+    @classmethod
+    def from_json(cls, fname:str) -> "Catalog":
+        with open(fname) as f:
+            return cls(json.load(f))
+
+    def to_json(self, fname:str) -> None:
+        with open(fname, "w") as f:
+            json.dump(self.artists, f)
+
+    def search_artists(self, query:str, limit:int) -> List[dict]:
+        query = query.lower().strip()
+        exact = [a for a in self._by_popularity if a["name"].lower() == query]
+        partial = [a for a in self._by_popularity if query in a["name"].lower() and a["name"].lower() != query]
+        return (exact + partial)[:limit]
+
+
+class FakeSpotifyServer:
+    """
+    Local stand in for the Spotify endpoints used by SpotifyClient, serving a Catalog:
+    /api/token, /v1/search (artists and tracks), /v1/artists, /v1/artists/{id}, /v1/artists/{id}/albums,
+    /v1/artists/{id}/top-tracks, /v1/tracks and the album images.
+    Faults can be injected for load testing:
+    - latency (+ uniform jitter) seconds per request
+    - rate requests per second (burst capacity) above which it answers 429 with Retry-After: retry_after
+    - error_rate fraction of requests answered with a 5xx
+    stats counts the requests per endpoint and status.
+
+        with FakeSpotifyServer(latency=0.05, rate=50.) as server:
+            client = SpotifyClient(base_url=server.url, accounts_url=server.url)
+    """
+
+    def __init__(self, catalog:Catalog=None, latency:float=0., jitter:float=0., rate:float=None, burst:float=None, 
+                 retry_after:float=1., error_rate:float=0., token_ttl:int=3600, seed:int=0, 
+                 host:str="127.0.0.1", port:int=0) -> None:
+        self.catalog = Catalog.synthetic() if catalog is None else catalog
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = set()
+        self._bucket_tokens = burst if burst is not None else rate
+        self._bucket_updated = time.monotonic()
+        self.stats = {"requests" : 0, "endpoints" : {}, "statuses" : {}, "bytes" : 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeSpotifyServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeSpotifyServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def revoke_tokens(self) -> None:
+        """
+        Every issued token is rejected from now on, as when a token is revoked before it expires.
+        """
+        with self._lock:
+            self._tokens.clear()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {"requests" : 0, "endpoints" : {}, "statuses" : {}, "bytes" : 0}
+
+    def _record(self, endpoint:str, status:int, n_bytes:int) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+            self.stats["statuses"][str(status)] = self.stats["statuses"].get(str(status), 0) + 1
+            self.stats["bytes"] += n_bytes
+
+    def _rate_limited(self) -> bool:
+        if self.rate is None:
+            return False
+        capacity = self.burst if self.burst is not None else self.rate
+        with self._lock:
+            now = time.monotonic()
+            self._bucket_tokens = min(capacity, self._bucket_tokens + (now - self._bucket_updated)*self.rate)
+            self._bucket_updated = now
+            if self._bucket_tokens >= 1:
+                self._bucket_tokens -= 1
+                return False
+            return True
+
+    def _fault(self) -> tuple | None:
+        """
+        The injected (status, headers) for this request, if any.
+        """
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.jitter) if self.latency or self.jitter else 0.
+            error = self.error_rate > 0 and self._rng.random() < self.error_rate
+            status = self._rng.choice(ERROR_STATUSES) if error else None
+        if delay > 0:
+            time.sleep(delay)
+        if self._rate_limited():
+            return 429, {"Retry-After" : str(self.retry_after)}
+        if status is not None:
+            return status, {}
+        return None
+
+    # response objects in the shape of the Spotify api
+    def _image_url(self, album_id:str, size:int) -> str:
+        return f"{self.url}/image/{album_id}/{size}"
+
+    def _artist_json(self, artist:dict) -> dict:
+        return {"id" : artist["id"], "name" : artist["name"], "genres" : artist["genres"], "type" : "artist",
+                "popularity" : int(100*artist["popularity"]), "uri" : f"spotify:artist:{artist['id']}"}
+
+    def _album_json(self, artist:dict, album:dict) -> dict:
+        images = [{"url" : self._image_url(album["id"], size), "width" : size, "height" : size} for size in IMAGE_SIZES]
+        return {"id" : album["id"], "name" : album["name"], "images" : images, "type" : "album",
+                "artists" : [{"id" : artist["id"], "name" : artist["name"]}]}
+
+    def _track_json(self, artist:dict, album:dict, track:dict) -> dict:
+        return {"id" : track["id"], "name" : track["name"], "type" : "track", "uri" : f"spotify:track:{track['id']}",
+                "album" : self._album_json(artist, album), "artists" : [{"id" : artist["id"], "name" : artist["name"]}]}
+
+    def _route(self, method:str, path:str, query:dict, headers:dict) -> tuple:
+        """
+        Returns (endpoint, status, payload) where payload is json serialisable or bytes.
+        """
+        if method == "POST" and path == "/api/token":
+            token = secrets.token_hex(16)
+            with self._lock:
+                self._tokens.add(token)
+            return "token", 200, {"access_token" : token, "token_type" : "Bearer", "expires_in" : self.token_ttl}
+        match = re.fullmatch(r"/image/([^/]+)/(\d+)", path)
+        if method == "GET" and match:
+            if match.group(1) not in self.catalog.album_by_id:
+                return "image", 404, {"error" : "not found"}
+            return "image", 200, f"JPEG {match.group(1)} {match.group(2)}".encode("utf-8")
+        if not path.startswith("/v1/") or method != "GET":
+            return "unknown", 404, {"error" : {"status" : 404, "message" : "Service not found"}}
+        if headers.get("Authorization", "")[len("Bearer "):] not in self._tokens:
+            return "unauthorized", 401, {"error" : {"status" : 401, "message" : "Invalid access token"}}
+
+        catalog = self.catalog
+        if path == "/v1/search":
+            q = query.get("q", "")
+            limit = int(query.get("limit", 10))
+            if query.get("type") == "track":
+                match = re.fullmatch(r"track:(.*) artist:(.*)", q)
+                track_id = None if match is None else catalog.track_by_names.get((match.group(2).lower(), match.group(1).lower()))
+                items = [] if track_id is None else [self._track_json(*catalog.track_by_id[track_id])]
+                return "search", 200, {"tracks" : {"items" : items}}
+            return "search", 200, {"artists" : {"items" : [self._artist_json(a) for a in catalog.search_artists(q, limit)]}}
+        if path == "/v1/artists":
+            ids = query.get("ids", "").split(",")
+            artists = [self._artist_json(catalog.artist_by_id[i]) if i in catalog.artist_by_id else None for i in ids]
+            return "artists", 200, {"artists" : artists}
+        if path == "/v1/tracks":
+            ids = query.get("ids", "").split(",")
+            tracks = [self._track_json(*catalog.track_by_id[i]) if i in catalog.track_by_id else None for i in ids]
+            return "tracks", 200, {"tracks" : tracks}
+        match = re.fullmatch(r"/v1/artists/([^/]+)(/albums|/top-tracks)?", path)
+        if match is None:
+            return "unknown", 404, {"error" : {"status" : 404, "message" : "Service not found"}}
+        artist = catalog.artist_by_id.get(match.group(1))
+        endpoint = "artist" + (match.group(2) or "").replace("/", "_")
+        if artist is None:
+            return endpoint, 400, {"error" : {"status" : 400, "message" : "invalid id"}}
+        if match.group(2) == "/albums":
+            limit = int(query.get("limit", 20))
+            return endpoint, 200, {"items" : [self._album_json(artist, album) for album in artist["albums"][:limit]]}
+        if match.group(2) == "/top-tracks":
+            tracks = [(album, track) for album in artist["albums"] for track in album["tracks"]][:10]
+            return endpoint, 200, {"tracks" : [self._track_json(artist, album, track) for album, track in tracks]}
+        return endpoint, 200, self._artist_json(artist)
+
+    def _handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive so the client's connection pool is exercised
+
+            def _serve(self, method:str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                parsed = urlparse(self.path)
+                query = {k : v[0] for k, v in parse_qs(parsed.query).items()}
+                fault = server._fault()
+                if fault is not None:
+                    status, headers = fault
+                    endpoint, payload = "fault", {"error" : {"status" : status, "message" : "injected"}}
+                else:
+                    endpoint, status, payload = server._route(method, parsed.path, query, dict(self.headers))
+                    headers = {}
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                # recorded before replying so the stats are complete once the client has its response
+                server._record(endpoint, status, len(body))
+                self.send_response(status)
+                self.send_header("Content-Type", "image/jpeg" if isinstance(payload, bytes) else "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                self._serve("GET")
+
+            def do_POST(self) -> None:
+                self._serve("POST")
+
+            def log_message(self, format:str, *args) -> None:
+                pass # no per request logging
+
+        return Handler
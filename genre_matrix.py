@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from typing import Dict, List, Tuple
+from aggregation import top_k_from_aggregates
+
+
+class GenreMatrix:
+    """
+    Sparse artist x genre incidence matrix (1 where the artist is tagged with the genre).
+    The genre totals of any per-artist aggregates are one sparse product A.T @ W,
+    so the plays never carry a list of genres and are never exploded per genre.
+    An artist counts towards every one of its genres, so the genre totals add up to more
+    than the total plays when artists have several genres.
+    """
+
+    def __init__(self, artists:List[str], genres:List[str], incidence:sp.csr_matrix) -> None:
+        assert incidence.shape == (len(artists), len(genres)), "Incidence matrix does not match the artists and genres."
+        self.artists = pd.Index(artists, dtype=object)
+        self.genres = pd.Index(genres, dtype=object, name="genre")
+        self.incidence = incidence
+
+    @classmethod
+    def from_genres(cls, artist_genres:Dict[str, List[str]]) -> "GenreMatrix":
+        """
+        Builds the matrix from {artist : genres} (eg. the get_genres_from_artist_list genres).
+        Artists without genres (None or []) get an empty row.  The genres are sorted.
+        """
+        artists = list(artist_genres)
+        genres = sorted({g for gs in artist_genres.values() if gs for g in gs})
+        codes = {g : i for i, g in enumerate(genres)}
+        rows, cols = [], []
+        for i, artist in enumerate(artists):
+            for g in set(artist_genres[artist] or []):
+                rows.append(i)
+                cols.append(codes[g])
+        incidence = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(artists), len(genres)))
+        return cls(artists, genres, incidence)
+
+    def __len__(self) -> int:
+        return len(self.genres)
+
+    def _rows(self, artists:pd.Index) -> np.ndarray:
+        # artists that are not in the matrix (no genres looked up) are -1
+        return self.artists.get_indexer(artists.astype(object))
+
+    def genre_totals(self, artist_agg:pd.DataFrame) -> pd.DataFrame:
+        """
+        The plays and minutes of every genre from the per artist aggregates (indexed by artistName,
+        columns plays and minutes, eg. aggregation.aggregate_plays(df, ["artistName"])).
+        Sorted by genre, genres with no plays are kept with zeros.
+        """
+        weights = np.zeros((len(self.artists), 2))
+        rows = self._rows(artist_agg.index)
+        known = rows >= 0
+        np.add.at(weights, rows[known], artist_agg[["plays", "minutes"]].to_numpy(dtype=float)[known])
+        totals = self.incidence.T @ weights
+        return pd.DataFrame({"plays" : totals[:, 0].round().astype("int64"), "minutes" : totals[:, 1]}, index=self.genres)
+
+    def top_k(self, artist_agg:pd.DataFrame, k:int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        The (Genre, Streams) and (Genre, Time (hours)) top k tables.
+        """
+        return top_k_from_aggregates(self.genre_totals(artist_agg), k, {"genre" : "Genre"})
+
+    def period_shares(self, period_agg:pd.DataFrame, genres:List[str]=None) -> pd.DataFrame:
+        """
+        Genre breakdown per period from aggregates indexed by (period, artistName) eg. months.
+        A sparse period x artist weight matrix times the incidence matrix gives the period x genre totals.
+        Returns the long frame (period, genre, plays, minutes, plays_share, minutes_share) with only the
+        non zero entries, where the shares are of all of the period's plays/minutes (including the artists
+        without genres), so a genre's share is the fraction of the listening that was tagged with it.
+        genres restricts the output to those genres (eg. the overall top k).
+        """
+        columns = ["period", "genre", "plays", "minutes", "plays_share", "minutes_share"]
+        periods, period_codes = np.unique(period_agg.index.get_level_values(0), return_inverse=True)
+        rows = self._rows(period_agg.index.get_level_values(1))
+        known = rows >= 0
+        shape = (len(periods), len(self.artists))
+        plays, minutes = (sp.csr_matrix((period_agg[c].to_numpy(dtype=float)[known], (period_codes[known], rows[known])), shape=shape)
+                          for c in ("plays", "minutes"))
+        genre_plays, genre_minutes = (plays @ self.incidence).tocoo(), (minutes @ self.incidence).tocsr()
+        if genres is not None:
+            keep = np.isin(self.genres[genre_plays.col], genres)
+            genre_plays = sp.coo_matrix((genre_plays.data[keep], (genre_plays.row[keep], genre_plays.col[keep])), shape=genre_plays.shape)
+        if genre_plays.nnz == 0:
+            return pd.DataFrame(columns=columns)
+        period_plays = np.bincount(period_codes, weights=period_agg["plays"].to_numpy(dtype=float), minlength=len(periods))
+        period_minutes = np.bincount(period_codes, weights=period_agg["minutes"].to_numpy(dtype=float), minlength=len(periods))
+        r, c = genre_plays.row, genre_plays.col
+        m = np.asarray(genre_minutes[r, c]).ravel()
+        shares = pd.DataFrame({
+            "period" : periods[r],
+            "genre" : self.genres[c].to_numpy(),
+            "plays" : genre_plays.data.round().astype("int64"),
+            "minutes" : m,
+            "plays_share" : genre_plays.data/period_plays[r],
+            "minutes_share" : m/period_minutes[r],
+        }, columns=columns)
+        return shares.sort_values(["period", "plays", "genre"], ascending=[True, False, True], kind="stable").reset_index(drop=True)
@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import IO
+from metadata_cache import DEFAULT_CACHE_DIR
+from instrumentation import Metrics, metrics as default_metrics
+
+
+def file_digest(fname:str | IO, chunk_size:int=1 << 20) -> str:
+    """
+    sha256 of the file contents. File objects (eg. Streamlit UploadedFile) are rewound afterwards.
+    """
+    h = hashlib.sha256()
+    if isinstance(fname, str):
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    else:
+        fname.seek(0)
+        for chunk in iter(lambda: fname.read(chunk_size), b""):
+            h.update(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+        fname.seek(0)
+    return h.hexdigest()
+
+
+class IngestCache:
+    """
+    Parquet cache of the normalised json_batch_update output.
+    Entries are keyed on the content hash of the input file and the filter parameters
+    so a re-uploaded file is read back (memory mapped) rather than parsed again.
+    The least recently used files are removed once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir:str=None, max_bytes:int=2*1024**3, metrics:Metrics=None) -> None:
+        self.metrics = default_metrics if metrics is None else metrics
+        self.cache_dir = os.path.join(DEFAULT_CACHE_DIR, "ingest") if cache_dir is None else cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, fname:str | IO, params:dict) -> str:
+        params = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{file_digest(fname)}:{params}".encode("utf-8")).hexdigest()
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def load(self, key:str) -> pd.DataFrame | None:
+        path = self._path(key)
+        hit = os.path.exists(path)
+        self.metrics.record_cache("ingest", hit)
+        if not hit:
+            return None
+        os.utime(path) # mark as recently used
+        return pq.read_table(path, memory_map=True).to_pandas()
+
+    def store(self, key:str, df:pd.DataFrame) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=True), tmp_path)
+        os.replace(tmp_path, path) # atomic so a concurrent reader never sees a partial file
+        self._evict(keep=os.path.basename(path))
+
+    def _evict(self, keep:str) -> None:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".parquet"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
@@ -0,0 +1,131 @@
+import json
+import time
+import logging
+import threading
+import functools
+import numpy as np
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from typing import Callable, Iterator
+
+logger = logging.getLogger("unwrapped")
+MAX_SAMPLES = 10_000 # latency samples kept per endpoint for the percentiles
+
+
+def endpoint_name(method:str, url:str) -> str:
+    """
+    Groups the urls of an endpoint, eg. GET /v1/artists/0TnOYISbd1XYRBk9myaseg/albums -> GET /v1/artists/{id}/albums.
+    Anything outside /v1 and /api (the image cdn) is "GET image".
+    """
+    path = urlparse(url).path
+    if not (path.startswith("/v1/") or path.startswith("/api/")):
+        return f"{method} image"
+    segments = path.split("/") # "", "v1", collection, id, ...
+    if len(segments) > 3:
+        segments[3] = "{id}"
+    return f"{method} {'/'.join(segments)}"
+
+
+class Metrics:
+    """
+    Thread-safe collector of the hot path measurements:
+    - per stage wall time (stage() context manager or the timed decorator)
+    - per endpoint request counts, statuses, latencies (p50/p95), retries and bytes (record_request)
+    - hits and misses of each cache (record_cache)
+    Every stage and request is also logged as a json line on the "unwrapped" logger
+    (requests and cache lookups at DEBUG).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages = {}
+            self.endpoints = {}
+            self.caches = {}
+
+    @contextmanager
+    def stage(self, name:str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                stage = self.stages.setdefault(name, {"count" : 0, "seconds" : 0.})
+                stage["count"] += 1
+                stage["seconds"] += seconds
+            self.log(logging.INFO, "stage", stage=name, seconds=seconds)
+
+    def record_request(self, endpoint:str, seconds:float, status:int | None, n_bytes:int, retry:bool) -> None:
+        with self._lock:
+            e = self.endpoints.setdefault(endpoint, {"count" : 0, "retries" : 0, "bytes" : 0, "statuses" : {}, "latencies" : []})
+            e["count"] += 1
+            e["retries"] += int(retry)
+            e["bytes"] += n_bytes
+            e["statuses"][str(status)] = e["statuses"].get(str(status), 0) + 1
+            if len(e["latencies"]) < MAX_SAMPLES:
+                e["latencies"].append(seconds)
+        self.log(logging.DEBUG, "request", endpoint=endpoint, seconds=seconds, status=status, bytes=n_bytes, retry=retry)
+
+    def record_cache(self, cache:str, hit:bool) -> None:
+        with self._lock:
+            c = self.caches.setdefault(cache, {"hits" : 0, "misses" : 0})
+            c["hits" if hit else "misses"] += 1
+        self.log(logging.DEBUG, "cache", cache=cache, hit=hit)
+
+    def log(self, level:int, event:str, **fields) -> None:
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({"event" : event, **fields}, default=str))
+
+    def summary(self) -> dict:
+        """
+        json serialisable snapshot of everything recorded since the last reset.
+        """
+        with self._lock:
+            endpoints = {}
+            for name, e in self.endpoints.items():
+                latencies = np.array(e["latencies"])
+                endpoints[name] = {
+                    "count" : e["count"],
+                    "retries" : e["retries"],
+                    "bytes" : e["bytes"],
+                    "statuses" : dict(e["statuses"]),
+                    "p50_ms" : float(np.percentile(latencies, 50)*1000) if len(latencies) else None,
+                    "p95_ms" : float(np.percentile(latencies, 95)*1000) if len(latencies) else None,
+                }
+            caches = {name : {**c, "hit_ratio" : c["hits"]/(c["hits"] + c["misses"])} for name, c in self.caches.items()}
+            return {"stages" : {k : dict(v) for k, v in self.stages.items()}, "endpoints" : endpoints, "caches" : caches}
+
+    def log_summary(self) -> None:
+        self.log(logging.INFO, "summary", **self.summary())
+
+
+metrics = Metrics() # the process-wide collector used by default
+
+
+def timed(stage:str) -> Callable:
+    """
+    Decorator recording the wall time of a method as stage on self.metrics (the process-wide metrics if unset).
+    """
+    def decorator(fn:Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self, "metrics", metrics).stage(stage):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def configure_json_logging(level:int=logging.INFO) -> None:
+    """
+    Print the "unwrapped" json log lines to stderr (once, however often it is called).
+    """
+    logger.setLevel(level)
+    if not any(getattr(h, "_unwrapped_json", False) for h in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._unwrapped_json = True
+        logger.addHandler(handler)
@@ -0,0 +1,97 @@
+"""
+Load test of SpotifyClient against the local fake Spotify server (fake_spotify.py).
+
+    python load_test.py --latency 0.05 --jitter 0.05 --server-rate 100 --error-rate 0.02 --output load_test.json
+
+Reports the end-to-end time, the requests per second and the responses by status for
+get_genres_from_artist_list and get_album_from_song_list on a synthetic history.
+The client runs without its caches so every lookup reaches the server.
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+import warnings
+from typing import List
+from artwork_cache import ArtworkCache
+from fake_spotify import Catalog, FakeSpotifyServer
+from request_engine import RequestEngine
+from spotify_client import SpotifyClient
+from synthetic_history import synthetic_frame
+
+
+def run_load_test(n_plays:int=5_000, n_artists:int=1_000, sample_rate:float=0.05, latency:float=0.02, jitter:float=0.01, 
+                  server_rate:float=None, retry_after:float=1., error_rate:float=0., workers:int=8, client_rate:float=100., 
+                  seed:int=0) -> dict:
+    catalog = Catalog.synthetic(n_artists=n_artists, seed=seed)
+    history = synthetic_frame(n_plays, n_artists=n_artists, seed=seed)
+    songs = history[history["trackUri"].notna()]
+    artist_list = list(songs["artistName"])
+    artist_song_list = list(songs[["artistName", "trackName"]].itertuples(index=False, name=None))
+
+    results = {"config" : {"n_plays" : n_plays, "n_artists" : n_artists, "sample_rate" : sample_rate, "latency" : latency, 
+                           "jitter" : jitter, "server_rate" : server_rate, "retry_after" : retry_after, "error_rate" : error_rate, 
+                           "workers" : workers, "client_rate" : client_rate, "seed" : seed}, 
+               "scenarios" : []}
+    server = FakeSpotifyServer(catalog, latency=latency, jitter=jitter, rate=server_rate, retry_after=retry_after, 
+                               error_rate=error_rate, seed=seed)
+    with server, tempfile.TemporaryDirectory() as tmp:
+        engine = RequestEngine(max_workers=workers, rate=client_rate, backoff=0.05, max_backoff=2.)
+        client = SpotifyClient(use_cache=False, engine=engine, artwork_cache=ArtworkCache(tmp), 
+                               base_url=server.url, accounts_url=server.url)
+        client.token # the token request is not part of the scenarios
+        scenarios = [
+            ("get_genres_from_artist_list", lambda: client.get_genres_from_artist_list(artist_list)),
+            ("get_album_from_song_list", lambda: client.get_album_from_song_list(artist_song_list, sample_rate)),
+        ]
+        for name, fn in scenarios:
+            server.reset_stats()
+            start = time.perf_counter()
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                output = fn()
+            seconds = time.perf_counter() - start
+            stats = json.loads(json.dumps(server.stats))
+            found = sum(v is not None for v in output) if isinstance(output, list) else sum(len(v["genres"]) > 0 for v in output.values())
+            results["scenarios"].append({
+                "scenario" : name,
+                "seconds" : seconds,
+                "requests" : stats["requests"],
+                "requests_per_second" : stats["requests"]/seconds if seconds > 0 else None,
+                "statuses" : stats["statuses"],
+                "endpoints" : stats["endpoints"],
+                "found" : found,
+            })
+        engine.close()
+    return results
+
+
+def main(argv:List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the Spotify client against the local fake server.")
+    parser.add_argument("--plays", type=int, default=5_000, help="size of the synthetic history")
+    parser.add_argument("--artists", type=int, default=1_000, help="artists in the catalog")
+    parser.add_argument("--sample-rate", type=float, default=0.05, help="get_album_from_song_list sample rate")
+    parser.add_argument("--latency", type=float, default=0.02, help="server latency per request (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra uniform latency (seconds)")
+    parser.add_argument("--server-rate", type=float, default=None, help="server rate limit (requests/second)")
+    parser.add_argument("--retry-after", type=float, default=1., help="Retry-After of the 429 responses (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0., help="fraction of requests answered with a 5xx")
+    parser.add_argument("--workers", type=int, default=8, help="client worker threads")
+    parser.add_argument("--client-rate", type=float, default=100., help="client rate limit (requests/second)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="save the results as json")
+    args = parser.parse_args(argv)
+
+    results = run_load_test(args.plays, args.artists, args.sample_rate, args.latency, args.jitter, args.server_rate, 
+                            args.retry_after, args.error_rate, args.workers, args.client_rate, args.seed)
+    for s in results["scenarios"]:
+        print(f"{s['scenario']:<30} {s['seconds']:8.2f}s {s['requests']:6d} requests {s['requests_per_second']:8.1f} req/s  {s['statuses']}")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
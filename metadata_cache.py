@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any
+
+DEFAULT_CACHE_DIR = os.getenv("UNWRAPPED_CACHE_DIR", ".unwrapped_cache")
+MISS = object() # sentinel so that a cached None (negative result) is distinguishable from a miss
+
+
+def normalise_key(*parts:str) -> str:
+    """
+    Normalise query strings so that "Dave", " dave " and "DAVE" share a cache entry.
+    """
+    return "\x1f".join(" ".join(str(p).lower().split()) for p in parts)
+
+
+class MetadataCache:
+    """
+    Persistent SQLite-backed cache for the Spotify metadata lookups.
+    Values are stored as json and keyed on (namespace, key).
+    A value of None records a negative result (eg. artist not found) which expires
+    after negative_ttl seconds rather than ttl seconds so that misses are retried eventually.
+    When the cache grows past max_entries the least recently accessed entries are evicted.
+    Reads do not write: the access times of the hits are buffered and written with the next
+    set() (or eviction, or every touch_batch hits) so the lookups of the engine workers are not
+    serialised on the SQLite write lock.  Within one instance the calls share a connection and a lock;
+    the database is in WAL mode so that other processes using the same file can read while one writes.
+    """
+
+    def __init__(self, path:str=None, ttl:float=30*24*3600, negative_ttl:float=24*3600, max_entries:int=200_000, touch_batch:int=1000) -> None:
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, "metadata.sqlite")
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self.touch_batch = touch_batch
+        self._touched = {} # (namespace, key) -> access time not written yet
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    expires REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, namespace:str, key:str) -> Any:
+        """
+        Returns the cached value, None for a cached negative result or MISS if
+        the key is absent or has expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return MISS
+            value, expires = row
+            if expires < now:
+                with self._conn:
+                    self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                return MISS
+            self._touched[(namespace, key)] = now
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+        return None if value is None else json.loads(value)
+
+    def set(self, namespace:str, key:str, value:Any) -> None:
+        """
+        Store value (None records a negative result).
+        """
+        now = time.time()
+        ttl = self.negative_ttl if value is None else self.ttl
+        payload = None if value is None else json.dumps(value)
+        with self._lock:
+            self._flush_touched()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, payload, now + ttl, now),
+                )
+            self._writes_since_evict += 1
+            # counting the table on every write is wasteful so only check periodically
+            if self._writes_since_evict >= max(1, self.max_entries // 100):
+                self._evict()
+
+    def flush(self) -> None:
+        """
+        Write the buffered access times.
+        """
+        with self._lock:
+            self._flush_touched()
+
+    def _flush_touched(self) -> None:
+        """
+        One transaction for the buffered access times.  Assumes the lock is held.
+        """
+        if len(self._touched) == 0:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                [(accessed, namespace, key) for (namespace, key), accessed in self._touched.items()],
+            )
+        self._touched.clear()
+
+    def _evict(self) -> None:
+        """
+        Drop expired entries then the least recently accessed entries beyond max_entries.
+        Assumes the lock is held.
+        """
+        self._writes_since_evict = 0
+        self._flush_touched()
+        with self._conn:
+            self._conn.execute("DELETE FROM entries WHERE expires < ?", (time.time(),))
+            n = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if n > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY accessed ASC LIMIT ?)",
+                    (n - self.max_entries,),
+                )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
@@ -0,0 +1,165 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from typing import IO, Iterator, List, Tuple
+from aggregation import aggregate_plays, top_k_from_aggregates
+from streaming_history import iter_history_frames, MIN_MINUTES
+from time_window import TimeWindow
+
+PODCAST_MINUTES = 10. # same rule as SpotifyUnwrapped.finalise_dataframes
+BATCH_ROWS = 1 << 18
+SCHEMA = pa.schema([
+    ("endTime", pa.timestamp("ns")),
+    ("artistName", pa.string()),
+    ("trackName", pa.string()),
+    ("msPlayed", pa.int64()),
+    ("minsPlayed", pa.float64()),
+    ("trackUri", pa.string()), # null for the basic history and for podcasts
+])
+LABELS = {
+    "artist" : (True, ["artistName"], {"artistName" : "Artist"}),
+    "song" : (True, ["trackName"], {"trackName" : "Track"}),
+    "podcast" : (False, ["artistName"], {"artistName" : "Podcast"}),
+}
+
+
+def dataset_files(path:str) -> List[str]:
+    """
+    The finished part files of the dataset at path, leaving out the .tmp files of an interrupted write.
+    """
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".parquet"))
+
+
+def write_history_dataset(fnames:List[str | IO], path:str, chunk_rows:int=BATCH_ROWS) -> List[str]:
+    """
+    Converts streaming history json files (basic or extended) into a Parquet dataset at path,
+    one file per input with a row group per chunk_rows plays, without holding a whole file in memory.
+    Every play is kept (the window and play length filters are applied when querying) so one
+    dataset answers any window.  Files already in the dataset are not overwritten, so more
+    exports (or other users' exports) can be added later.  Returns the written files.
+    """
+    os.makedirs(path, exist_ok=True)
+    start = len(dataset_files(path))
+    written = []
+    for i, fname in enumerate(fnames):
+        out = os.path.join(path, f"part-{start + i:05d}.parquet")
+        tmp_path = f"{out}.{os.getpid()}.tmp"
+        with pq.ParquetWriter(tmp_path, SCHEMA) as writer:
+            for df in _iter_frames(fname, chunk_rows):
+                if "trackUri" not in df.columns:
+                    df = df.assign(trackUri=None)
+                writer.write_table(pa.Table.from_pandas(df[SCHEMA.names], schema=SCHEMA, preserve_index=False))
+        os.replace(tmp_path, out) # a half written file is never part of the dataset
+        written.append(out)
+    return written
+
+
+def _iter_frames(fname:str | IO, chunk_rows:int) -> Iterator[pd.DataFrame]:
+    if isinstance(fname, str):
+        with open(fname, "rb") as f:
+            yield from iter_history_frames(f, chunk_rows)
+    else:
+        yield from iter_history_frames(fname, chunk_rows)
+
+
+class ParquetHistory:
+    """
+    Out of core backend for the top k queries over a Parquet dataset of plays (see write_history_dataset).
+    The window and play length filters are pushed down to the scan (whole row groups outside the window
+    are skipped using their statistics), only the needed columns are read, and the plays are aggregated
+    batch_rows at a time with the partial aggregates merged as they grow, so memory is bounded by the
+    number of distinct keys rather than the number of plays.
+    The filters and aggregates are the ones of the pandas path so the results are the same.
+    """
+
+    def __init__(self, path:str, window:TimeWindow=None, min_minutes:float=MIN_MINUTES, batch_rows:int=BATCH_ROWS) -> None:
+        self.path = path
+        self.window = TimeWindow.wrapped(2023) if window is None else window
+        self.min_minutes = min_minutes
+        self.batch_rows = batch_rows
+        self.dataset = ds.dataset(dataset_files(path), format="parquet", schema=SCHEMA)
+        self._aggregates = {}
+        self._track_uris = None
+
+    def filter(self, songs:bool) -> ds.Expression:
+        """
+        The pushed down predicate: in the window, longer than min_minutes, and a song (<= 10 minutes) or a podcast.
+        """
+        minutes = ds.field("minsPlayed")
+        expression = minutes > self.min_minutes
+        expression &= (minutes <= PODCAST_MINUTES) if songs else (minutes > PODCAST_MINUTES)
+        if self.window.start is not None:
+            expression &= ds.field("endTime") >= pa.scalar(self.window.start.value, pa.timestamp("ns"))
+        if self.window.end is not None:
+            expression &= ds.field("endTime") < pa.scalar(self.window.end.value, pa.timestamp("ns"))
+        return expression
+
+    def scan(self, columns:List[str], songs:bool=True) -> Iterator[pd.DataFrame]:
+        for batch in self.dataset.to_batches(columns=columns, filter=self.filter(songs), batch_size=self.batch_rows):
+            if batch.num_rows > 0:
+                yield batch.to_pandas()
+
+    def aggregate(self, keys:List[str], songs:bool=True) -> pd.DataFrame:
+        """
+        aggregation.aggregate_plays of the filtered songs (or podcasts) over keys, computed batch by batch.
+        """
+        cache_key = (tuple(keys), songs)
+        if cache_key not in self._aggregates:
+            partials, rows = [], 0
+            for df in self.scan(keys + ["minsPlayed"], songs):
+                partials.append(aggregate_plays(df, keys))
+                rows += len(partials[-1])
+                # merge once the partials outgrow a batch so they stay about the size of the distinct keys
+                if rows > self.batch_rows and len(partials) > 1:
+                    partials = [_merge(partials, keys)]
+                    rows = len(partials[0])
+            self._aggregates[cache_key] = _merge(partials, keys) if partials else _empty(keys)
+        return self._aggregates[cache_key]
+
+    def get_top_k(self, kind:str, k:int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        The (Streams, Time (hours)) top k tables of kind "artist", "song" or "podcast" in the same
+        format as the SpotifyUnwrapped.get_yearly_top_* methods.
+        """
+        if kind not in LABELS:
+            raise ValueError(f"Unknown kind {kind}.")
+        songs, keys, labels = LABELS[kind]
+        return top_k_from_aggregates(self.aggregate(keys, songs), k, labels)
+
+    def track_aggregates(self) -> pd.DataFrame:
+        """
+        plays and minutes per (artistName, trackName) of the songs, for the album modes.
+        """
+        return self.aggregate(["artistName", "trackName"])
+
+    def track_uris(self) -> dict:
+        """
+        {(artistName, trackName) : track id} of the songs (first id seen), empty for the basic history.
+        Scanned once, the album modes ask for it on every round.
+        """
+        if self._track_uris is None:
+            uris = {}
+            for df in self.scan(["artistName", "trackName", "trackUri"]):
+                df = df[df["trackUri"].notna()].drop_duplicates(["artistName", "trackName"])
+                for key, uri in zip(zip(df["artistName"], df["trackName"]), df["trackUri"]):
+                    uris.setdefault(key, uri)
+            self._track_uris = uris
+        return self._track_uris
+
+    def count(self, songs:bool=True) -> int:
+        return self.dataset.count_rows(filter=self.filter(songs))
+
+
+def _merge(partials:List[pd.DataFrame], keys:List[str]) -> pd.DataFrame:
+    if len(partials) == 1:
+        return partials[0]
+    agg = pd.concat(partials).groupby(level=keys, sort=True)[["plays", "minutes"]].sum()
+    return agg.astype({"plays" : np.int64})
+
+
+def _empty(keys:List[str]) -> pd.DataFrame:
+    df = pd.DataFrame({key : pd.Series(dtype=object) for key in keys})
+    return aggregate_plays(df.assign(minsPlayed=pd.Series(dtype="float64")), keys)
@@ -0,0 +1,180 @@
+import time
+import random
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Any, Callable, Hashable, Iterable, List
+from instrumentation import Metrics, endpoint_name, metrics as default_metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retry_after_seconds(value:str) -> float:
+    """
+    Seconds to wait from a Retry-After header, which is either a number of seconds or an
+    HTTP-date (RFC 9110).  None if the value is neither.
+    """
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0., (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available.
+    pause() stops all callers until the given time has passed, which is used
+    to respect the Retry-After header of a 429 response.
+    """
+
+    def __init__(self, rate:float, capacity:float=None) -> None:
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.paused_until - now, (1 - self.tokens)/self.rate)
+            time.sleep(delay)
+
+    def pause(self, seconds:float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.
+
+
+class RequestEngine:
+    """
+    Bounded thread pool for the Spotify API traffic.
+    - one pooled requests.Session (keep-alive connections shared by the workers)
+    - a token bucket limiter that also honours Retry-After on 429
+    - retries on 429/5xx and connection errors with jittered exponential backoff
+    - submit(..., key=k) merges duplicate in-flight calls for the same key
+    - every attempt is recorded on metrics (latency, status, bytes, retry) per endpoint
+    """
+
+    def __init__(self, max_workers:int=8, rate:float=20., burst:float=None, max_retries:int=5,
+                 backoff:float=0.5, max_backoff:float=30., timeout:float=30., metrics:Metrics=None) -> None:
+        self.metrics = default_metrics if metrics is None else metrics
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spotify")
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _sleep_before_retry(self, attempt:int) -> None:
+        # "full jitter" so that the workers do not retry in lockstep
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff*2**attempt)))
+
+    def request(self, method:str, url:str, **kwargs) -> requests.Response:
+        """
+        Rate limited request with retries.
+        Returns the last response if the retries are exhausted on a retryable status.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint_name(method, url)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.metrics.record_request(endpoint, time.perf_counter() - start, None, 0, attempt > 0)
+                if attempt == self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            self.metrics.record_request(endpoint, time.perf_counter() - start, response.status_code,
+                                        len(response.content or b""), attempt > 0)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After") if response.headers else None
+            delay = None if retry_after is None else retry_after_seconds(retry_after)
+            if response.status_code == 429 and delay is not None:
+                self.limiter.pause(delay)
+            else:
+                self._sleep_before_retry(attempt)
+        return response
+
+    def get(self, url:str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def submit(self, fn:Callable, *args, key:Hashable=None) -> Future:
+        """
+        Run fn(*args) on the pool. Calls sharing a key while the first is still
+        in flight get the same future rather than repeating the work.
+        """
+        if key is None:
+            return self._executor.submit(fn, *args)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(fn, *args)
+            self._inflight[key] = future
+        future.add_done_callback(lambda _: self._release(key))
+        return future
+
+    def _release(self, key:Hashable) -> None:
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+
+    def map(self, fn:Callable, items:Iterable, key:Callable=None) -> List[Any]:
+        """
+        Concurrent equivalent of [fn(item) for item in items] preserving order.
+        key(item) gives the deduplication key, duplicates are only computed once.
+        Must not be called from inside a pool task as the nested tasks could starve.
+        If a call raises, the calls that have not started are cancelled before the error is raised.
+        """
+        if key is None:
+            futures = [self.submit(fn, item) for item in items]
+        else:
+            by_key = {}
+            futures = []
+            for item in items:
+                k = key(item)
+                if k not in by_key:
+                    by_key[k] = self.submit(fn, item, key=k)
+                futures.append(by_key[k])
+        try:
+            return [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            wait(futures)
+            raise
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.session.close()
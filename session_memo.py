@@ -0,0 +1,65 @@
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Hashable, IO, MutableMapping, Tuple
+from ingest_cache import file_digest
+
+
+class StageMemo:
+    """
+    Memoises the stages of the app in a mapping (st.session_state) so that a rerun only
+    recomputes the stages whose inputs changed.
+    Each stage keeps only its latest (key, result) so memory does not grow with reruns.
+    """
+
+    def __init__(self, state:MutableMapping, prefix:str="memo") -> None:
+        self.state = state
+        self.prefix = prefix
+
+    def get(self, stage:str, key:Hashable, compute:Callable[[], Any]) -> Any:
+        """
+        The result of compute() for this stage, recomputed only when key changes.
+        """
+        found, value = self.lookup(stage, key)
+        if found:
+            return value
+        value = compute()
+        self.put(stage, key, value)
+        return value
+
+    def lookup(self, stage:str, key:Hashable) -> Tuple[bool, Any]:
+        cached = self.state.get(f"{self.prefix}_{stage}")
+        if cached is not None and cached[0] == key:
+            return True, cached[1]
+        return False, None
+
+    def put(self, stage:str, key:Hashable, value:Any) -> None:
+        self.state[f"{self.prefix}_{stage}"] = (key, value)
+
+    def submit(self, stage:str, key:Hashable, compute:Callable[[], Any], executor:Executor) -> Future:
+        """
+        Background version of get: runs compute on executor unless the stage is memoised for key,
+        in which case the returned future is already done.  The result is not stored, call put()
+        from the script thread once it is ready (session_state belongs to the script thread).
+        """
+        found, value = self.lookup(stage, key)
+        if not found:
+            return executor.submit(compute)
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def clear(self, stage:str=None) -> None:
+        slots = [k for k in self.state.keys() if k == f"{self.prefix}_{stage}" or (stage is None and str(k).startswith(f"{self.prefix}_"))]
+        for slot in slots:
+            del self.state[slot]
+
+    def upload_digest(self, fobj:IO) -> str:
+        """
+        Content hash of an upload, hashed once per upload (keyed on the Streamlit file_id when there is one).
+        """
+        upload_id = getattr(fobj, "file_id", None)
+        if upload_id is None:
+            return file_digest(fobj)
+        digests = self.state.setdefault(f"{self.prefix}_digests", {})
+        if upload_id not in digests:
+            digests[upload_id] = file_digest(fobj)
+        return digests[upload_id]
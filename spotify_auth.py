@@ -0,0 +1,91 @@
+import time
+import base64
+import json
+import threading
+from request_engine import RequestEngine
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+REFRESH_MARGIN = 60. # refresh this many seconds before the token expires
+
+
+class ClientCredentialsToken:
+    """
+    Thread-safe client credentials access token.
+    The token is fetched on first use, cached until REFRESH_MARGIN seconds before it
+    expires and then refreshed by whichever caller gets there first.
+    """
+
+    def __init__(self, client_id:str, client_secret:str, engine:RequestEngine, margin:float=REFRESH_MARGIN, 
+                 token_url:str=TOKEN_URL) -> None:
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.engine = engine
+        self.margin = margin
+        self.token_url = token_url
+        self.token = None
+        self.expires_at = 0.
+        self._lock = threading.Lock()
+
+    def is_valid(self) -> bool:
+        return self.token is not None and time.monotonic() < self.expires_at - self.margin
+
+    def get(self) -> str:
+        if self.is_valid():
+            return self.token
+        with self._lock:
+            if not self.is_valid(): # another thread may have refreshed it while we waited
+                self._refresh()
+            return self.token
+
+    def invalidate(self, token:str=None) -> None:
+        """
+        Drop the token (eg. after a 401) so the next get() requests a new one.  When token is
+        given it is only dropped if it is still the current one, so concurrent 401s for the
+        same token cause one refresh.
+        """
+        with self._lock:
+            if token is None or token == self.token:
+                self.token = None
+
+    def _refresh(self) -> None:
+        auth_string = f"{self.client_id}:{self.client_secret}"
+        auth_base64 = str(base64.b64encode(auth_string.encode("utf-8")), "utf-8")
+        headers = {
+            "Authorization" : f"Basic {auth_base64}",
+            "Content-Type" : "application/x-www-form-urlencoded"
+        }
+        data = {"grant_type" : "client_credentials"}
+        requested_at = time.monotonic()
+        result = self.engine.post(self.token_url, headers=headers, data=data)
+        json_result = json.loads(result.content)
+        self.token = json_result["access_token"]
+        self.expires_at = requested_at + float(json_result.get("expires_in", 3600))
+
+
+_shared_engine = None
+_shared_tokens = {}
+_shared_lock = threading.Lock()
+
+
+def shared_engine() -> RequestEngine:
+    """
+    The process-wide request engine (one pooled session and rate limiter for every client).
+    """
+    global _shared_engine
+    with _shared_lock:
+        if _shared_engine is None:
+            _shared_engine = RequestEngine()
+        return _shared_engine
+
+
+def shared_token(client_id:str, client_secret:str, engine:RequestEngine=None, token_url:str=TOKEN_URL) -> ClientCredentialsToken:
+    """
+    The process-wide token for these credentials (and token server), so new clients reuse a still valid token.
+    """
+    engine = shared_engine() if engine is None else engine
+    with _shared_lock:
+        token = _shared_tokens.get((client_id, client_secret, token_url))
+        if token is None:
+            token = ClientCredentialsToken(client_id, client_secret, engine, token_url=token_url)
+            _shared_tokens[(client_id, client_secret, token_url)] = token
+        return token
@@ -1,74 +1,168 @@
 import os 
-import base64
 import requests 
 import json
 import numpy as np
 from dotenv import load_dotenv
 from tabulate import tabulate
-from thefuzz import fuzz
 import warnings
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 from typing import List, Tuple
 from pprint import PrettyPrinter
+from collections import Counter
+from metadata_cache import MetadataCache, MISS, normalise_key
+from request_engine import RequestEngine
+from spotify_auth import shared_engine, shared_token
+from entity_index import EntityIndex, best_matches
+from artwork_cache import ArtworkCache, ARTWORK_WIDTH, select_image
+
+MAX_IDS_PER_REQUEST = 50 # limit for the multi-id endpoints eg. /v1/artists?ids=
+API_URL = "https://api.spotify.com"
+ACCOUNTS_URL = "https://accounts.spotify.com"
 
 class SpotifyClient:
-    def __init__(self):
+    def __init__(self, cache:MetadataCache=None, use_cache:bool=True, engine:RequestEngine=None, 
+                 artwork_cache:ArtworkCache=None, entity_index:EntityIndex=None, base_url:str=None, 
+                 accounts_url:str=None):
+        """
+        The metadata lookups are served from a persistent cache when use_cache is True.
+        Pass cache to share a MetadataCache (eg. a different path or ttl), otherwise the default is used.
+        Likewise names are resolved from the local entity_index before asking the API.
+        The album artwork is stored in artwork_cache (the default ArtworkCache if None).
+        All of the http traffic goes through engine (pooled session, rate limiting and retries)
+        which also runs the list lookups concurrently.  By default every client shares the
+        process-wide engine and access token, so constructing a client makes no network calls
+        and the token is only requested when it is missing or about to expire.
+        base_url and accounts_url point the client at a different server (eg. fake_spotify.FakeSpotifyServer),
+        they default to the SPOTIFY_API_URL and SPOTIFY_ACCOUNTS_URL environment variables and then to Spotify.
+        The cache and index lookups are recorded on the engine's metrics alongside its requests.
+        """
         load_dotenv() # need .env in same directory as main.py
         self.client_id = os.getenv("CLIENT_ID")
         self.client_secret = os.getenv("CLIENT_SECRET")
-        self._set_token()
-        client_credentials_manager = SpotifyClientCredentials(client_id=self.client_id, client_secret=self.client_secret)
-        self.sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+        self.base_url = (base_url or os.getenv("SPOTIFY_API_URL") or API_URL).rstrip("/")
+        self.accounts_url = (accounts_url or os.getenv("SPOTIFY_ACCOUNTS_URL") or ACCOUNTS_URL).rstrip("/")
+        self.engine = engine if engine is not None else shared_engine()
+        self.metrics = self.engine.metrics
+        self.auth = shared_token(self.client_id, self.client_secret, self.engine, f"{self.accounts_url}/api/token")
+        if use_cache and cache is None:
+            cache = MetadataCache()
+        self.cache = cache if use_cache else None
+        if use_cache and entity_index is None:
+            entity_index = EntityIndex()
+        self.entity_index = entity_index if use_cache else None
+        self.artwork_cache = artwork_cache if artwork_cache is not None else ArtworkCache()
+
+    def _cache_get(self, namespace:str, key:str):
+        if self.cache is None:
+            return MISS
+        value = self.cache.get(namespace, key)
+        self.metrics.record_cache(f"metadata:{namespace}", value is not MISS)
+        return value
+
+    def _cache_set(self, namespace:str, key:str, value) -> None:
+        if self.cache is not None:
+            self.cache.set(namespace, key, value)
+
+    def _index_get(self, kind:str, name:str, scope:str="") -> Tuple[str, str] | None:
+        if self.entity_index is None:
+            return None
+        entity = self.entity_index.get(kind, name, scope)
+        self.metrics.record_cache(f"index:{kind}", entity is not None)
+        return entity
+
+    def _index_add(self, kind:str, entries:list, scope:str="") -> None:
+        if self.entity_index is not None:
+            self.entity_index.add(kind, entries, scope)
     
-    def _set_token(self) -> None:
-        """
-        Sets the class token attribute to the access token from Spotify API
-        """
-        auth_string = f"{self.client_id}:{self.client_secret}"
-        auth_bytes = auth_string.encode("utf-8")
-        auth_base64 = str(base64.b64encode(auth_bytes), "utf-8") 
-        url = "https://accounts.spotify.com/api/token"
-        headers = {
-            "Authorization" : f"Basic {auth_base64}",
-            "Content-Type" : "application/x-www-form-urlencoded"
-        }
-        data = {"grant_type" : "client_credentials"}
-        result = requests.post(url, headers=headers, data=data)
-        json_result = json.loads(result.content)
-        self.token = json_result["access_token"]
+    @property
+    def token(self) -> str:
+        """
+        The current access token, refreshed shortly before it expires.
+        """
+        return self.auth.get()
 
     def get_auth_header(self) -> dict:
         return {"Authorization" : f"Bearer {self.token}"}
+
+    def api_get(self, url:str, params:dict=None) -> requests.Response:
+        """
+        Authorised GET through the engine.  A 401 (token revoked or expired early) invalidates
+        the token and the request is retried once with a new one.
+        """
+        token = self.token
+        result = self.engine.get(url, headers={"Authorization" : f"Bearer {token}"}, params=params)
+        if result.status_code == 401:
+            self.auth.invalidate(token)
+            result = self.engine.get(url, headers=self.get_auth_header(), params=params)
+        return result
     
     def search_for_artist_id(self, artist_name:str, track:str=None) -> tuple[str, str] | tuple[None, None]:
         """returns (artist_name, artist_id)""" 
-        url = "https://api.spotify.com/v1/search"
-        headers = self.get_auth_header()
+        return self.search_for_artist_ids([artist_name], concurrent=False)[artist_name]
+
+    def search_for_artist_ids(self, artist_names:list, concurrent:bool=True) -> dict:
+        """
+        Returns {artist name : (artist_name, artist_id)} ((None, None) if not found).
+        Names are resolved from the entity index, then the metadata cache and only then searched,
+        concurrently unless concurrent is False (eg. when already running on the engine).
+        The ambiguous search results are disambiguated together with best_matches.
+        """
+        artists = {}
+        to_search = []
+        for artist_name in dict.fromkeys(artist_names):
+            indexed = self._index_get("artist", artist_name)
+            if indexed is not None:
+                artists[artist_name] = indexed
+                continue
+            cached = self._cache_get("artist_search", normalise_key(artist_name))
+            if cached is MISS:
+                to_search.append(artist_name)
+            elif cached is None:
+                warnings.warn(f"Could not find artist {artist_name}", UserWarning)
+                artists[artist_name] = (None, None)
+            else:
+                artists[artist_name] = (cached[0], cached[1])
+        if len(to_search) == 0:
+            return artists
+
+        if concurrent:
+            candidate_lists = self.engine.map(self._search_artist_candidates, to_search)
+        else:
+            candidate_lists = [self._search_artist_candidates(artist_name) for artist_name in to_search]
+        # the top result is used when its name matches, otherwise the closest name.
+        # We need this fix for ambiguous names (eg. Dave, Beck)
+        # Modified from https://stackoverflow.com/questions/65101111/spotipy-wrong-several-artist-coming-up-when-i-use-sp-search
+        fuzzy = [i for i, (artist_name, candidates) in enumerate(zip(to_search, candidate_lists)) 
+                 if len(candidates) > 0 and candidates[0][0].lower() != artist_name.lower()]
+        selected = [0 if len(candidates) > 0 else None for candidates in candidate_lists]
+        matches = best_matches([to_search[i] for i in fuzzy], [[c[0] for c in candidate_lists[i]] for i in fuzzy])
+        for i, match in zip(fuzzy, matches):
+            selected[i] = match
+
+        for artist_name, candidates, idx in zip(to_search, candidate_lists, selected):
+            if idx is None:
+                warnings.warn(f"Could not find artist {artist_name}", UserWarning)
+                artists[artist_name] = (None, None)
+                self._cache_set("artist_search", normalise_key(artist_name), None)
+                continue
+            artists[artist_name] = candidates[idx]
+            self._cache_set("artist_search", normalise_key(artist_name), list(candidates[idx]))
+            self._index_add("artist", [(artist_name, *candidates[idx])])
+        return artists
+
+    def _search_artist_candidates(self, artist_name:str) -> List[Tuple[str, str]]:
+        """
+        The (name, id) of the top 5 search results for artist_name.
+        """
+        url = f"{self.base_url}/v1/search"
         params = {"q" : artist_name, "type" : "artist", "limit": 5} # equivalent to query = f"q={artist_name}&type=artist&limit=1"
-        result = requests.get(url, headers=headers, params=params)
+        result = self.api_get(url, params=params)
         json_result = json.loads(result.content)["artists"]["items"]
-        if len(json_result) == 0:
-            warning_message = f"Could not find artist {artist_name}"
-            warnings.warn(warning_message, UserWarning)
-            return None, None
-        test_artist_name = json_result[0]["name"]
-        if test_artist_name.lower() == artist_name.lower():
-            return json_result[0]["name"], json_result[0]["id"]
-        else:
-            # no match - lookup and do manual match
-            # We need this fix for ambiguous names (eg. Dave, Beck)
-            # Modified from https://stackoverflow.com/questions/65101111/spotipy-wrong-several-artist-coming-up-when-i-use-sp-search
-            artist_names = [artist["name"] for artist in json_result]
-            artist_scores = np.array([fuzz.ratio(artist_name, artist) for artist in artist_names])
-            selected_artist_idx = np.argmax(artist_scores)
-            return json_result[selected_artist_idx]["name"], json_result[selected_artist_idx]["id"]
+        return [(artist["name"], artist["id"]) for artist in json_result]
 
     def get_songs_by_artist(self, artist_id:str) -> dict:
-        url = f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks"
-        headers = self.get_auth_header()
+        url = f"{self.base_url}/v1/artists/{artist_id}/top-tracks"
         params = {"country" : "GB"}
-        result = requests.get(url, headers=headers, params=params)
+        result = self.api_get(url, params=params)
         json_result = json.loads(result.content)["tracks"]
         return json_result
     
@@ -77,20 +171,42 @@ class SpotifyClient:
         nb. not an obvious way to optimize this by memoizing the seen 
         artists (as in for genres) because artists have one list of genres
         but multiple distinct albums.
+        Instead, the (artist, song) pair is cached persistently.
         """
-        results = self.sp.search(q=f'track:{song_name} artist:{artist_name}', type='track')
+        cache_key = normalise_key(artist_name, song_name)
+        cached = self._cache_get("track_album", cache_key)
+        if cached is not MISS:
+            return cached
+        # the track search goes through the engine so that it
+        # is rate limited and retried like the other endpoints
+        url = f"{self.base_url}/v1/search"
+        params = {"q" : f"track:{song_name} artist:{artist_name}", "type" : "track", "limit" : 10}
+        results = json.loads(self.api_get(url, params=params).content)
         track = results['tracks']['items']
         if len(track) == 0:
             warning_message = f"Could not find song {song_name} by {artist_name}"
             warnings.warn(warning_message, UserWarning)
+            self._cache_set("track_album", cache_key, None)
             return None
         track = track[0]
         album_name = track['album']['name']
+        self._cache_set("track_album", cache_key, album_name)
+        self._index_track(track)
         return album_name
+
+    def _index_track(self, track:dict) -> None:
+        """
+        Record the artists of a track response and the track itself (scoped by its first artist).
+        """
+        self._index_add("artist", [(a["name"], a["name"], a["id"]) for a in track["artists"]])
+        if len(track["artists"]) > 0 and track.get("name") is not None:
+            self._index_add("track", [(track["name"], track["name"], track["id"])], scope=track["artists"][0]["id"])
     
     def get_album_from_song_list(self, artist_song_list:list, sample_rate:float=0.1) -> dict:
         """
-        Given a list of (song, artist) pairs, return a dictionary of (song, album) pairs.
+        Given a list of (artist, song) pairs, return the list of albums for a sample of the pairs
+        (None for the pairs that were not sampled).
+        The sampled lookups run concurrently and repeated pairs are only looked up once.
         """
         np.random.seed(235151123) # arbitrary seed
         n = len(artist_song_list)
@@ -99,66 +215,215 @@ class SpotifyClient:
         sampled_ids = np.random.choice(n, sample_size, replace=False)
         sampled_data = [artist_song_list[i] for i in sampled_ids]
         song_albums = [None for _ in range(len(artist_song_list))]
-        song_album_dict = {}
-        #for i, (artist, song) in enumerate(artist_song_list):
-        for i, (artist, song) in enumerate(sampled_data):
-            print(i)
-            if artist in song_album_dict and song in song_album_dict[artist]:
-                song_albums[i] = song_album_dict[artist][song]
-                continue
-            album = self.get_album_from_song(song, artist)
-            #song_albums[i] = album
-            song_albums[sampled_ids[i]] = album
-            song_album_dict[artist] = {}
-            song_album_dict[artist][song] = album
+        albums = self.get_albums_for_tracks(sampled_data)
+        for i, album in zip(sampled_ids, albums):
+            song_albums[i] = album
         return song_albums 
-    
-    def _download_and_write_image(self, image_url:str, image_destination:str) -> None:
+
+    def get_albums_for_tracks(self, artist_song_list:List[Tuple[str, str]]) -> list:
         """
-        Writes the downloaded image to a file
+        The album of every (artist, song) pair, looked up concurrently with each distinct pair looked up once.
+        Pairs whose track id is already in the entity index are fetched in batches of 50 with get_tracks
+        rather than searched for one at a time.
         """
-        response = requests.get(image_url)
+        track_ids = {pair : self._indexed_track_id(*pair) for pair in dict.fromkeys(map(tuple, artist_song_list))}
+        tracks = self.get_tracks([track_id for track_id in track_ids.values() if track_id is not None])
+        indexed_albums = {pair : tracks[track_id]["album"] for pair, track_id in track_ids.items() 
+                          if track_id is not None and tracks[track_id] is not None}
+        to_search = [pair for pair in artist_song_list if tuple(pair) not in indexed_albums]
+        searched = dict(zip(map(tuple, to_search), 
+                            self.engine.map(lambda pair: self.get_album_from_song(pair[1], pair[0]), to_search, key=tuple)))
+        return [indexed_albums[tuple(pair)] if tuple(pair) in indexed_albums else searched[tuple(pair)] for pair in artist_song_list]
+
+    def _indexed_track_id(self, artist_name:str, song_name:str) -> str | None:
+        artist = self._index_get("artist", artist_name)
+        if artist is None:
+            return None
+        track = self._index_get("track", song_name, scope=artist[1])
+        return None if track is None else track[1]
+    
+    def _download_image(self, image_url:str) -> bytes | None:
+        response = self.engine.get(image_url)
         if response.status_code == 200:
-            with open(image_destination, 'wb') as file:
-                file.write(response.content)
-            print(f"Image downloaded successfully to {image_destination}")
-        else:
-            print(f"Failed to download image. Status code: {response.status_code}")
+            return response.content
+        print(f"Failed to download image. Status code: {response.status_code}")
+        return None
 
+    def get_artist_albums(self, artist_id:str) -> list:
+        """
+        Returns the album listing (up to 50 albums) for artist_id.
+        """
+        cached = self._cache_get("artist_albums", artist_id)
+        if cached is not MISS:
+            return cached
+        url = f"{self.base_url}/v1/artists/{artist_id}/albums?limit=50"
+        result = json.loads(self.api_get(url).content)
+        # only keep the fields we use, the full listing is large
+        albums = [{"name" : a["name"], "id" : a["id"], "images" : a["images"]} for a in result["items"]]
+        self._cache_set("artist_albums", artist_id, albums)
+        self._index_add("album", [(a["name"], a["name"], a["id"]) for a in albums], scope=artist_id)
+        return albums
 
-    def get_album_artwork(self, artist_album_list:List[Tuple[str, str]]) -> None:
+    def get_album_artwork(self, artist_album_list:List[Tuple[str, str]], width:int=ARTWORK_WIDTH) -> dict:
         """
-        For every artist in the dataframe, get the album artwork for the top album
-        and write the image to a file.
+        For every (artist, album) get the album artwork and return {(artist, album) : image path}
+        (None when the album could not be found).
         Do this by getting the artist id and making a small number of calls to the API.
+        Repeated pairs are handled once, the pairs run concurrently on the request engine, the
+        image url of each pair is cached and the images are stored in the content addressed
+        artwork cache, so an album's artwork is only ever downloaded once.
+        The smallest image at least width pixels wide is used.
+        """
+        pairs = list(dict.fromkeys((artist, album) for artist, album in artist_album_list))
+        paths = self.engine.map(lambda pair: self._get_album_artwork(pair, width), pairs)
+        return dict(zip(pairs, paths))
+
+    def _get_album_artwork(self, artist_album:Tuple[str, str], width:int) -> str | None:
+        artist, album = artist_album
+        cache_key = normalise_key(artist, album, str(width))
+        image_url = self._cache_get("album_image", cache_key)
+        if image_url is MISS:
+            image_url = self._find_album_image(artist, album, width)
+            self._cache_set("album_image", cache_key, image_url)
+        if image_url is None:
+            return None
+        return self.artwork_cache.fetch(image_url, self._download_image)
+
+    def _find_album_image(self, artist:str, album:str, width:int) -> str | None:
+        artist_id = self.search_for_artist_id(artist)[1]
+        if artist_id is None:
+            return None
+        albums = self.get_artist_albums(artist_id)
+        if len(albums) == 0:
+            return None
+        indexed = self._index_get("album", album, scope=artist_id)
+        album_ids = [a["id"] for a in albums]
+        if indexed is not None and indexed[1] in album_ids:
+            selected_album_idx = album_ids.index(indexed[1])
+        else:
+            selected_album_idx = best_matches([album], [[a["name"] for a in albums]])[0]
+        selected_album_dict = albums[selected_album_idx]
+        image = select_image(selected_album_dict["images"], width)
+        return None if image is None else image["url"]
+
+    def get_tracks(self, track_ids:list) -> dict:
+        """
+        Batched track metadata from the multi-id /v1/tracks endpoint (50 ids per request):
+        {track_id : {"album" : album name, "artists" : [names], "artist_ids" : [ids]}} or None for unknown ids.
         """
-        headers = self.get_auth_header()
-        for artist, album in artist_album_list:
-            artist_id = self.search_for_artist_id(artist)[1]
-            url = f"https://api.spotify.com/v1/artists/{artist_id}/albums?limit=50"
-            result = json.loads(requests.get(url, headers=headers).content)
-            album_names = [a["name"] for a in result["items"]]
-            album_scores = np.array([fuzz.ratio(a, album) for a in album_names])
-            selected_album_idx = np.argmax(album_scores)
-            selected_album_dict = result["items"][selected_album_idx]
-            self._download_and_write_image(selected_album_dict["images"][0]["url"], f"album_artwork/{artist}_{album}.jpg")
-        
+        tracks = {}
+        to_fetch = []
+        for track_id in dict.fromkeys(track_ids):
+            cached = self._cache_get("track", track_id)
+            if cached is not MISS:
+                tracks[track_id] = cached
+            else:
+                to_fetch.append(track_id)
+        chunks = [to_fetch[start:start + MAX_IDS_PER_REQUEST] for start in range(0, len(to_fetch), MAX_IDS_PER_REQUEST)]
+        for chunk_tracks in self.engine.map(self._get_track_chunk, chunks):
+            tracks.update(chunk_tracks)
+        return tracks
+
+    def _get_track_chunk(self, chunk:list) -> dict:
+        url = f"{self.base_url}/v1/tracks"
+        result = self.api_get(url, params={"ids" : ",".join(chunk)})
+        if result.status_code == 400:
+            # an invalid id invalidates the whole batch, retry the ids one at a time
+            if len(chunk) == 1:
+                self._cache_set("track", chunk[0], None)
+                return {chunk[0] : None}
+            return {k : v for track_id in chunk for k, v in self._get_track_chunk([track_id]).items()}
+        tracks = {}
+        for track_id, track in zip(chunk, json.loads(result.content)["tracks"]):
+            if track is not None:
+                self._index_track(track)
+                track = {
+                    "album" : track["album"]["name"],
+                    "artists" : [a["name"] for a in track["artists"]],
+                    "artist_ids" : [a["id"] for a in track["artists"]],
+                }
+            self._cache_set("track", track_id, track)
+            tracks[track_id] = track
+        return tracks
+
     def get_genre_from_artist(self, artist_id:str) -> list :
         """
         Returning an empty list for consistency between output modes on if conditional
         """
-        url = f"https://api.spotify.com/v1/artists/{artist_id}"
-        headers = self.get_auth_header()
-        result = requests.get(url, headers=headers)
+        cached = self._cache_get("artist_genres", str(artist_id))
+        if cached is not MISS:
+            return [] if cached is None else cached
+        url = f"{self.base_url}/v1/artists/{artist_id}"
+        result = self.api_get(url)
         if result.status_code == 400:
             # invalid query
+            self._cache_set("artist_genres", str(artist_id), None)
             return []
         json_result = json.loads(result.content)
         if json_result is not None:
+            self._cache_set("artist_genres", str(artist_id), json_result["genres"])
             return json_result["genres"]
         return []
     
-    def get_genres_from_artist_list(self, artist_list:list) -> list:
+    def get_genres_from_artist_ids(self, artist_ids:list) -> dict:
+        """
+        Batched version of get_genre_from_artist: returns {artist_id : genres}.
+        Uses the multi-id /v1/artists endpoint so that 50 artists cost a single request.
+        Invalid or unknown ids map to [] as in get_genre_from_artist.
+        """
+        genres = {}
+        to_fetch = []
+        for artist_id in dict.fromkeys(artist_ids):
+            if artist_id is None:
+                genres[artist_id] = []
+                continue
+            cached = self._cache_get("artist_genres", str(artist_id))
+            if cached is not MISS:
+                genres[artist_id] = [] if cached is None else cached
+            else:
+                to_fetch.append(artist_id)
+
+        chunks = [to_fetch[start:start + MAX_IDS_PER_REQUEST] for start in range(0, len(to_fetch), MAX_IDS_PER_REQUEST)]
+        for chunk_genres in self.engine.map(self._get_genres_from_artist_id_chunk, chunks):
+            genres.update(chunk_genres)
+        return genres
+
+    def _get_genres_from_artist_id_chunk(self, chunk:list) -> dict:
+        url = f"{self.base_url}/v1/artists"
+        genres = {}
+        result = self.api_get(url, params={"ids" : ",".join(chunk)})
+        if result.status_code == 400:
+            # an invalid id invalidates the whole batch so fall back to one request each
+            for artist_id in chunk:
+                genres[artist_id] = self.get_genre_from_artist(artist_id)
+            return genres
+        # the response preserves the order of the ids, with null for unknown ids
+        for artist_id, artist in zip(chunk, json.loads(result.content)["artists"]):
+            if artist is None:
+                self._cache_set("artist_genres", str(artist_id), None)
+                genres[artist_id] = []
+            else:
+                self._cache_set("artist_genres", str(artist_id), artist["genres"])
+                genres[artist_id] = artist["genres"]
+        return genres
+
+    def get_genres_from_artist_list(self, artist_list:list, batched:bool=True, known_ids:dict=None) -> dict:
+        """
+        Returns {artist : {"genres" : genres, "count" : count}} for the artist names in artist_list.
+        When batched, the artist ids are collected first and the genres are fetched
+        50 at a time with get_genres_from_artist_ids rather than one request per artist.
+        known_ids {artist : artist id} skips the search for those artists (batched only).
+        """
+        if batched:
+            counts = Counter(artist_list)
+            known_ids = {} if known_ids is None else known_ids
+            to_search = [artist for artist in counts if artist not in known_ids]
+            searched = self.search_for_artist_ids(to_search)
+            artist_ids = {artist : known_ids[artist] for artist in counts if artist in known_ids}
+            artist_ids.update({artist : searched[artist][1] for artist in to_search})
+            id_genres = self.get_genres_from_artist_ids(list(artist_ids.values()))
+            return {artist : {"genres" : id_genres[artist_ids[artist]], "count" : count} for artist, count in counts.items()}
+
         artist_genres = {}
         for artist in artist_list:
             if artist in artist_genres.keys():
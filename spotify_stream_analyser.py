@@ -0,0 +1,114 @@
+import pandas as pd
+import streamlit as st
+from typing import Tuple
+from datasketches import frequent_strings_sketch, frequent_items_error_type
+from streaming_history import iter_history_frames, filter_plays
+from time_window import TimeWindow
+
+DIMENSIONS = {
+    # dimension : (dataframe column, label used in the output frames)
+    "artist" : ("artistName", "Artist"),
+    "song" : ("trackName", "Track"),
+    "podcast" : ("artistName", "Podcast"),
+}
+MEASURES = ("plays", "ms")
+PODCAST_MINUTES = 10. # same rule as SpotifyUnwrapped.finalise_dataframes
+
+
+class SpotifyStreamAnalyser:
+    """
+    Analyses the spotify data in a streaming fashion.
+    Keeps a frequent items (Misra-Gries) sketch of the number of plays and of the
+    time played for each of artists, songs and podcasts.  The sketches are updated
+    in one pass, use memory proportional to 2**lg_max_k rather than to the size of
+    the history and can be merged across files and months.
+    Counts are exact while the number of distinct items is below 0.75*2**lg_max_k,
+    otherwise every estimate comes with a lower and upper bound.
+    """
+
+    def __init__(self, lg_max_k:int=10, top_k_artists:int=5, top_k_songs:int=10, window:TimeWindow=None) -> None:
+        """
+        window selects the plays that update_file keeps (the 2023 Wrapped window by default).
+        """
+        self.window = TimeWindow.wrapped(2023) if window is None else window
+        self.lg_max_k = lg_max_k
+        self.top_k_artists = top_k_artists
+        self.top_k_songs = top_k_songs
+        self.top_ks = {"artist" : top_k_artists, "song" : top_k_songs, "podcast" : top_k_artists}
+        self.sketches = {(d, m) : frequent_strings_sketch(lg_max_k) for d in DIMENSIONS for m in MEASURES}
+
+    def update(self, df:pd.DataFrame) -> None:
+        """
+        Add a chunk of (already filtered) plays, eg. the output of SpotifyUnwrapped.json_batch_update.
+        Each chunk is pre-aggregated so the sketches see one update per distinct key.
+        """
+        podcasts = df["minsPlayed"] > PODCAST_MINUTES
+        for dimension, (column, _) in DIMENSIONS.items():
+            part = df[podcasts] if dimension == "podcast" else df[~podcasts]
+            if len(part) == 0:
+                continue
+            agg = part.groupby(column, sort=False)["msPlayed"].agg(["size", "sum"])
+            plays, ms = self.sketches[(dimension, "plays")], self.sketches[(dimension, "ms")]
+            for key, n, total_ms in zip(agg.index, agg["size"], agg["sum"]):
+                plays.update(str(key), int(n))
+                if total_ms > 0:
+                    ms.update(str(key), int(total_ms))
+
+    def update_file(self, fname:str | st.runtime.uploaded_file_manager.UploadedFile, chunk_rows:int=50_000) -> None:
+        """
+        Stream a StreamingHistory file into the sketches without holding it in memory.
+        """
+        if isinstance(fname, str):
+            with open(fname, "rb") as f:
+                for df in iter_history_frames(f, chunk_rows):
+                    self.update(filter_plays(df, self.window))
+        elif isinstance(fname, st.runtime.uploaded_file_manager.UploadedFile):
+            for df in iter_history_frames(fname, chunk_rows):
+                self.update(filter_plays(df, self.window))
+        else:
+            raise TypeError("Only str or Streamlit UploadedFile are acceptable.")
+
+    def merge(self, other:"SpotifyStreamAnalyser") -> None:
+        """
+        Merge the sketches of other (eg. a different file or month) into this analyser.
+        """
+        for k, sk in self.sketches.items():
+            sk.merge(other.sketches[k])
+
+    def serialize(self) -> dict:
+        return {f"{d}_{m}" : sk.serialize() for (d, m), sk in self.sketches.items()}
+
+    @classmethod
+    def deserialize(cls, data:dict, **kwargs) -> "SpotifyStreamAnalyser":
+        analyser = cls(**kwargs)
+        for (d, m) in analyser.sketches:
+            analyser.sketches[(d, m)] = frequent_strings_sketch.deserialize(data[f"{d}_{m}"])
+        return analyser
+
+    def get_top_k(self, dimension:str, measure:str, k:int=None) -> pd.DataFrame:
+        """
+        Returns the top k items by estimate with the lower and upper bounds on their true value.
+        Ties are broken by item name.
+        """
+        k = self.top_ks[dimension] if k is None else k
+        items = self.sketches[(dimension, measure)].get_frequent_items(frequent_items_error_type.NO_FALSE_NEGATIVES, 0)
+        items = sorted(items, key=lambda x: (-x[1], x[0]))[:k]
+        return pd.DataFrame(items, columns=["item", "estimate", "lower_bound", "upper_bound"])
+
+    def _top_k_frames(self, dimension:str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        label = DIMENSIONS[dimension][1]
+        num_plays = self.get_top_k(dimension, "plays")[["item", "estimate"]]
+        num_plays = num_plays.rename(columns={"item" : label, "estimate" : "Streams"})
+        cum_time = self.get_top_k(dimension, "ms")[["item", "estimate"]]
+        cum_time = cum_time.rename(columns={"item" : label, "estimate" : "Time (hours)"})
+        cum_time["Time (hours)"] = cum_time["Time (hours)"]/(60*60*1000)
+        return num_plays, cum_time
+
+    def get_yearly_top_artists(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        return self._top_k_frames("artist")
+
+    def get_yearly_top_songs(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        return self._top_k_frames("song")
+
+    def get_yearly_top_podcasts(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        return self._top_k_frames("podcast")
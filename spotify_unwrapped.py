@@ -1,9 +1,42 @@
 import json
+import threading
 import pandas as pd 
+import numpy as np
 import streamlit as st
-from typing import Tuple, List
+from typing import Dict, Tuple, List
 from tabulate import tabulate
 from spotify_client import SpotifyClient
+from aggregation import aggregate_plays, top_k_from_aggregates, top_k_tables
+from album_estimation import estimate_album_shares
+from ingest_cache import IngestCache
+from aggregate_state import AggregateState
+from streaming_history import iter_history_frames, empty_history_frame, filter_plays, is_extended, records_to_frame, MIN_MINUTES
+from time_window import TimeWindow, wrapped_windows
+from genre_matrix import GenreMatrix
+from time_cube import TimeCube
+from parquet_history import ParquetHistory
+from instrumentation import timed, metrics as default_metrics
+
+
+def artist_ids_from_uris(spotify_client:SpotifyClient, artists:List[str], track_uris:dict) -> dict:
+    """
+    {artistName : artist id} for the artists with a track id in track_uris ({(artistName, trackName) : track id}),
+    from one batched get_tracks call.
+    """
+    artist_uri = {}
+    for (artist, _), uri in track_uris.items():
+        artist_uri.setdefault(artist, uri)
+    artists = [a for a in artists if a in artist_uri]
+    tracks = spotify_client.get_tracks([artist_uri[a] for a in artists]) if artists else {}
+    artist_ids = {}
+    for artist in artists:
+        track = tracks.get(artist_uri[artist])
+        if track is None:
+            continue
+        # prefer the credited artist with the same name (features are also listed)
+        matches = [i for name, i in zip(track["artists"], track["artist_ids"]) if name.lower() == artist.lower()]
+        artist_ids[artist] = matches[0] if matches else track["artist_ids"][0]
+    return artist_ids
 
 
 class SpotifyUnwrapped:
@@ -11,23 +44,96 @@ class SpotifyUnwrapped:
     Class to analyse the data from the Spotify user data.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, spotify_client:SpotifyClient=None, ingest_cache:IngestCache=None, window:TimeWindow=None) -> None:
         """
         We set self.top_k_artists = 5 for consistency with the Spotfy Wrapped product.
         However, self.top_k_songs = 10 is set srbitrarily.
+        A spotify_client can be passed in to share one between instances, otherwise the default
+        client is created on first use so the offline stages never construct one.
+        If an ingest_cache is given, json_batch_update reads previously seen files from it.
+        window is the time window of the plays that are kept, by default the 2023 Wrapped window.
+        The stage timings are recorded on the client's metrics (see instrumentation.py).
         """
         self.top_k_artists = 5
         self.top_k_songs = 10
         self.top_ks = {"artist" : self.top_k_artists, "songs": self.top_k_songs, "album" : self.top_k_artists}
         self.dataframes_finalised = False
-        self.spotify_client = SpotifyClient()   
+        self.compact = False
+        self.ingest_cache = ingest_cache
+        self.window = TimeWindow.wrapped(2023) if window is None else window
+        self.state = None
+        self.dataset = None
+        self._genre_matrix = None
+        self.time_cube = None
+        self._spotify_client = spotify_client
+        self._client_lock = threading.Lock() # the app runs stages that need the client concurrently
+        self.metrics = getattr(spotify_client, "metrics", default_metrics)
+
+    @property
+    def spotify_client(self) -> SpotifyClient:
+        if self._spotify_client is None:
+            with self._client_lock:
+                if self._spotify_client is None:
+                    self._spotify_client = SpotifyClient()
+        return self._spotify_client
 
-    def json_batch_update(self, fname:str | st.runtime.uploaded_file_manager.UploadedFile) -> pd.DataFrame:
+    @timed("ingest")
+    def json_batch_update(self, fname:str | st.runtime.uploaded_file_manager.UploadedFile, streaming:bool=False, 
+                          chunk_rows:int=50_000) -> pd.DataFrame:
         """
         Update the json file with the new data.
         Cleans the data so that it is in a format that is suitable to analyse 
         according to Spotify Wrapped requirements.
+        With streaming=True the file is parsed incrementally chunk_rows records at a time
+        so that the peak memory does not scale with the file size.
+        """
+        if self.ingest_cache is None:
+            return self._json_update(fname, streaming, chunk_rows)
+        if not isinstance(fname, (str, st.runtime.uploaded_file_manager.UploadedFile)):
+            raise TypeError("Only str or Streamlit UploadedFile are acceptable.")
+        key = self.ingest_cache.key(fname, self._ingest_params())
+        df = self.ingest_cache.load(key)
+        if df is None:
+            df = self._json_update(fname, streaming, chunk_rows)
+            self.ingest_cache.store(key, df)
+        return df
+
+    @timed("append")
+    def append_update(self, fnames:List[str | st.runtime.uploaded_file_manager.UploadedFile], state_path:str, 
+                      resolve_albums:bool=False, resolve_genres:bool=False) -> int:
+        """
+        Incremental alternative to json_batch_update + finalise_dataframes for adding a new export.
+        The aggregate state saved at state_path (see aggregate_state.AggregateState) is loaded, only
+        the plays of fnames that are newer than what it has already ingested are merged in and the
+        state is saved again, so adding a month costs time in the size of that month.
+        With resolve_albums/resolve_genres only the new tracks/artists are looked up.
+        The get_yearly_top_* methods then answer from the state.  Returns the number of plays added.
         """
+        if self.state is None or self.state.path != state_path:
+            self.state = AggregateState.load(state_path, self.window)
+        added = self.state.append([self.json_batch_update(fname) for fname in fnames])
+        if resolve_albums:
+            unresolved = self.state.unresolved_tracks()
+            if unresolved:
+                self.state.albums.update(zip(unresolved, self.spotify_client.get_albums_for_tracks(unresolved)))
+        if resolve_genres:
+            unresolved = self.state.unresolved_artists()
+            if unresolved:
+                genres = self.spotify_client.get_genres_from_artist_list(unresolved, batched=True)
+                self.state.genres.update({artist : genres[artist]["genres"] for artist in unresolved})
+        self.state.save()
+        return added
+
+    def _ingest_params(self) -> dict:
+        """
+        Everything other than the file contents that changes the json_batch_update output.
+        """
+        return {"window" : self.window.params(), "min_minutes" : MIN_MINUTES, "schema" : 2}
+
+    def _json_update(self, fname:str | st.runtime.uploaded_file_manager.UploadedFile, streaming:bool, 
+                     chunk_rows:int) -> pd.DataFrame:
+        if streaming:
+            return self.json_stream_update(fname, chunk_rows)
         if isinstance(fname, str):
             with open(fname) as fname:
                 json_data = json.load(fname)
@@ -36,19 +142,47 @@ class SpotifyUnwrapped:
         else:
             raise TypeError("Only str or Streamlit UploadedFile are acceptable.")
 
+        if len(json_data) > 0 and is_extended(json_data[0]):
+            return self._filter_plays(records_to_frame(json_data))
         df = pd.json_normalize(json_data)
         df['endTime'] = pd.to_datetime(df['endTime'], format='%Y-%m-%d %H:%M')
         df["minsPlayed"] = df["msPlayed"]/(60*1000) 
-        df = df[df["endTime"].dt.strftime("%Y") == "2023"]
-        df = df[df["endTime"].dt.strftime("%m") < "11"]
-        df = df[df["minsPlayed"] > 0.5]
-        return df
+        return self._filter_plays(df)
+
+    def json_stream_update(self, fname:str | st.runtime.uploaded_file_manager.UploadedFile, chunk_rows:int=50_000) -> pd.DataFrame:
+        """
+        Incremental version of json_batch_update giving the same dataframe.
+        Each chunk of records is converted straight to typed columns and filtered
+        before the next chunk is read, so only the filtered rows are kept.
+        """
+        if isinstance(fname, str):
+            with open(fname, "rb") as f:
+                return self._stream_filtered_chunks(f, chunk_rows)
+        elif isinstance(fname, st.runtime.uploaded_file_manager.UploadedFile):
+            return self._stream_filtered_chunks(fname, chunk_rows)
+        else:
+            raise TypeError("Only str or Streamlit UploadedFile are acceptable.")
+
+    def _stream_filtered_chunks(self, f, chunk_rows:int) -> pd.DataFrame:
+        dfs = [self._filter_plays(df) for df in iter_history_frames(f, chunk_rows)]
+        if len(dfs) == 0:
+            return empty_history_frame()
+        return pd.concat(dfs, axis=0)
+
+    def _filter_plays(self, df:pd.DataFrame) -> pd.DataFrame:
+        return filter_plays(df, self.window)
     
-    def finalise_dataframes(self, dfs:List[pd.DataFrame]) -> None:
+    @timed("finalise")
+    def finalise_dataframes(self, dfs:List[pd.DataFrame], compact:bool=False) -> None:
         """
         Sets the self.dataframes_finalised to True and separates the data into songs
         and podcasts using a simple rule of 10. minutes.
         To do: add more sophisticated approach to separate podcasts and songs.
+        With compact=True the names are stored as categoricals, msPlayed as int32
+        (minsPlayed stays float64 so the results are unchanged) and the songs are put before the podcasts (keeping their order) so that
+        song_df/podcast_df are row slices of self.df (views) rather than copies.
+        Also builds self.time_cube, the (artist, month, weekday, hour) rollup of the songs
+        that answers the listening over time views (see time_cube.TimeCube).
         """
         if isinstance(dfs, pd.DataFrame):
             df = dfs 
@@ -60,10 +194,83 @@ class SpotifyUnwrapped:
             else:
                 df = pd.concat(dfs, axis=0)
         self.dataframes_finalised = True
+        self.compact = compact
+        self.dataset = None
+        self._genre_matrix = None
+        if compact:
+            df = self._compact(df)
+            songs = (df["minsPlayed"] <= 10.).to_numpy()
+            df = df.iloc[np.concatenate([np.flatnonzero(songs), np.flatnonzero(~songs)])]
         
         self.df = df#.iloc[:250] # remove for debugging later
-        self.song_df = self.df[self.df["minsPlayed"] <= 10.]
-        self.podcast_df = df[df["minsPlayed"] > 10.]
+        self.song_mask = (self.df["minsPlayed"] <= 10.).to_numpy()
+        self.podcast_mask = ~self.song_mask
+        if compact:
+            n_songs = int(self.song_mask.sum())
+            self._song_df = self.df.iloc[:n_songs]
+            self._podcast_df = self.df.iloc[n_songs:]
+        else:
+            self._song_df = self.df[self.song_mask]
+            self._podcast_df = self.df[self.podcast_mask]
+        self.time_cube = TimeCube.from_plays(self.song_df, "artistName")
+
+    @timed("finalise")
+    def finalise_dataset(self, path:str, batch_rows:int=None) -> None:
+        """
+        Out of core alternative to finalise_dataframes for histories larger than memory (eg. multi-year
+        extended histories or many users' exports): the top k artists, songs, podcasts and albums
+        (exact and adaptive modes) are answered by scanning the Parquet dataset at path
+        (see parquet_history.write_history_dataset) with the window pushed down and bounded memory.
+        The results are the same as finalise_dataframes on the same plays.
+        """
+        kwargs = {} if batch_rows is None else {"batch_rows" : batch_rows}
+        self.dataset = ParquetHistory(path, self.window, **kwargs)
+        self.dataframes_finalised = False
+        self._genre_matrix = None
+        self.time_cube = None
+
+    def _compact(self, df:pd.DataFrame) -> pd.DataFrame:
+        """
+        Dictionary encodes the name columns and narrows msPlayed.
+        """
+        return df.astype({
+            "artistName" : "category", 
+            "trackName" : "category",
+            "msPlayed" : "int32", # ~24 days
+        })
+
+    @property
+    def song_df(self) -> pd.DataFrame:
+        return self._song_df
+
+    @property
+    def podcast_df(self) -> pd.DataFrame:
+        return self._podcast_df
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the finalised dataframes (including the strings).
+        """
+        assert self.dataframes_finalised, "Dataframes have not been finalised."
+        frames = [self.df] if self.compact else [self.df, self._song_df, self._podcast_df]
+        return int(sum(df.memory_usage(deep=True).sum() for df in frames) + self.song_mask.nbytes + self.podcast_mask.nbytes)
+
+    def wrapped_by_year(self, full_year:bool=False) -> Dict[int, "SpotifyUnwrapped"]:
+        """
+        One finalised SpotifyUnwrapped per year in the data, all sharing this spotify client.
+        Ingest with window=TimeWindow.all_time() (or a multi-year window) to get every year from a single ingest.
+        Each year uses the Wrapped window (January to October) unless full_year is True.
+        """
+        assert self.dataframes_finalised, "Dataframes have not been finalised."
+        yearly = {}
+        for year, window in wrapped_windows(self.df["endTime"], full_year).items():
+            unwrapped = SpotifyUnwrapped(spotify_client=self.spotify_client, window=window)
+            unwrapped.top_k_artists, unwrapped.top_k_songs, unwrapped.top_ks = self.top_k_artists, self.top_k_songs, self.top_ks
+            year_df = window.filter(self.df)
+            if len(year_df) > 0:
+                unwrapped.finalise_dataframes(year_df, compact=self.compact)
+                yearly[year] = unwrapped
+        return yearly
 
     def get_total_num_songs(self, df:pd.DataFrame) -> int:
         """
@@ -71,90 +278,251 @@ class SpotifyUnwrapped:
         """
         return df["trackName"].nunique()
     
+    @timed("top_artists")
     def get_yearly_top_artists(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """
-        Get the top artists from the dataframe.
+        Get the top artists from the dataframe (or from the Parquet dataset after finalise_dataset,
+        or from the aggregate state after append_update).
         """
+        if self.dataset is not None:
+            return self.dataset.get_top_k("artist", self.top_k_artists)
+        if self.state is not None and not self.dataframes_finalised:
+            return self.state.get_top_k("artist", self.top_k_artists)
         assert self.dataframes_finalised, "Dataframes have not been finalised."
-        top_artists_num_plays = self.song_df[["artistName"]].value_counts().head(self.top_k_artists)#.index.tolist()
-        top_artists_cum_time = self.song_df.groupby("artistName").agg({"minsPlayed": "sum"}).sort_values(by="minsPlayed", ascending=False).head(self.top_k_artists)#.index.tolist()
-
-        # reset headers for compatibility with Altair
-        top_artists_num_plays = top_artists_num_plays.reset_index().rename(columns={"count" : "Streams", "artistName" : "Artist"})
-        top_artists_cum_time = top_artists_cum_time.reset_index().rename(columns={"minsPlayed" : "Time (hours)", "artistName" : "Artist"})
-        top_artists_cum_time["Time (hours)"] /= 60
-        return top_artists_num_plays, top_artists_cum_time
+        return top_k_tables(self.song_df, ["artistName"], self.top_k_artists, {"artistName" : "Artist"})
     
+    @timed("top_songs")
     def get_yearly_top_songs(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        if self.dataset is not None:
+            return self.dataset.get_top_k("song", self.top_k_songs)
+        if self.state is not None and not self.dataframes_finalised:
+            return self.state.get_top_k("song", self.top_k_songs)
         assert self.dataframes_finalised, "Dataframes have not been finalised."
-        top_songs_num_plays = self.song_df[["trackName"]].value_counts().head(self.top_k_songs)#.index.tolist()
-        top_songs_cum_time = self.song_df.groupby("trackName").agg({"minsPlayed": "sum"}).sort_values(by="minsPlayed", ascending=False).head(self.top_k_songs)#.index.tolist()
-
-        # reset headers for compatibility with Altair
-        top_songs_num_plays = top_songs_num_plays.reset_index().rename(columns={"count" : "Streams", "trackName" : "Track"})
-        top_songs_cum_time = top_songs_cum_time.reset_index().rename(columns={"minsPlayed" : "Time (hours)", "trackName" : "Track"})
-        top_songs_cum_time["Time (hours)"] /= 60
-        return top_songs_num_plays, top_songs_cum_time
+        return top_k_tables(self.song_df, ["trackName"], self.top_k_songs, {"trackName" : "Track"})
     
+    @timed("top_podcasts")
     def get_yearly_top_podcasts(self) -> pd.DataFrame:
+        if self.dataset is not None:
+            return self.dataset.get_top_k("podcast", self.top_k_artists)
+        if self.state is not None and not self.dataframes_finalised:
+            return self.state.get_top_k("podcast", self.top_k_artists)
         assert self.dataframes_finalised, "Dataframes have not been finalised."
-        top_podcasts_num_plays = self.podcast_df[["artistName"]].value_counts().head(self.top_k_artists)
-        top_podcast_cum_time = self.podcast_df.groupby("artistName").agg({"minsPlayed": "sum"}).sort_values(by="minsPlayed", ascending=False).head(self.top_k_artists)  
-
-        # reset headers for compatibility with Altair
-        top_podcasts_num_plays = top_podcasts_num_plays.reset_index().rename(columns={"count" : "Streams", "artistName" : "Podcast"})
-        top_podcast_cum_time = top_podcast_cum_time.reset_index().rename(columns={"minsPlayed" : "Time (hours)", "artistName" : "Podcast"})
-        top_podcast_cum_time["Time (hours)"] /= 60
-        return top_podcasts_num_plays, top_podcast_cum_time
+        return top_k_tables(self.podcast_df, ["artistName"], self.top_k_artists, {"artistName" : "Podcast"})
     
-    def get_yearly_top_albums(self, sample_rate:float=0.01) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    @timed("top_albums")
+    def get_yearly_top_albums(self, sample_rate:float=0.01, mode:str="sample", confidence:float=0.95, 
+                              max_lookups:int=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """
-        To do: Replace with sampling for this step to avoid querying everything.
+        mode="sample" looks up the albums of a uniform sample_rate sample of the plays.
+        mode="exact" looks up every distinct (artist, track) once and counts every play.
+        mode="adaptive" samples distinct tracks weighted by plays (and by minutes for the time table)
+        and stops looking up albums once the top k is stable at the given confidence
+        (see album_estimation.estimate_album_shares).  The estimates have "Share", "Share lower"
+        and "Share upper" columns giving the confidence interval on the album's share.
+        After append_update (without finalised dataframes) the albums resolved in the state are used.
+        After finalise_dataset only the exact and adaptive modes are available.
         """
+        if self.dataset is None and self.state is not None and not self.dataframes_finalised:
+            return self.state.get_top_k("album", self.top_ks["album"])
+        assert self.dataframes_finalised or self.dataset is not None, "Dataframes have not been finalised."
+        if mode == "adaptive":
+            return self._get_adaptive_top_albums(confidence, max_lookups)
+        if mode == "exact":
+            return self._get_exact_top_albums()
+        assert mode == "sample", f"Unknown album mode {mode}."
+        assert self.dataset is None, "The sample mode needs the finalised dataframes, use the exact or adaptive mode."
         assert 0 < sample_rate <= 1, "Sample rate must be between 0 and 1."
-        assert self.dataframes_finalised, "Dataframes have not been finalised."
-        artist_song_list = list(self.song_df[["artistName", "trackName"]].itertuples(index=False, name=None))
-        album_list = self.spotify_client.get_album_from_song_list(artist_song_list, sample_rate)
-        self.song_df["albumName"] = album_list
-        sampled_albums = self.song_df[self.song_df["albumName"].notna()]
-       
+        song_df = self.song_df
+        artist_song_list = list(song_df[["artistName", "trackName"]].itertuples(index=False, name=None))
+        album_list = pd.Series(self.spotify_client.get_album_from_song_list(artist_song_list, sample_rate), dtype=object)
+        sampled = album_list.notna().to_numpy()
+        sampled_albums = song_df[sampled].assign(albumName=album_list[sampled].to_numpy())
 
         # can ignore the None values as they are not in the top k anyway
-        top_albums_num_plays = sampled_albums[["artistName", "albumName"]].value_counts().head(self.top_ks["album"])
-        top_albums_cum_time = sampled_albums.groupby(["artistName", "albumName"]).agg({"minsPlayed": "sum"}).sort_values(by="minsPlayed", ascending=False).head(self.top_ks["album"])  
-       
-
-        # reset headers for consistency
-        top_albums_num_plays = top_albums_num_plays.reset_index().rename(columns={"count" : "Streams", "albumName" : "Album", "artistName" : "Artist"})
-        top_albums_cum_time = top_albums_cum_time.reset_index().rename(columns={"minsPlayed" : "Time (hours)", "albumName" : "Album", "artistName" : "Artist"})
-        top_albums_cum_time["Time (hours)"] /= 60
-        return top_albums_num_plays, top_albums_cum_time
+        return top_k_tables(sampled_albums, ["artistName", "albumName"], self.top_ks["album"], 
+                            {"albumName" : "Album", "artistName" : "Artist"})
+
+    def _track_aggregates(self) -> pd.DataFrame:
+        """
+        plays and minutes per (artistName, trackName) of the songs.
+        """
+        if self.dataset is not None:
+            return self.dataset.track_aggregates()
+        return aggregate_plays(self.song_df, ["artistName", "trackName"])
+
+    def _get_exact_top_albums(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        tracks = self._track_aggregates()
+        self.track_albums = self.get_track_albums(tracks.index)
+        tracks = tracks.assign(albumName=self.track_albums["albumName"].to_numpy())
+        albums = tracks[tracks["albumName"].notna()].groupby(["artistName", "albumName"], sort=True, observed=True)[["plays", "minutes"]].sum()
+        return top_k_from_aggregates(albums, self.top_ks["album"], {"albumName" : "Album", "artistName" : "Artist"})
+
+    def get_track_albums(self, keys:pd.MultiIndex | List[Tuple[str, str]]) -> pd.DataFrame:
+        """
+        Looks up the album of each distinct (artistName, trackName) once through the client's
+        concurrent pool. Returns a frame with artistName, trackName and albumName columns.
+        """
+        pairs = list(dict.fromkeys((str(a), str(t)) for a, t in keys))
+        albums = self._resolve_albums(pairs)
+        return pd.DataFrame({
+            "artistName" : [a for a, _ in pairs],
+            "trackName" : [t for _, t in pairs],
+            "albumName" : pd.Series(albums, dtype=object),
+        })
+
+    def _track_uris(self) -> dict:
+        """
+        {(artistName, trackName) : track id} from the extended history, empty for the basic history.
+        """
+        if self.dataset is not None:
+            return self.dataset.track_uris()
+        if "trackUri" not in self.df.columns:
+            return {}
+        uris = self.df[self.df["trackUri"].notna()][["artistName", "trackName", "trackUri"]].astype(object)
+        uris = uris.drop_duplicates(["artistName", "trackName"])
+        return dict(zip(zip(uris["artistName"], uris["trackName"]), uris["trackUri"]))
+
+    def _resolve_albums(self, pairs:List[Tuple[str, str]]) -> list:
+        """
+        Albums for (artist, track) pairs: from the batched track endpoint when the history has
+        the track ids (no search and no ambiguous names), otherwise by searching.
+        """
+        uris = self._track_uris()
+        with_uri = [p for p in pairs if p in uris]
+        tracks = self.spotify_client.get_tracks([uris[p] for p in with_uri]) if with_uri else {}
+        albums = {p : None if tracks.get(uris[p]) is None else tracks[uris[p]]["album"] for p in with_uri}
+        searched = [p for p in pairs if p not in uris]
+        albums.update(zip(searched, self.spotify_client.get_albums_for_tracks(searched) if searched else []))
+        return [albums[p] for p in pairs]
+
+    def _artist_ids_from_uris(self, artists:List[str]) -> dict:
+        """
+        {artistName : artist id} for the artists that have a track id in the history.
+        """
+        return artist_ids_from_uris(self.spotify_client, artists, self._track_uris())
+
+    def add_albums_to_df(self, df:pd.DataFrame, track_albums:pd.DataFrame=None) -> pd.DataFrame:
+        """
+        Adds an albumName column to df with a vectorised join on (artistName, trackName).
+        Uses the albums found by the exact mode unless track_albums is given.
+        """
+        track_albums = self.track_albums if track_albums is None else track_albums
+        keys = pd.MultiIndex.from_frame(df[["artistName", "trackName"]].astype(object))
+        lookup = pd.MultiIndex.from_frame(track_albums[["artistName", "trackName"]])
+        positions = lookup.get_indexer(keys)
+        albums = track_albums["albumName"].to_numpy()[positions]
+        albums[positions == -1] = None
+        return df.assign(albumName=albums)
+
+    def _get_adaptive_top_albums(self, confidence:float, max_lookups:int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        tracks = self._track_aggregates()
+        track_list = [(str(a), str(t)) for a, t in tracks.index]
+        resolved = {}
+        def resolve(pairs):
+            # the plays and minutes estimates share the lookups
+            missing = [p for p in pairs if p not in resolved]
+            resolved.update(zip(missing, self._resolve_albums(missing)))
+            return [resolved[p] for p in pairs]
+
+        k = self.top_ks["album"]
+        self.album_estimates = {}
+        tables = []
+        for measure, label, total in [("plays", "Streams", tracks["plays"].sum()), ("minutes", "Time (hours)", tracks["minutes"].sum()/60)]:
+            estimate = estimate_album_shares(track_list, tracks[measure].to_numpy(), resolve, k=k, 
+                                             confidence=confidence, max_lookups=max_lookups)
+            self.album_estimates[measure] = estimate
+            top = estimate.shares.head(k)
+            table = pd.DataFrame({
+                "Artist" : top["artistName"],
+                "Album" : top["albumName"],
+                label : top["share"]*total,
+                "Share" : top["share"],
+                "Share lower" : top["lower"],
+                "Share upper" : top["upper"],
+            })
+            if label == "Streams":
+                table[label] = table[label].round().astype("int64")
+            tables.append(table.reset_index(drop=True))
+        return tables[0], tables[1]
     
-    def get_yearly_album_artwork(self, df:pd.DataFrame) -> None:
+    @timed("album_artwork")
+    def get_yearly_album_artwork(self, df:pd.DataFrame) -> dict:
         """
-        For every artist in the top album dataframe, get the album artwork and return the filepath
-        so that streamlit can display it.
+        For every artist in the top album dataframe, get the album artwork and return the filepaths
+        {(artist, album) : path} so that streamlit can display them.
+        Pass all of the album frames at once (eg. pd.concat) so that shared albums are only fetched once.
         """
-        artist_albums = df[["Artist", "Album"]]
-        artist_album_list = []
-        for _, row in artist_albums.iterrows():
-            artist_album_list.append((row["Artist"], row["Album"]))
-        self.spotify_client.get_album_artwork(artist_album_list)
+        artist_album_list = list(df[["Artist", "Album"]].itertuples(index=False, name=None))
+        return self.spotify_client.get_album_artwork(artist_album_list)
 
+    @timed("genres")
     def add_genres_to_df(self, df:pd.DataFrame) -> pd.DataFrame:
         """
         Add the genres to the dataframe.
         """
         all_artists = list(df["artistName"].unique())
         #Slow! -->artist_to_genres = {a : a["genres"] for a in spotify_client.get_genres_from_artist_list(all_artists[:10])}
-        resp = self.spotify_client.get_genres_from_artist_list(all_artists)
+        known_ids = self._artist_ids_from_uris(all_artists) if self.dataframes_finalised else {}
+        resp = self.spotify_client.get_genres_from_artist_list(all_artists, batched=True, known_ids=known_ids)
         genre_df = pd.DataFrame(resp).T
         genre_df.drop(columns=["count"], inplace=True)
         genre_df.reset_index()
         genre_dict = genre_df.to_dict()["genres"]
-        df["genres"] = df['artistName'].map(genre_dict) 
+        df["genres"] = df['artistName'].astype(object).map(genre_dict) 
         return df
     
+    def get_genre_matrix(self) -> GenreMatrix:
+        """
+        The sparse artist x genre matrix of the song artists.  The genres are looked up once per
+        finalise (from the aggregate state's resolved genres after append_update with resolve_genres).
+        """
+        if self.dataset is None and self.state is not None and not self.dataframes_finalised:
+            return GenreMatrix.from_genres(self.state.genres)
+        assert self.dataframes_finalised or self.dataset is not None, "Dataframes have not been finalised."
+        if self._genre_matrix is None:
+            if self.dataset is not None:
+                artists = list(self.dataset.aggregate(["artistName"]).index)
+            else:
+                artists = list(self.song_df["artistName"].astype(object).unique())
+            known_ids = self._artist_ids_from_uris(artists)
+            resp = self.spotify_client.get_genres_from_artist_list(artists, batched=True, known_ids=known_ids)
+            self._genre_matrix = GenreMatrix.from_genres({artist : resp[artist]["genres"] for artist in artists})
+        return self._genre_matrix
+
+    @timed("top_genres")
+    def get_yearly_top_genres(self, k:int=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        The top k genres (default top_k_artists) by streams and by time.  A play counts towards
+        every genre of its artist.
+        """
+        k = self.top_k_artists if k is None else k
+        genre_matrix = self.get_genre_matrix()
+        if self.dataset is not None:
+            artist_agg = self.dataset.aggregate(["artistName"])
+        elif self.state is not None and not self.dataframes_finalised:
+            artist_agg = self.state.songs.groupby(level="artistName", sort=True).sum()
+        else:
+            artist_agg = aggregate_plays(self.song_df, ["artistName"])
+        return genre_matrix.top_k(artist_agg, k)
+
+    @timed("monthly_genres")
+    def get_monthly_genre_shares(self, genres:List[str]=None) -> pd.DataFrame:
+        """
+        Long frame (month, genre, plays, minutes, plays_share, minutes_share) of the share of each month's
+        listening by artists with each genre (see GenreMatrix.period_shares), restricted to genres if given.
+        Needs the finalised dataframes (the aggregate state does not keep the play times).
+        """
+        assert self.dataframes_finalised, "Dataframes have not been finalised."
+        genre_matrix = self.get_genre_matrix()
+        df = self.song_df
+        months = pd.DataFrame({
+            "month" : df["endTime"].to_numpy().astype("datetime64[M]").astype("datetime64[ns]"),
+            "artistName" : df["artistName"].to_numpy(),
+            "minsPlayed" : df["minsPlayed"].to_numpy(),
+        })
+        shares = genre_matrix.period_shares(aggregate_plays(months, ["month", "artistName"]), genres)
+        return shares.rename(columns={"period" : "month"})
+
     # def get_yearly_top_genres(self, df:pd.DataFrame) -> list:
     #     artist_to_genres = []
         #resp = self.spotify_client.get_genres_from_artist_list(all_artists)
@@ -0,0 +1,156 @@
+import json
+import codecs
+import numpy as np
+import pandas as pd
+from typing import IO, Iterator, List
+from time_window import TimeWindow
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+MIN_MINUTES = 0.5 # plays shorter than 30 seconds are not counted
+
+
+def _read_text(fobj:IO, chunk_size:int) -> Iterator[str]:
+    """
+    Yields decoded text chunks from either a text or binary file object (eg. a Streamlit UploadedFile).
+    The file is not closed so that an UploadedFile can be read again on a rerun.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    while True:
+        chunk = fobj.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+
+def iter_json_array(fobj:IO, chunk_size:int=1 << 20) -> Iterator[dict]:
+    """
+    Incrementally parses a top level json array of objects (the StreamingHistory format)
+    holding at most one read chunk plus one partial record in memory.
+    """
+    chunks = _read_text(fobj, chunk_size)
+    buf, pos, exhausted = "", 0, False
+
+    def refill() -> bool:
+        nonlocal buf, pos, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip(chars:str) -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or not refill():
+                return
+
+    skip(_WHITESPACE)
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("Expected a json array of streaming records.")
+    pos += 1
+    while True:
+        skip(_WHITESPACE + ",")
+        if pos >= len(buf):
+            raise ValueError("Unterminated json array.")
+        if buf[pos] == "]":
+            return
+        while True:
+            try:
+                record, end = _decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError:
+                # the record is split across chunks
+                if exhausted or not refill():
+                    raise
+        pos = end
+        yield record
+
+
+def iter_record_chunks(fobj:IO, chunk_rows:int=50_000, chunk_size:int=1 << 20) -> Iterator[List[dict]]:
+    """
+    Groups the parsed records into lists of at most chunk_rows records.
+    """
+    records = []
+    for record in iter_json_array(fobj, chunk_size):
+        records.append(record)
+        if len(records) == chunk_rows:
+            yield records
+            records = []
+    if records:
+        yield records
+
+
+def is_extended(record:dict) -> bool:
+    """
+    The extended streaming history (endsong.json / Streaming_History_Audio_*.json) uses ts rather than endTime.
+    """
+    return "ts" in record
+
+
+def records_to_frame(records:List[dict], offset:int=0) -> pd.DataFrame:
+    """
+    Builds the typed StreamingHistory columns directly from a list of records,
+    indexed from offset so that chunks line up with the json.load path.
+    """
+    if len(records) > 0 and is_extended(records[0]):
+        return extended_records_to_frame(records, offset)
+    df = pd.DataFrame({
+        "endTime" : pd.to_datetime([r["endTime"] for r in records], format='%Y-%m-%d %H:%M'),
+        "artistName" : [r["artistName"] for r in records],
+        "trackName" : [r["trackName"] for r in records],
+        "msPlayed" : np.fromiter((r["msPlayed"] for r in records), dtype=np.int64, count=len(records)),
+    }, index=pd.RangeIndex(offset, offset + len(records)))
+    df["minsPlayed"] = df["msPlayed"]/(60*1000)
+    return df
+
+
+def extended_records_to_frame(records:List[dict], offset:int=0) -> pd.DataFrame:
+    """
+    Maps the extended streaming history onto the basic columns plus trackUri (the track id, None for podcasts).
+    Podcast episodes use the show as the artistName and the episode as the trackName.
+    Records with neither a track nor an episode (eg. audiobooks) are dropped.
+    """
+    def track_id(uri:str) -> str | None:
+        return uri.rsplit(":", 1)[-1] if uri else None
+
+    ms_played = np.fromiter((r["ms_played"] for r in records), dtype=np.int64, count=len(records))
+    df = pd.DataFrame({
+        # ts is UTC like endTime in the basic history
+        "endTime" : pd.to_datetime([r["ts"] for r in records], utc=True, format="ISO8601").tz_localize(None),
+        "artistName" : [r.get("master_metadata_album_artist_name") or r.get("episode_show_name") for r in records],
+        "trackName" : [r.get("master_metadata_track_name") or r.get("episode_name") for r in records],
+        "msPlayed" : ms_played,
+        "minsPlayed" : ms_played/(60*1000),
+        "trackUri" : [track_id(r.get("spotify_track_uri")) for r in records],
+    }, index=pd.RangeIndex(offset, offset + len(records)))
+    return df[df["artistName"].notna().to_numpy() & df["trackName"].notna().to_numpy()]
+
+
+def iter_history_frames(fobj:IO, chunk_rows:int=50_000) -> Iterator[pd.DataFrame]:
+    """
+    Yields the (unfiltered) StreamingHistory as dataframes of at most chunk_rows rows.
+    """
+    offset = 0
+    for records in iter_record_chunks(fobj, chunk_rows):
+        yield records_to_frame(records, offset)
+        offset += len(records)
+
+
+def empty_history_frame() -> pd.DataFrame:
+    return records_to_frame([])
+
+
+def filter_plays(df:pd.DataFrame, window:TimeWindow=None, min_minutes:float=MIN_MINUTES) -> pd.DataFrame:
+    """
+    Keeps the plays in the window (by default the 2023 Wrapped window) that lasted over min_minutes.
+    """
+    window = TimeWindow.wrapped(2023) if window is None else window
+    return df[window.mask(df["endTime"]) & (df["minsPlayed"] > min_minutes).to_numpy()]
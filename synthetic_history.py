@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+from typing import Iterator, List, Tuple
+
+CHUNK_ROWS = 1_000_000 # rows generated per chunk, so any size is generated in bounded memory
+TRACKS_PER_ALBUM = 10
+TRACKS_PER_ARTIST = 50
+
+
+def zipf_probabilities(n:int, exponent:float) -> np.ndarray:
+    """
+    Probability of each rank 1..n under a (finite) Zipf law.
+    """
+    weights = 1/np.arange(1, n + 1)**exponent
+    return weights/weights.sum()
+
+
+def iter_synthetic_frames(n_rows:int, seed:int=0, n_artists:int=5_000, tracks_per_artist:int=TRACKS_PER_ARTIST, n_podcasts:int=50,
+                          exponent:float=1.1, podcast_fraction:float=0.03, skip_fraction:float=0.15,
+                          start:str="2023-01-01", days:int=365, chunk_rows:int=CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Deterministic synthetic StreamingHistory (endTime, artistName, trackName, msPlayed, trackUri) in chunks.
+    Artists, each artist's tracks and the podcasts are drawn with Zipfian popularity, podcast_fraction
+    of the plays are long podcast episodes and skip_fraction of the song plays are under 30 seconds.
+    The plays are in time order over days days from start.  Each chunk has its own generator
+    seeded with (seed, chunk) so the output only depends on the arguments.
+    """
+    artist_p = zipf_probabilities(n_artists, exponent)
+    track_p = zipf_probabilities(tracks_per_artist, exponent)
+    podcast_p = zipf_probabilities(n_podcasts, exponent)
+    artist_names = np.array([f"Artist {i}" for i in range(n_artists)], dtype=object)
+    podcast_names = np.array([f"Podcast {i}" for i in range(n_podcasts)], dtype=object)
+    start = pd.Timestamp(start).value
+    span = pd.Timedelta(days=days).value
+    n_chunks = max(1, -(-n_rows//chunk_rows))
+    for c in range(n_chunks):
+        rows = min(chunk_rows, n_rows - c*chunk_rows)
+        rng = np.random.default_rng([seed, c])
+        podcast = rng.random(rows) < podcast_fraction
+        artist = rng.choice(n_artists, size=rows, p=artist_p)
+        track = rng.choice(tracks_per_artist, size=rows, p=track_p)
+        show = rng.choice(n_podcasts, size=rows, p=podcast_p)
+        episode = rng.integers(0, 100, size=rows)
+        skip = rng.random(rows) < skip_fraction
+        ms_played = np.where(skip, rng.integers(0, 30_000, size=rows), np.minimum(rng.gamma(9., 25_000., size=rows), 10*60*1000).astype(np.int64))
+        ms_played = np.where(podcast, rng.integers(20*60*1000, 90*60*1000, size=rows), ms_played)
+        # the chunk covers its share of the time span, so the whole history is in time order
+        chunk_start = start + span*c*chunk_rows//n_rows
+        chunk_end = start + span*(c*chunk_rows + rows)//n_rows
+        times = np.sort(rng.integers(chunk_start, max(chunk_end, chunk_start + 1), size=rows))
+
+        artist_name = np.where(podcast, podcast_names[show], artist_names[artist])
+        track_name = [f"{p} episode {e}" if is_podcast else f"{a} - Track {t}"
+                      for is_podcast, p, e, a, t in zip(podcast, podcast_names[show], episode, artist_names[artist], track)]
+        track_uri = [None if is_podcast else f"synthetic{a*tracks_per_artist + t}" for is_podcast, a, t in zip(podcast, artist, track)]
+        yield pd.DataFrame({
+            "endTime" : pd.to_datetime(times).floor("min"),
+            "artistName" : artist_name,
+            "trackName" : track_name,
+            "msPlayed" : ms_played.astype(np.int64),
+            "trackUri" : np.array(track_uri, dtype=object),
+        }, index=pd.RangeIndex(c*chunk_rows, c*chunk_rows + rows))
+
+
+def synthetic_frame(n_rows:int, **kwargs) -> pd.DataFrame:
+    """
+    The whole synthetic history as one frame with a minsPlayed column (unfiltered).
+    """
+    df = pd.concat(list(iter_synthetic_frames(n_rows, **kwargs)), axis=0)
+    df["minsPlayed"] = df["msPlayed"]/(60*1000)
+    return df
+
+
+def _format_times(times:pd.Series, unit:str, sep:str="T") -> np.ndarray:
+    # much faster than Series.dt.strftime
+    formatted = np.datetime_as_string(times.to_numpy(dtype="datetime64[ns]"), unit=unit)
+    if sep != "T" and len(formatted) > 0:
+        chars = formatted.view("U1").reshape(len(formatted), -1)
+        chars[:, 10] = sep # YYYY-MM-DDThh...
+    return formatted
+
+
+def _basic_records(df:pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        "endTime" : _format_times(df["endTime"], "m", sep=" "),
+        "artistName" : df["artistName"],
+        "trackName" : df["trackName"],
+        "msPlayed" : df["msPlayed"],
+    })
+
+
+def _extended_records(df:pd.DataFrame) -> pd.DataFrame:
+    podcast = df["trackUri"].isna()
+    return pd.DataFrame({
+        "ts" : [t + "Z" for t in _format_times(df["endTime"], "s")],
+        "ms_played" : df["msPlayed"],
+        "master_metadata_track_name" : df["trackName"].where(~podcast, None),
+        "master_metadata_album_artist_name" : df["artistName"].where(~podcast, None),
+        "master_metadata_album_album_name" : [None if uri is None else synthetic_album(a, t) for a, t, uri in zip(df["artistName"], df["trackName"], df["trackUri"])],
+        "spotify_track_uri" : ["spotify:track:" + uri if uri is not None else None for uri in df["trackUri"]],
+        "episode_name" : df["trackName"].where(podcast, None),
+        "episode_show_name" : df["artistName"].where(podcast, None),
+    })
+
+
+def write_history(fname:str, n_rows:int, extended:bool=False, **kwargs) -> int:
+    """
+    Writes n_rows synthetic plays as a StreamingHistory json file (the extended format if extended)
+    one chunk at a time.  Returns the number of bytes written.
+    """
+    to_records = _extended_records if extended else _basic_records
+    written = 0
+    with open(fname, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, df in enumerate(iter_synthetic_frames(n_rows, **kwargs)):
+            records = to_records(df).to_json(orient="records", force_ascii=False)
+            if len(records) <= 2:
+                continue
+            f.write(("," if i > 0 else "") + records[1:-1])
+        f.write("]")
+        written = f.tell()
+    return written
+
+
+def synthetic_album(artist:str, track:str) -> str:
+    """
+    The album of a synthetic track: every TRACKS_PER_ALBUM consecutive tracks of an artist share an album.
+    """
+    return f"{artist} - Album {int(track.rsplit(' ', 1)[-1])//TRACKS_PER_ALBUM}"
+
+
+def synthetic_track(track_id:str, tracks_per_artist:int=TRACKS_PER_ARTIST) -> Tuple[str, str]:
+    """
+    The (artistName, trackName) of a synthetic track id (the trackUri without "spotify:track:").
+    """
+    artist, track = divmod(int(track_id[len("synthetic"):]), tracks_per_artist)
+    return f"Artist {artist}", f"Artist {artist} - Track {track}"
+
+
+def synthetic_albums(pairs:List[Tuple[str, str]]) -> List[str]:
+    return [synthetic_album(artist, track) for artist, track in pairs]
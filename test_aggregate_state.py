@@ -0,0 +1,108 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from aggregate_state import AggregateState, merge_intervals
+from spotify_unwrapped import SpotifyUnwrapped
+from time_window import TimeWindow
+from conftest import OfflineClient, assert_top_k_equal, finalised, make_history
+
+class AlbumClient(OfflineClient):
+    def __init__(self):
+        self.looked_up = []
+    def get_albums_for_tracks(self, pairs):
+        self.looked_up.extend(pairs)
+        return [f"{artist} album {track[-1]}" for artist, track in pairs]
+
+def write_months(tmp_path, records):
+    """
+    One file per month of the history, as successive exports would add.
+    """
+    by_month = {}
+    for r in sorted(records, key=lambda r: r["endTime"]):
+        by_month.setdefault(r["endTime"][:7], []).append(r)
+    fnames = []
+    for month, month_records in by_month.items():
+        fname = tmp_path / f"StreamingHistory_{month}.json"
+        fname.write_text(json.dumps(month_records))
+        fnames.append(str(fname))
+    return fnames
+
+def test_merge_intervals():
+    t = pd.Timestamp
+    intervals = [(t("2023-03-01"), t("2023-04-01")), (t("2023-01-01"), t("2023-02-01")), (t("2023-01-15"), t("2023-03-01"))]
+    assert merge_intervals(intervals) == [(t("2023-01-01"), t("2023-04-01"))]
+
+def test_append_matches_full_ingest(tmp_path):
+    window = TimeWindow.year(2023)
+    records = make_history(4000, seed=3)
+    fnames = write_months(tmp_path, records)
+    state_path = str(tmp_path/"state")
+
+    full = finalised(fnames, window=window)
+
+    total = 0
+    for fname in fnames:
+        # a new instance each time, as for a later run, so the state must come from disk
+        unwrapped = SpotifyUnwrapped(spotify_client=AlbumClient(), window=window)
+        total += unwrapped.append_update([fname], state_path)
+    assert total == len(full.df)
+    # the files already ingested are skipped
+    unwrapped = SpotifyUnwrapped(spotify_client=AlbumClient(), window=window)
+    assert unwrapped.append_update(fnames[:3], state_path) == 0
+
+    for expected, result in [(full.get_yearly_top_artists(), unwrapped.get_yearly_top_artists()),
+                             (full.get_yearly_top_songs(), unwrapped.get_yearly_top_songs()),
+                             (full.get_yearly_top_podcasts(), unwrapped.get_yearly_top_podcasts())]:
+        for e, r in zip(expected, result):
+            assert_top_k_equal(e, r)
+
+def test_append_resolves_only_new_tracks(tmp_path):
+    window = TimeWindow.year(2023)
+    fnames = write_months(tmp_path, make_history(3000, seed=4))
+    state_path = str(tmp_path/"state")
+    client = AlbumClient()
+    unwrapped = SpotifyUnwrapped(spotify_client=client, window=window)
+    unwrapped.append_update(fnames[:-1], state_path, resolve_albums=True)
+    known = set(unwrapped.state.songs.index)
+    assert set(client.looked_up) == known
+    client.looked_up.clear()
+    unwrapped.append_update(fnames[-1:], state_path, resolve_albums=True)
+    # only the tracks first played in the new month are looked up
+    assert set(client.looked_up) == set(unwrapped.state.songs.index) - known
+
+    streams, _ = unwrapped.get_yearly_top_albums()
+    state = AggregateState.load(state_path, window)
+    assert state.unresolved_tracks() == []
+    songs = state.songs.reset_index()
+    songs["albumName"] = [f"{a} album {t[-1]}" for a, t in zip(songs["artistName"], songs["trackName"])]
+    expected = songs.groupby(["artistName", "albumName"])["plays"].sum().nlargest(5)
+    np.testing.assert_array_equal(streams["Streams"].to_numpy(), expected.to_numpy())
+
+def test_state_window_must_match(tmp_path):
+    fnames = write_months(tmp_path, make_history(500, seed=5))
+    state_path = str(tmp_path/"state")
+    SpotifyUnwrapped(spotify_client=OfflineClient(), window=TimeWindow.year(2023)).append_update(fnames, state_path)
+    with pytest.raises(ValueError):
+        AggregateState.load(state_path, TimeWindow.wrapped(2023))
+
+def test_overlapping_exports_share_the_boundary_minute(tmp_path):
+    play = lambda t, track, ms=180000: {"endTime" : t, "artistName" : "a", "trackName" : track, "msPlayed" : ms}
+    first = [play("2023-05-01 11:58", "x"), play("2023-05-01 12:00", "x"), play("2023-05-01 12:00", "y")]
+    # the later export repeats the boundary minute with one more play in it, and goes on after it
+    second = [play("2023-05-01 12:00", "x"), play("2023-05-01 12:00", "y"), play("2023-05-01 12:00", "y", 200000),
+              play("2023-05-01 12:00", "z"), play("2023-05-01 12:30", "x")]
+    fnames = []
+    for i, records in enumerate([first, second]):
+        fname = tmp_path/f"StreamingHistory{i}.json"
+        fname.write_text(json.dumps(records))
+        fnames.append(str(fname))
+    state_path = str(tmp_path/"state")
+    window = TimeWindow.year(2023)
+    assert SpotifyUnwrapped(spotify_client=OfflineClient(), window=window).append_update(fnames[:1], state_path) == 3
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient(), window=window)
+    assert unwrapped.append_update(fnames[1:], state_path) == 3
+    assert unwrapped.state.songs["plays"].to_dict() == {("a", "x") : 3, ("a", "y") : 2, ("a", "z") : 1}
+    # uploading either export again adds nothing
+    for fname in fnames:
+        assert SpotifyUnwrapped(spotify_client=OfflineClient(), window=window).append_update([fname], state_path) == 0
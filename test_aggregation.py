@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from aggregation import aggregate_plays, top_k_tables
+from conftest import assert_top_k_equal
+
+def legacy_top_k(df, keys, k, labels):
+    """
+    The original value_counts + groupby/sort_values implementation.
+    """
+    num_plays = df[keys].value_counts().head(k).reset_index().rename(columns={"count" : "Streams", **labels})
+    cum_time = df.groupby(keys).agg({"minsPlayed": "sum"}).sort_values(by="minsPlayed", ascending=False).head(k)
+    cum_time = cum_time.reset_index().rename(columns={"minsPlayed" : "Time (hours)", **labels})
+    cum_time["Time (hours)"] /= 60
+    return num_plays, cum_time
+
+def random_plays(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    artists = rng.zipf(1.3, size=n) % 200
+    return pd.DataFrame({
+        "artistName" : [f"artist {a}" for a in artists],
+        "albumName" : [f"album {a % 7}" for a in rng.integers(0, 1000, size=n)],
+        "minsPlayed" : rng.random(n)*5,
+    })
+
+def test_matches_legacy_single_key():
+    df = random_plays()
+    for k in [1, 5, 10, 500]:
+        for expected, result in zip(legacy_top_k(df, ["artistName"], k, {"artistName" : "Artist"}),
+                                    top_k_tables(df, ["artistName"], k, {"artistName" : "Artist"})):
+            assert_top_k_equal(expected, result)
+            assert list(result.index) == list(range(len(result)))
+
+def test_matches_legacy_two_keys():
+    df = random_plays(seed=1)
+    labels = {"artistName" : "Artist", "albumName" : "Album"}
+    for expected, result in zip(legacy_top_k(df, ["artistName", "albumName"], 5, labels),
+                                top_k_tables(df, ["artistName", "albumName"], 5, labels)):
+        assert_top_k_equal(expected, result)
+        assert list(result.columns[:2]) == ["Artist", "Album"]
+
+def test_aggregate_plays():
+    df = pd.DataFrame({"artistName" : ["b", "a", "b"], "minsPlayed" : [1., 2., 3.]})
+    agg = aggregate_plays(df, ["artistName"])
+    assert agg.loc["b", "plays"] == 2 and agg.loc["b", "minutes"] == 4.
+    assert list(agg.index) == ["a", "b"]
+
+def test_empty():
+    df = random_plays().iloc[:0]
+    num_plays, cum_time = top_k_tables(df, ["artistName"], 5, {"artistName" : "Artist"})
+    assert len(num_plays) == 0 and list(num_plays.columns) == ["Artist", "Streams"]
+    assert list(cum_time.columns) == ["Artist", "Time (hours)"]
+
+def test_ties_in_key_order():
+    # the legacy tables ordered ties by an unstable sort, these are always in key order
+    df = pd.DataFrame({"artistName" : ["c", "a", "d", "b", "c", "a"], "minsPlayed" : [2., 1., 2., 3., 1., 2.]})
+    num_plays, cum_time = top_k_tables(df, ["artistName"], 3, {"artistName" : "Artist"})
+    assert num_plays["Artist"].tolist() == ["a", "c", "b"]
+    assert cum_time["Artist"].tolist() == ["a", "b", "c"]
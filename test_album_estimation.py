@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+from album_estimation import estimate_album_shares, wilson_interval
+from time_window import TimeWindow
+from aggregation import top_k_tables
+from conftest import FakeAlbumClient, album_of, extended_track_ids, finalised, make_history, write_histories
+
+class CountingResolver:
+    def __init__(self):
+        self.looked_up = []
+    def __call__(self, pairs):
+        self.looked_up.extend(pairs)
+        return [album_of(a, t) for a, t in pairs]
+
+def zipf_tracks(n_artists=100, tracks_per_artist=8, seed=0):
+    rng = np.random.default_rng(seed)
+    tracks = [(f"artist {a}", f"track {t}") for a in range(n_artists) for t in range(tracks_per_artist)]
+    weights = (1/np.arange(1, len(tracks) + 1)**1.1)*1e5
+    weights = np.ceil(rng.permutation(weights))
+    return tracks, weights
+
+def exact_shares(tracks, weights):
+    df = pd.DataFrame({"album" : [(a, album_of(a, t)) for a, t in tracks], "w" : weights})
+    return (df.groupby("album")["w"].sum()/weights.sum()).sort_values(ascending=False)
+
+def test_converges_to_exact_top_k_with_fewer_lookups():
+    tracks, weights = zipf_tracks()
+    resolver = CountingResolver()
+    estimate = estimate_album_shares(tracks, weights, resolver, k=5, confidence=0.95)
+    exact = exact_shares(tracks, weights)
+    assert estimate.converged and not estimate.exact
+    assert len(resolver.looked_up) == len(set(resolver.looked_up)) == estimate.lookups
+    assert estimate.lookups < 0.75*len(tracks)
+    top = list(zip(estimate.shares["artistName"], estimate.shares["albumName"]))[:5]
+    assert top == list(exact.index[:5])
+    for _, row in estimate.shares.head(5).iterrows():
+        assert row["lower"] <= exact[(row["artistName"], row["albumName"])] <= row["upper"]
+
+def test_exact_when_everything_is_resolved():
+    tracks = [("a", "track 0"), ("a", "track 3"), ("b", "track 1"), ("c", "track 2")]
+    weights = np.array([10., 10., 5., 5.])
+    estimate = estimate_album_shares(tracks, weights, CountingResolver(), k=5)
+    assert estimate.exact
+    assert estimate.shares["share"].tolist() == [20/30, 5/30, 5/30]
+    assert estimate.shares["albumName"].iloc[0] == "a album 0"
+
+def test_max_lookups():
+    tracks, weights = zipf_tracks()
+    estimate = estimate_album_shares(tracks, weights, CountingResolver(), k=5, confidence=0.999999, max_lookups=10)
+    assert estimate.lookups == 10
+
+def test_max_lookups_keeps_a_random_sample():
+    tracks = [(f"artist {i}", f"track {i}") for i in range(1000)]
+    resolver = CountingResolver()
+    estimate_album_shares(tracks, np.ones(len(tracks)), resolver, k=5, confidence=0.999999, max_lookups=20)
+    looked_up = sorted(int(t.split()[-1]) for _, t in resolver.looked_up)
+    assert len(looked_up) == 20
+    # not just the tracks that sort first among the round's draws
+    assert looked_up[-1] > 500
+
+def test_wilson_interval():
+    lower, upper = wilson_interval(np.array([0, 50, 100]), 100, 1.96)
+    assert lower[0] == 0 and 0 < upper[0] < 0.05
+    assert lower[1] < 0.5 < upper[1]
+    assert np.isclose(upper[2], 1)
+
+def test_adaptive_top_albums(tmp_path):
+    client = FakeAlbumClient()
+    unwrapped = finalised(write_histories(tmp_path, n=20000), client, TimeWindow.all_time())
+    streams, time = unwrapped.get_yearly_top_albums(mode="adaptive")
+    assert list(streams.columns) == ["Artist", "Album", "Streams", "Share", "Share lower", "Share upper"]
+    assert list(time.columns[:3]) == ["Artist", "Album", "Time (hours)"]
+    assert len(client.looked_up) == len(set(client.looked_up))
+    assert (streams["Share lower"] <= streams["Share"]).all() and (streams["Share"] <= streams["Share upper"]).all()
+    assert streams["Streams"].dtype == np.int64
+
+def test_exact_top_albums(tmp_path):
+    client = FakeAlbumClient()
+    unwrapped = finalised(write_histories(tmp_path, n=20000), client, TimeWindow.all_time(), compact=True)
+    streams, time = unwrapped.get_yearly_top_albums(mode="exact")
+
+    song_df = unwrapped.song_df
+    n_distinct = len(song_df[["artistName", "trackName"]].drop_duplicates())
+    assert len(client.looked_up) == n_distinct < len(song_df)/10
+
+    # the same as looking up every play
+    with_albums = unwrapped.add_albums_to_df(song_df)
+    expected = [album_of(a, t) for a, t in zip(song_df["artistName"], song_df["trackName"])]
+    assert with_albums["albumName"].tolist() == expected
+    expected_streams, expected_time = top_k_tables(with_albums, ["artistName", "albumName"], 5, {"albumName" : "Album", "artistName" : "Artist"})
+    pd.testing.assert_frame_equal(streams, expected_streams)
+    pd.testing.assert_frame_equal(time, expected_time)
+
+def test_exact_top_albums_from_track_uris(tmp_path):
+    results = []
+    for extended, client in [(False, FakeAlbumClient()), (True, FakeAlbumClient(extended_track_ids(make_history(5000))))]:
+        unwrapped = finalised(write_histories(tmp_path, n=5000, extended=extended), client, TimeWindow.all_time())
+        results.append(unwrapped.get_yearly_top_albums(mode="exact"))
+    # the extended history does not search at all
+    assert client.looked_up == [] and len(client.uri_looked_up) > 0
+    for expected, result in zip(*results):
+        pd.testing.assert_frame_equal(expected, result)
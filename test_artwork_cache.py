@@ -0,0 +1,39 @@
+import os
+from artwork_cache import ArtworkCache, select_image
+
+IMAGES = [
+    {"url" : "large", "width" : 640, "height" : 640},
+    {"url" : "medium", "width" : 300, "height" : 300},
+    {"url" : "small", "width" : 64, "height" : 64},
+]
+
+def test_select_image():
+    assert select_image(IMAGES)["url"] == "medium"
+    assert select_image(IMAGES, width=64)["url"] == "small"
+    assert select_image(IMAGES, width=1000)["url"] == "large"
+    assert select_image([]) is None
+
+def test_fetch_downloads_once(tmp_path):
+    cache = ArtworkCache(str(tmp_path))
+    downloads = []
+    def download(url):
+        downloads.append(url)
+        return b"cover"
+    path = cache.fetch("https://a", download)
+    assert cache.fetch("https://a", download) == path
+    assert downloads == ["https://a"]
+    # identical images at different urls are stored once
+    assert cache.fetch("https://b", download) == path
+    assert len([f for f in os.listdir(tmp_path) if f.endswith(".jpg")]) == 1
+    assert cache.fetch("https://c", lambda url: None) is None
+
+def test_eviction(tmp_path):
+    cache = ArtworkCache(str(tmp_path), max_bytes=25)
+    first = cache.put("https://a", b"a"*10)
+    os.utime(first, (0, 0))
+    second = cache.put("https://b", b"b"*10)
+    third = cache.put("https://c", b"c"*10)
+    assert not os.path.exists(first)
+    assert os.path.exists(second) and os.path.exists(third)
+    assert cache.get("https://a") is None
+    assert cache.get("https://c") == third
@@ -0,0 +1,92 @@
+import os
+import json
+import pytest
+import pandas as pd
+import pyarrow.parquet as pq
+from batch_unwrapped import run_batch, discover_users
+from spotify_unwrapped import SpotifyUnwrapped
+from time_window import TimeWindow
+from conftest import OfflineClient, make_history, assert_top_k_equal, extended_track_ids, to_extended
+
+class CountingClient(OfflineClient):
+    def __init__(self):
+        self.tracks, self.artists, self.artwork, self.known_ids = [], [], [], {}
+    def get_albums_for_tracks(self, artist_song_list):
+        self.tracks.extend(artist_song_list)
+        return [f"{t.split(' track ')[0]} album {int(t[-1]) % 2}" for _, t in artist_song_list]
+    def get_genres_from_artist_list(self, artist_list, batched=True, known_ids=None):
+        self.artists.extend(artist_list)
+        self.known_ids.update(known_ids or {})
+        return {a : {"genres" : ["pop"] if int(a.split()[-1]) % 2 else ["rock", "pop"], "count" : 1} for a in artist_list}
+    def get_album_artwork(self, artist_album_list):
+        self.artwork.extend(artist_album_list)
+        return {pair : f"/artwork/{pair[1]}.jpg" for pair in artist_album_list}
+
+class UriClient(CountingClient):
+    """
+    Resolves the to_extended track ids, whose artist is in the track name.
+    """
+    def __init__(self, uri_tracks):
+        super().__init__()
+        self.uri_tracks = uri_tracks
+    def get_tracks(self, track_ids):
+        return {i : {"album" : "album", "artists" : [self.uri_tracks[i][0]], "artist_ids" : [f"id {self.uri_tracks[i][0]}"]}
+                for i in track_ids}
+
+def make_exports(tmp_path, n_users=3):
+    exports = tmp_path/"exports"
+    for i in range(n_users):
+        user_dir = exports/f"user{i}"
+        user_dir.mkdir(parents=True)
+        with open(user_dir/"StreamingHistory0.json", "w") as f:
+            json.dump(make_history(1500, seed=i), f)
+        with open(user_dir/"Userdata.json", "w") as f:
+            json.dump({"username" : f"user{i}"}, f)
+    with open(exports/"broken.json", "w") as f:
+        f.write("not json")
+    return exports
+
+def test_discover_users(tmp_path):
+    users = discover_users(str(make_exports(tmp_path)))
+    assert list(users) == ["broken", "user0", "user1", "user2"]
+    assert [os.path.basename(f) for f in users["user1"]] == ["StreamingHistory0.json"]
+
+def test_batch_matches_per_user_runs_and_dedupes_lookups(tmp_path):
+    exports = make_exports(tmp_path)
+    output = tmp_path/"results"
+    client = CountingClient()
+    window = TimeWindow.all_time()
+    with pytest.warns(UserWarning, match="broken"):
+        summary = run_batch(str(exports), str(output), window, workers=2, genres=True, artwork=True, client=client)
+    assert summary["succeeded"] == 3 and list(summary["failed"]) == ["broken"]
+    # each distinct track and artist is looked up once for the whole batch
+    assert len(client.tracks) == len(set(client.tracks)) == summary["lookups"]["unique_tracks"]
+    assert summary["lookups"]["tracks"] > summary["lookups"]["unique_tracks"]
+    assert len(client.artists) == len(set(client.artists)) == summary["lookups"]["unique_artists"]
+    assert len(client.artwork) == len(set(client.artwork))
+
+    for i in range(3):
+        unwrapped = SpotifyUnwrapped(spotify_client=client, window=window)
+        unwrapped.finalise_dataframes([unwrapped.json_batch_update(str(exports/f"user{i}"/"StreamingHistory0.json"))])
+        with open(output/f"user{i}"/"top_k.json") as f:
+            result = json.load(f)
+        for name, expected in zip(["artists_streams", "artists_time"], unwrapped.get_yearly_top_artists()):
+            assert_top_k_equal(expected, pd.DataFrame(result["tables"][name]))
+            assert_top_k_equal(expected, pq.read_table(output/f"user{i}"/f"{name}.parquet").to_pandas())
+        assert_top_k_equal(unwrapped.get_yearly_top_genres()[0], pd.DataFrame(result["tables"]["genres_streams"]))
+        top_albums = {row["Album"] for name in ("albums_streams", "albums_time") for row in result["tables"][name]}
+        assert {a["album"] for a in result["artwork"]} == top_albums
+        assert os.path.exists(output/f"user{i}"/"state"/"meta.json")
+
+def test_batch_genres_use_the_known_artist_ids(tmp_path):
+    exports = tmp_path/"exports"
+    uri_tracks = {}
+    for i in range(2):
+        records = make_history(1000, seed=i)
+        uri_tracks.update(extended_track_ids(records))
+        (exports/f"user{i}").mkdir(parents=True)
+        (exports/f"user{i}"/"Streaming_History_Audio_2023.json").write_text(json.dumps(to_extended(records)))
+    client = UriClient(uri_tracks)
+    run_batch(str(exports), str(tmp_path/"results"), TimeWindow.all_time(), workers=2, genres=True, client=client)
+    # every artist has a track id so none of them needs a search
+    assert len(client.artists) > 0 and client.known_ids == {a : f"id {a}" for a in client.artists}
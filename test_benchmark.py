@@ -0,0 +1,31 @@
+import json
+from benchmark import SyntheticClient, compare, main, run_benchmarks
+from synthetic_history import synthetic_frame, synthetic_album
+
+def test_run_benchmarks():
+    results = run_benchmarks([2000], memory=True)
+    stages = [r["stage"] for r in results["results"]]
+    assert "json_batch_update" in stages and "get_yearly_top_albums_adaptive" in stages
+    assert "json_batch_update_extended" in stages and "get_yearly_top_albums_exact_extended" in stages
+    assert all(r["rows"] == 2000 and r["seconds"] >= 0 and r["peak_mb"] >= 0 for r in results["results"])
+    json.dumps(results)
+
+def test_compare_flags_slower_stages():
+    baseline = {"results" : [{"stage" : "a", "rows" : 10, "seconds" : 1.}, {"stage" : "b", "rows" : 10, "seconds" : 1.}]}
+    results = {"results" : [{"stage" : "a", "rows" : 10, "seconds" : 1.2}, {"stage" : "b", "rows" : 10, "seconds" : 2.},
+                            {"stage" : "c", "rows" : 10, "seconds" : 5.}]}
+    regressions = compare(results, baseline, tolerance=1.5)
+    assert [(r["stage"], r["ratio"]) for r in regressions] == [("b", 2.)]
+
+def test_main_writes_results(tmp_path):
+    output = tmp_path/"results.json"
+    assert main(["--sizes", "1000", "--no-memory", "--output", str(output)]) == 0
+    assert main(["--sizes", "1000", "--no-memory", "--output", str(tmp_path/"again.json"), 
+                 "--baseline", str(output), "--tolerance", "1000"]) == 0
+    assert json.loads(output.read_text())["results"][0]["rows"] == 1000
+
+def test_synthetic_client_resolves_track_ids():
+    songs = synthetic_frame(500).dropna(subset=["trackUri"])
+    tracks = SyntheticClient().get_tracks(list(songs["trackUri"]))
+    for artist, track, uri in zip(songs["artistName"], songs["trackName"], songs["trackUri"]):
+        assert tracks[uri]["album"] == synthetic_album(artist, track) and tracks[uri]["artists"] == [artist]
@@ -0,0 +1,35 @@
+import numpy as np
+from thefuzz import fuzz
+import entity_index
+from entity_index import EntityIndex, best_matches, match_scores, pair_scores
+
+def test_match_scores_agree_with_thefuzz():
+    queries = ["Dave", "beck", "Arctic Monkeys"]
+    candidates = ["Dave East", "Beck", "Arctic monkeys", "dave", ""]
+    expected = np.array([[fuzz.ratio(q, c) for c in candidates] for q in queries])
+    assert (match_scores(queries, candidates) == expected).all()
+    pairs = [(q, c) for q in queries for c in candidates]
+    assert (pair_scores([q for q, _ in pairs], [c for _, c in pairs]) == expected.ravel()).all()
+
+def test_best_matches_use_own_candidates():
+    queries = ["Dave", "Beck", "Nobody"]
+    candidate_lists = [["Dave East", "Dave", "Beck"], ["Dave", "Beck Hansen"], []]
+    assert best_matches(queries, candidate_lists) == [1, 1, None]
+    assert best_matches([], []) == [] and best_matches(["a"], [[]]) == [None]
+
+def test_best_matches_without_rapidfuzz(monkeypatch):
+    monkeypatch.setattr(entity_index, "cpdist", None)
+    assert best_matches(["Dave", "Beck"], [["Dave East", "Dave", "Beck"], ["Dave", "Beck Hansen"]]) == [1, 1]
+
+def test_index_persists_and_keeps_first(tmp_path):
+    index = EntityIndex(str(tmp_path/"entities.sqlite"))
+    index.add("artist", [("dave", "Dave", "id_dave"), ("DAVE ", "Dave", "id_other")])
+    index.add("track", [("Streatham", "Streatham", "t_streatham")], scope="id_dave")
+    assert index.get("artist", " Dave") == ("Dave", "id_dave")
+    assert index.get("track", "streatham") is None
+
+    index = EntityIndex(str(tmp_path/"entities.sqlite"))
+    assert len(index) == 2
+    assert index.get("track", "streatham", scope="id_dave") == ("Streatham", "t_streatham")
+    index.clear()
+    assert len(EntityIndex(str(tmp_path/"entities.sqlite"))) == 0
@@ -0,0 +1,71 @@
+import warnings
+import pytest
+import requests
+from artwork_cache import ArtworkCache
+from fake_spotify import Catalog, FakeSpotifyServer
+from load_test import run_load_test
+from request_engine import RequestEngine
+from spotify_client import SpotifyClient
+
+@pytest.fixture
+def make_client(tmp_path):
+    engines = []
+    def make(server, **kwargs):
+        engine = RequestEngine(max_workers=4, backoff=0.01, max_backoff=0.05, **kwargs)
+        engines.append(engine)
+        return SpotifyClient(use_cache=False, engine=engine, artwork_cache=ArtworkCache(str(tmp_path)), 
+                             base_url=server.url, accounts_url=server.url)
+    yield make
+    for engine in engines:
+        engine.close()
+
+def test_client_against_fake_server(make_client):
+    catalog = Catalog.synthetic(n_artists=20, tracks_per_artist=20)
+    with FakeSpotifyServer(catalog) as server:
+        client = make_client(server)
+        assert client.search_for_artist_id("artist 3") == ("Artist 3", "artist3")
+        genres = client.get_genres_from_artist_list(["Artist 1", "Artist 2", "Artist 1"])
+        assert genres["Artist 1"] == {"genres" : catalog.artist_by_id["artist1"]["genres"], "count" : 2}
+        assert client.get_album_from_song("Artist 2 - Track 13", "Artist 2") == "Artist 2 - Album 1"
+        assert client.get_tracks(["synthetic5", "unknown"]) == {
+            "synthetic5" : {"album" : "Artist 0 - Album 0", "artists" : ["Artist 0"], "artist_ids" : ["artist0"]}, "unknown" : None}
+        artwork = client.get_album_artwork([("Artist 4", "Artist 4 - Album 1")])
+        with open(artwork[("Artist 4", "Artist 4 - Album 1")], "rb") as f:
+            assert f.read() == b"JPEG album4x1 300"
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            assert client.get_album_from_song("No Such Track", "Artist 2") is None
+        assert server.stats["endpoints"]["token"] == 1
+        assert server.stats["statuses"].get("401", 0) == 0
+
+def test_requests_need_a_token():
+    with FakeSpotifyServer(Catalog.synthetic(n_artists=5)) as server:
+        assert requests.get(f"{server.url}/v1/artists/artist1").status_code == 401
+
+def test_injected_errors_and_rate_limits_are_retried(make_client):
+    with FakeSpotifyServer(Catalog.synthetic(n_artists=50), error_rate=0.2, rate=100., burst=5, retry_after=0.05) as server:
+        client = make_client(server)
+        artists = [f"Artist {i}" for i in range(50)]
+        ids = client.search_for_artist_ids(artists)
+        assert all(ids[a] == (a, f"artist{i}") for i, a in enumerate(artists))
+        statuses = server.stats["statuses"]
+        assert statuses["200"] >= 51
+        assert sum(statuses.get(s, 0) for s in ("429", "500", "502", "503")) > 0
+
+def test_load_test_reports_throughput():
+    results = run_load_test(n_plays=300, n_artists=50, sample_rate=0.1, latency=0., jitter=0.)
+    scenarios = {s["scenario"] : s for s in results["scenarios"]}
+    assert set(scenarios) == {"get_genres_from_artist_list", "get_album_from_song_list"}
+    for s in scenarios.values():
+        assert s["requests"] > 0 and s["requests_per_second"] > 0
+    assert scenarios["get_album_from_song_list"]["found"] > 0
+
+def test_revoked_token_is_refreshed_once(make_client):
+    with FakeSpotifyServer(Catalog.synthetic(n_artists=20)) as server:
+        client = make_client(server)
+        assert client.search_for_artist_id("artist 3") == ("Artist 3", "artist3")
+        server.revoke_tokens()
+        genres = client.get_genres_from_artist_list([f"Artist {i}" for i in range(10)])
+        assert genres["Artist 1"]["genres"] == server.catalog.artist_by_id["artist1"]["genres"]
+        assert server.stats["endpoints"]["token"] == 2
+        assert server.stats["statuses"]["401"] >= 1
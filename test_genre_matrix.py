@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from genre_matrix import GenreMatrix
+from aggregation import aggregate_plays
+from time_window import TimeWindow
+from conftest import GENRES, GenreClient, assert_top_k_equal, finalised, write_histories
+
+def make_unwrapped(tmp_path):
+    return finalised(write_histories(tmp_path, n=3000), GenreClient(), TimeWindow.all_time())
+
+def exploded(df):
+    """
+    The reference: one row per (play, genre).
+    """
+    df = df.assign(genre=df["artistName"].map(GENRES)).explode("genre")
+    return df[df["genre"].notna()]
+
+def test_genre_totals_match_exploded_rows(tmp_path):
+    unwrapped = make_unwrapped(tmp_path)
+    df = unwrapped.song_df
+    expected = aggregate_plays(exploded(df), ["genre"])
+    totals = GenreMatrix.from_genres(GENRES).genre_totals(aggregate_plays(df, ["artistName"]))
+    totals = totals[totals["plays"] > 0]
+    assert list(totals.index) == list(expected.index)
+    np.testing.assert_array_equal(totals["plays"], expected["plays"])
+    np.testing.assert_allclose(totals["minutes"], expected["minutes"])
+
+def test_top_genres(tmp_path):
+    unwrapped = make_unwrapped(tmp_path)
+    streams, cum_time = unwrapped.get_yearly_top_genres(k=3)
+    agg = aggregate_plays(exploded(unwrapped.song_df), ["genre"])
+    assert_top_k_equal(agg["plays"].nlargest(3).rename("Streams").reset_index().rename(columns={"genre" : "Genre"}), streams)
+    expected_time = (agg["minutes"].nlargest(3)/60).rename("Time (hours)").reset_index().rename(columns={"genre" : "Genre"})
+    assert_top_k_equal(expected_time, cum_time)
+    unwrapped.get_monthly_genre_shares()
+    assert unwrapped.spotify_client.calls == 1
+
+def test_monthly_shares(tmp_path):
+    unwrapped = make_unwrapped(tmp_path)
+    df = unwrapped.song_df.assign(month=unwrapped.song_df["endTime"].dt.to_period("M").dt.to_timestamp())
+    shares = unwrapped.get_monthly_genre_shares(genres=["pop", "genre 1"])
+    assert set(shares["genre"]) == {"pop", "genre 1"}
+    expected = aggregate_plays(exploded(df), ["month", "genre"])
+    month_plays = df.groupby("month").size()
+    for _, row in shares.iterrows():
+        assert row["plays"] == expected.loc[(row["month"], row["genre"]), "plays"]
+        assert np.isclose(row["plays_share"], row["plays"]/month_plays[row["month"]])
+    assert len(shares) == len(expected.loc[pd.IndexSlice[:, ["pop", "genre 1"]], :])
+
+def test_artists_without_genres():
+    matrix = GenreMatrix.from_genres({"a" : ["rock", "pop"], "b" : None, "c" : []})
+    agg = pd.DataFrame({"plays" : [2, 3, 5, 7], "minutes" : [1., 2., 3., 4.]}, index=pd.Index(["a", "b", "c", "unknown"], name="artistName"))
+    totals = matrix.genre_totals(agg)
+    assert totals.to_dict() == {"plays" : {"pop" : 2, "rock" : 2}, "minutes" : {"pop" : 1., "rock" : 1.}}
+    period_agg = agg.set_index(pd.Index([1, 1, 2, 2]), append=True).swaplevel()
+    shares = matrix.period_shares(period_agg)
+    assert list(shares["period"]) == [1, 1]
+    assert np.allclose(shares["plays_share"], 2/5)
@@ -0,0 +1,37 @@
+import io
+import pandas as pd
+from ingest_cache import IngestCache, file_digest
+from spotify_unwrapped import SpotifyUnwrapped
+from conftest import OfflineClient
+
+def test_file_digest(history_file):
+    with open(history_file, "rb") as f:
+        data = f.read()
+    buffer = io.BytesIO(data)
+    assert file_digest(history_file) == file_digest(buffer)
+    assert buffer.tell() == 0
+    assert file_digest(io.BytesIO(data + b" ")) != file_digest(buffer)
+
+def test_repeat_ingest_skips_parsing(history_file, tmp_path, monkeypatch):
+    cache = IngestCache(str(tmp_path / "ingest"))
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient(), ingest_cache=cache)
+    first = unwrapped.json_batch_update(history_file)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the cached file should not be parsed")
+    monkeypatch.setattr(unwrapped, "_json_update", fail)
+    second = unwrapped.json_batch_update(history_file)
+    pd.testing.assert_frame_equal(first, second)
+
+def test_key_depends_on_params(history_file, tmp_path):
+    cache = IngestCache(str(tmp_path / "ingest"))
+    assert cache.key(history_file, {"filter" : "a"}) != cache.key(history_file, {"filter" : "b"})
+    assert cache.key(history_file, {"filter" : "a"}) == cache.key(history_file, {"filter" : "a"})
+
+def test_eviction(tmp_path):
+    cache = IngestCache(str(tmp_path / "ingest"), max_bytes=1)
+    df = pd.DataFrame({"a" : range(100)})
+    cache.store("first", df)
+    cache.store("second", df)
+    assert cache.load("first") is None
+    pd.testing.assert_frame_equal(cache.load("second"), df)
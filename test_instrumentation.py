@@ -0,0 +1,69 @@
+import json
+import logging
+import requests
+from instrumentation import Metrics, endpoint_name, timed
+from ingest_cache import IngestCache
+from request_engine import RequestEngine
+
+class FakeResponse:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = content
+
+def test_endpoint_name_groups_ids():
+    assert endpoint_name("GET", "https://api.spotify.com/v1/artists/0TnOYISbd1XYRBk9myaseg/albums?limit=50") == "GET /v1/artists/{id}/albums"
+    assert endpoint_name("GET", "https://api.spotify.com/v1/artists?ids=a,b") == "GET /v1/artists"
+    assert endpoint_name("POST", "https://accounts.spotify.com/api/token") == "POST /api/token"
+    assert endpoint_name("GET", "https://i.scdn.co/image/ab67616d00001e02") == "GET image"
+
+def test_summary_percentiles_and_hit_ratio():
+    m = Metrics()
+    for ms in range(1, 101):
+        m.record_request("GET /v1/search", ms/1000, 200, 10, retry=False)
+    m.record_request("GET /v1/search", 0.5, 429, 0, retry=True)
+    m.record_cache("ingest", True)
+    m.record_cache("ingest", False)
+    m.record_cache("ingest", True)
+    summary = m.summary()
+    search = summary["endpoints"]["GET /v1/search"]
+    assert search["count"] == 101 and search["retries"] == 1 and search["bytes"] == 1000
+    assert search["statuses"] == {"200" : 100, "429" : 1}
+    assert abs(search["p50_ms"] - 51) < 1e-6
+    assert search["p95_ms"] > 95
+    assert summary["caches"]["ingest"] == {"hits" : 2, "misses" : 1, "hit_ratio" : 2/3}
+    json.dumps(summary)
+    m.reset()
+    assert m.summary() == {"stages" : {}, "endpoints" : {}, "caches" : {}}
+
+def test_timed_uses_the_instance_metrics(caplog):
+    class Stage:
+        def __init__(self):
+            self.metrics = Metrics()
+        @timed("work")
+        def work(self, x):
+            return 2*x
+    s = Stage()
+    with caplog.at_level(logging.INFO, logger="unwrapped"):
+        assert s.work(2) == 4
+        assert s.work(3) == 6
+    assert s.metrics.summary()["stages"]["work"]["count"] == 2
+    events = [json.loads(r.message) for r in caplog.records]
+    assert [e["stage"] for e in events if e["event"] == "stage"] == ["work", "work"]
+
+def test_engine_records_requests_and_retries(monkeypatch):
+    statuses = [503, 200]
+    monkeypatch.setattr(requests.Session, "request", lambda *a, **k: FakeResponse(statuses.pop(0), b"12345"))
+    m = Metrics()
+    engine = RequestEngine(rate=100., backoff=0.001, metrics=m)
+    assert engine.get("https://api.spotify.com/v1/artists/abc").status_code == 200
+    engine.close()
+    e = m.summary()["endpoints"]["GET /v1/artists/{id}"]
+    assert e["count"] == 2 and e["retries"] == 1 and e["bytes"] == 10
+    assert e["statuses"] == {"503" : 1, "200" : 1}
+
+def test_ingest_cache_hits(tmp_path):
+    m = Metrics()
+    cache = IngestCache(str(tmp_path), metrics=m)
+    assert cache.load("missing") is None
+    assert m.summary()["caches"]["ingest"]["misses"] == 1
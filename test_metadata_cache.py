@@ -0,0 +1,64 @@
+import metadata_cache
+from metadata_cache import MetadataCache, MISS, normalise_key
+
+def test_normalise_key():
+    assert normalise_key(" Dave ") == normalise_key("dave")
+    assert normalise_key("Taylor  Swift", "Lover") == normalise_key("taylor swift", "lover")
+    assert normalise_key("a", "b c") != normalise_key("a b", "c")
+
+def test_hit_miss_and_negative(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("artist_search", "dave") is MISS
+    cache.set("artist_search", "dave", ["Dave", "abc123"])
+    cache.set("artist_search", "not an artist", None)
+    assert cache.get("artist_search", "dave") == ["Dave", "abc123"]
+    assert cache.get("artist_search", "not an artist") is None
+    assert cache.get("artist_genres", "dave") is MISS
+
+    # persisted between instances
+    cache = MetadataCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("artist_search", "dave") == ["Dave", "abc123"]
+
+def test_ttl_expiry(tmp_path, monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(metadata_cache.time, "time", lambda: now[0])
+    cache = MetadataCache(str(tmp_path / "cache.sqlite"), ttl=100, negative_ttl=10)
+    cache.set("track_album", "hit", "Lover")
+    cache.set("track_album", "miss", None)
+    now[0] += 50
+    assert cache.get("track_album", "hit") == "Lover"
+    assert cache.get("track_album", "miss") is MISS
+    now[0] += 100
+    assert cache.get("track_album", "hit") is MISS
+
+def test_size_bounded_eviction(tmp_path, monkeypatch):
+    now = [0.]
+    monkeypatch.setattr(metadata_cache.time, "time", lambda: now[0])
+    cache = MetadataCache(str(tmp_path / "cache.sqlite"), max_entries=100)
+    for i in range(250):
+        now[0] += 1
+        cache.set("artist_genres", str(i), ["pop"])
+    assert len(cache) <= 100
+    # most recently written entries survive
+    assert cache.get("artist_genres", "249") == ["pop"]
+    assert cache.get("artist_genres", "0") is MISS
+
+def test_hits_are_not_written_until_set(tmp_path, monkeypatch):
+    now = [0.]
+    monkeypatch.setattr(metadata_cache.time, "time", lambda: now[0])
+    cache = MetadataCache(str(tmp_path / "cache.sqlite"), max_entries=100)
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    for i in range(100):
+        now[0] += 1
+        cache.set("artist_genres", str(i), ["pop"])
+    changes = cache._conn.total_changes
+    for _ in range(10):
+        now[0] += 1
+        assert cache.get("artist_genres", "0") == ["pop"]
+    assert cache._conn.total_changes == changes
+    # the buffered access time still counts for the eviction: "0" was read most recently
+    for i in range(100, 150):
+        now[0] += 1
+        cache.set("artist_genres", str(i), ["pop"])
+    assert cache.get("artist_genres", "0") == ["pop"]
+    assert cache.get("artist_genres", "1") is MISS
@@ -0,0 +1,82 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from parquet_history import ParquetHistory, write_history_dataset
+from spotify_unwrapped import SpotifyUnwrapped
+from time_window import TimeWindow
+from conftest import FakeAlbumClient, GenreClient, OfflineClient, assert_top_k_equal, extended_track_ids, finalised, make_history, write_histories
+
+class AlbumGenreClient(FakeAlbumClient, GenreClient):
+    def __init__(self, uri_tracks=None):
+        FakeAlbumClient.__init__(self, uri_tracks)
+        GenreClient.__init__(self)
+
+def both_backends(tmp_path, fnames, window, client=None, batch_rows=1000):
+    """
+    The same plays finalised as dataframes and as a Parquet dataset.
+    """
+    in_memory = finalised(fnames, client, window)
+    write_history_dataset(fnames, str(tmp_path/"dataset"), chunk_rows=700)
+    out_of_core = SpotifyUnwrapped(spotify_client=client or OfflineClient(), window=window)
+    out_of_core.finalise_dataset(str(tmp_path/"dataset"), batch_rows=batch_rows)
+    return in_memory, out_of_core
+
+def assert_same_top_k(expected, result):
+    for e, r in zip(expected, result):
+        assert_top_k_equal(e, r)
+        assert r[r.columns[-1]].dtype == e[e.columns[-1]].dtype
+
+@pytest.mark.parametrize("extended", [False, True])
+@pytest.mark.parametrize("window", [TimeWindow.all_time(), TimeWindow.wrapped(2023), TimeWindow.year(2024)])
+def test_top_k_matches_dataframes(tmp_path, extended, window):
+    in_memory, out_of_core = both_backends(tmp_path, write_histories(tmp_path, n_files=3, n=4000, extended=extended), window)
+    for method in ("get_yearly_top_artists", "get_yearly_top_songs", "get_yearly_top_podcasts"):
+        assert_same_top_k(getattr(in_memory, method)(), getattr(out_of_core, method)())
+    dataset = out_of_core.dataset
+    assert dataset.count() == len(in_memory.song_df) and dataset.count(songs=False) == len(in_memory.podcast_df)
+
+def test_batches_are_merged(tmp_path):
+    fnames = write_histories(tmp_path, n_files=3, n=4000)
+    dataset_path = str(tmp_path/"dataset")
+    write_history_dataset(fnames, dataset_path, chunk_rows=500)
+    expected = ParquetHistory(dataset_path, TimeWindow.all_time()).aggregate(["artistName", "trackName"])
+    result = ParquetHistory(dataset_path, TimeWindow.all_time(), batch_rows=50).aggregate(["artistName", "trackName"])
+    assert list(result.index) == list(expected.index)
+    np.testing.assert_array_equal(result["plays"], expected["plays"])
+    np.testing.assert_allclose(result["minutes"], expected["minutes"])
+    with pytest.raises(ValueError):
+        ParquetHistory(dataset_path).get_top_k("album", 5)
+
+def test_interrupted_writes_are_ignored(tmp_path):
+    fnames = write_histories(tmp_path, n_files=2, n=4000)
+    dataset_path = str(tmp_path/"dataset")
+    write_history_dataset(fnames[:1], dataset_path)
+    expected = ParquetHistory(dataset_path, TimeWindow.all_time()).count()
+    # what a crash part way through write_history_dataset leaves behind
+    (tmp_path/"dataset"/"part-00001.parquet.1234.tmp").write_bytes(b"PAR1 half written")
+    assert ParquetHistory(dataset_path, TimeWindow.all_time()).count() == expected
+    assert [os.path.basename(f) for f in write_history_dataset(fnames[1:], dataset_path)] == ["part-00001.parquet"]
+
+def test_datasets_can_be_extended(tmp_path):
+    fnames = write_histories(tmp_path, n_files=3, n=4000)
+    dataset_path = str(tmp_path/"dataset")
+    write_history_dataset(fnames[:1], dataset_path)
+    written = write_history_dataset(fnames[1:], dataset_path)
+    assert [f.rsplit("/", 1)[-1] for f in written] == ["part-00001.parquet", "part-00002.parquet"]
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient(), window=TimeWindow.all_time())
+    df = unwrapped.json_batch_update(fnames[0])
+    assert ParquetHistory(dataset_path, TimeWindow.all_time()).count() > len(df[(df["minsPlayed"] > 0.5) & (df["minsPlayed"] <= 10)])
+
+@pytest.mark.parametrize("extended", [False, True])
+def test_albums_and_genres_match_dataframes(tmp_path, extended):
+    uri_tracks = extended_track_ids([r for i in range(3) for r in make_history(4000, seed=i)])
+    fnames = write_histories(tmp_path, n_files=3, n=4000, extended=extended)
+    in_memory, out_of_core = both_backends(tmp_path, fnames, TimeWindow.all_time(), AlbumGenreClient(uri_tracks))
+    for mode in ("exact", "adaptive"):
+        # both the Streams and the Time (hours) tables, the adaptive ones with their share columns
+        for e, r in zip(in_memory.get_yearly_top_albums(mode=mode), out_of_core.get_yearly_top_albums(mode=mode)):
+            pd.testing.assert_frame_equal(e, r)
+    with pytest.raises(AssertionError):
+        out_of_core.get_yearly_top_albums(mode="sample")
+    assert_same_top_k(in_memory.get_yearly_top_genres(), out_of_core.get_yearly_top_genres())
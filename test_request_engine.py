@@ -0,0 +1,92 @@
+import time
+import threading
+import pytest
+import requests
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from request_engine import RequestEngine, TokenBucket, retry_after_seconds
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = {} if headers is None else headers
+        self.content = b""
+
+def test_retry_after_is_respected(monkeypatch):
+    statuses = [429, 503, 200]
+    calls = []
+    def request(session, method, url, **kwargs):
+        calls.append(time.monotonic())
+        status = statuses[len(calls) - 1]
+        return FakeResponse(status, {"Retry-After" : "0.2"} if status == 429 else {})
+    monkeypatch.setattr(requests.Session, "request", request)
+    engine = RequestEngine(rate=100., backoff=0.01)
+    response = engine.get("https://api.spotify.com/v1/search")
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.2
+    engine.close()
+
+def test_retry_after_date():
+    assert retry_after_seconds("1.5") == 1.5
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < retry_after_seconds(later) <= 30
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.
+    assert retry_after_seconds("soon") is None
+
+def test_unparseable_retry_after_backs_off(monkeypatch):
+    statuses = [429, 200]
+    def request(session, method, url, **kwargs):
+        return FakeResponse(statuses.pop(0), {"Retry-After" : "soon"})
+    monkeypatch.setattr(requests.Session, "request", request)
+    engine = RequestEngine(rate=100., backoff=0.01)
+    assert engine.get("https://api.spotify.com/v1/search").status_code == 200
+    engine.close()
+
+def test_retries_exhausted_returns_last_response(monkeypatch):
+    monkeypatch.setattr(requests.Session, "request", lambda *a, **k: FakeResponse(500))
+    engine = RequestEngine(rate=100., max_retries=2, backoff=0.001)
+    assert engine.get("https://api.spotify.com/v1/search").status_code == 500
+    engine.close()
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50., capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.18
+
+def test_duplicate_keys_are_merged():
+    engine = RequestEngine(max_workers=4)
+    counts = {}
+    lock = threading.Lock()
+    def work(item):
+        with lock:
+            counts[item] = counts.get(item, 0) + 1
+        time.sleep(0.01)
+        return item.upper()
+    items = ["dave", "beck", "dave", "spice", "dave", "beck"]
+    assert engine.map(work, items, key=lambda x: x) == [i.upper() for i in items]
+    assert counts == {"dave" : 1, "beck" : 1, "spice" : 1}
+    engine.close()
+
+def test_map_is_concurrent():
+    engine = RequestEngine(max_workers=8)
+    start = time.monotonic()
+    engine.map(lambda _: time.sleep(0.1), range(8))
+    assert time.monotonic() - start < 0.5
+    engine.close()
+
+def test_map_cancels_pending_calls_on_error():
+    engine = RequestEngine(max_workers=1)
+    started = []
+    def work(i):
+        started.append(i)
+        if i == 0:
+            raise ValueError("failed")
+        return i
+    with pytest.raises(ValueError):
+        engine.map(work, range(50))
+    n_started = len(started)
+    engine.close()
+    assert n_started == len(started) < 50
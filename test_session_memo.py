@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+from session_memo import StageMemo
+
+def test_stage_recomputed_only_when_key_changes():
+    state = {}
+    memo = StageMemo(state)
+    computed = []
+    def compute(value):
+        def f():
+            computed.append(value)
+            return value
+        return f
+    assert memo.get("dataset", ("a", 1), compute("x")) == "x"
+    assert memo.get("dataset", ("a", 1), compute("y")) == "x"
+    assert memo.get("albums", ("a", 1, "exact"), compute("z")) == "z"
+    assert memo.get("dataset", ("b", 1), compute("w")) == "w"
+    assert computed == ["x", "z", "w"]
+    # only the latest result of each stage is kept
+    assert len(state) == 2
+    memo.clear("albums")
+    assert list(state) == ["memo_dataset"]
+    memo.clear()
+    assert state == {}
+
+def test_upload_digest_hashed_once():
+    state = {}
+    memo = StageMemo(state)
+    upload = io.BytesIO(b"[]")
+    upload.file_id = "upload-1"
+    digest = memo.upload_digest(upload)
+    upload.write(b"changed") # a cached digest is not recomputed for the same upload
+    assert memo.upload_digest(upload) == digest
+    assert memo.upload_digest(io.BytesIO(b"[]")) == digest
+
+def test_submit_runs_in_background_unless_memoised():
+    memo = StageMemo({})
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        future = memo.submit("albums", "a", lambda: "computed", pool)
+        assert future.result() == "computed"
+        assert memo.lookup("albums", "a") == (False, None)
+        memo.put("albums", "a", future.result())
+        again = memo.submit("albums", "a", lambda: "recomputed", pool)
+        assert again.done() and again.result() == "computed"
+        assert memo.submit("albums", "b", lambda: "recomputed", pool).result() == "recomputed"
@@ -0,0 +1,54 @@
+import json
+import spotify_auth
+import spotify_client
+from spotify_auth import ClientCredentialsToken
+from spotify_client import SpotifyClient
+
+class FakeTokenEngine:
+    def __init__(self):
+        self.posts = 0
+    def post(self, url, **kwargs):
+        self.posts += 1
+        return FakeTokenResponse({"access_token" : f"token_{self.posts}", "expires_in" : 3600})
+
+class FakeTokenResponse:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode("utf-8")
+        self.status_code = 200
+        self.headers = {}
+
+def test_token_refreshed_before_expiry(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(spotify_auth.time, "monotonic", lambda: now[0])
+    engine = FakeTokenEngine()
+    token = ClientCredentialsToken("id", "secret", engine)
+    assert engine.posts == 0
+    assert token.get() == "token_1"
+    now[0] += 3000
+    assert token.get() == "token_1"
+    assert engine.posts == 1
+    now[0] += 3600 - 3000 - 30 # inside the refresh margin
+    assert token.get() == "token_2"
+    token.invalidate("token_1") # a stale 401 keeps the current token
+    assert token.get() == "token_2" and engine.posts == 2
+    token.invalidate()
+    assert token.get() == "token_3"
+
+def test_clients_share_token(monkeypatch, tmp_path):
+    calls = []
+    def request(session, method, url, **kwargs):
+        calls.append(url)
+        if url.endswith("/api/token"):
+            return FakeTokenResponse({"access_token" : "shared", "expires_in" : 3600})
+        return FakeTokenResponse({"artists" : {"items" : [{"name" : "Beck", "id" : "id_beck"}]}})
+    monkeypatch.setenv("CLIENT_ID", "shared_id")
+    monkeypatch.setenv("CLIENT_SECRET", "shared_secret")
+    monkeypatch.setattr(spotify_client.requests.Session, "request", request)
+    first = SpotifyClient(use_cache=False, artwork_cache=spotify_client.ArtworkCache(str(tmp_path)))
+    assert calls == [] # constructing a client makes no network calls
+    first.search_for_artist_id("Beck")
+    second = SpotifyClient(use_cache=False, artwork_cache=first.artwork_cache)
+    second.search_for_artist_id("Beck")
+    assert sum(url.endswith("/api/token") for url in calls) == 1
+    assert second.engine is first.engine
+    assert second.auth is first.auth
@@ -1,4 +1,11 @@
+import json
+import warnings
+import pytest
+import spotify_client
 from spotify_client import SpotifyClient
+from artwork_cache import ArtworkCache
+from metadata_cache import MetadataCache
+from entity_index import EntityIndex
 from collections import Counter
 import numpy as np
 
@@ -76,6 +83,177 @@ def test_genre_lookup_from_song():
     for k, v in genres.items():
         assert v["count"] == artist_ctr[k]
 
+class FakeResponse:
+    def __init__(self, payload, status_code=200, headers=None):
+        self.content = json.dumps(payload).encode("utf-8")
+        self.status_code = status_code
+        self.headers = {} if headers is None else headers
+
+FAKE_ARTISTS = {
+    "dave" : ("Dave", "id_dave", ["uk hip hop", "rap"]),
+    "beck" : ("Beck", "id_beck", ["alternative rock"]),
+    "spice" : ("Spice", "id_spice", ["dancehall"]),
+    "arctic monkeys" : ("Arctic Monkeys", "id_am", ["garage rock", "indie rock"]),
+}
+
+FAKE_TRACKS = {
+    "t_streatham" : {"id" : "t_streatham", "name" : "Streatham", "album" : {"name" : "PSYCHODRAMA"}, "artists" : [{"name" : "Dave", "id" : "id_dave"}]},
+    "t_loser" : {"id" : "t_loser", "name" : "Loser", "album" : {"name" : "Mellow Gold"}, "artists" : [{"name" : "Beck", "id" : "id_beck"}]},
+}
+
+FAKE_ALBUMS = {
+    "id_dave" : [{"name" : "PSYCHODRAMA", "id" : "a_psychodrama", "images" : [
+        {"url" : "https://i.scdn.co/image/psychodrama_640", "width" : 640, "height" : 640},
+        {"url" : "https://i.scdn.co/image/psychodrama_300", "width" : 300, "height" : 300},
+        {"url" : "https://i.scdn.co/image/psychodrama_64", "width" : 64, "height" : 64},
+    ]}],
+}
+
+class FakeImageResponse(FakeResponse):
+    def __init__(self, content):
+        super().__init__(None)
+        self.content = content
+
+def fake_spotify_get(calls):
+    """
+    Offline stand in for requests.Session.request covering the token, search and artist endpoints.
+    """
+    by_id = {v[1] : v for v in FAKE_ARTISTS.values()}
+    def get(session, method, url, headers=None, params=None, **kwargs):
+        if url.endswith("/api/token"):
+            return FakeResponse({"access_token" : "token", "expires_in" : 3600})
+        calls.append(url)
+        if url.endswith("/v1/search"):
+            hit = FAKE_ARTISTS.get(params["q"].lower())
+            items = [] if hit is None else [{"name" : hit[0], "id" : hit[1]}]
+            return FakeResponse({"artists" : {"items" : items}})
+        if url.endswith("/v1/tracks"):
+            ids = params["ids"].split(",")
+            if "invalid" in ids:
+                return FakeResponse({"error" : "invalid id"}, status_code=400)
+            return FakeResponse({"tracks" : [None if i not in FAKE_TRACKS else FAKE_TRACKS[i] for i in ids]})
+        if url.startswith("https://i.scdn.co/image/"):
+            return FakeImageResponse(url.rsplit("/", 1)[-1].encode("utf-8"))
+        if "/albums" in url:
+            artist_id = url.split("/albums")[0].rsplit("/", 1)[-1]
+            return FakeResponse({"items" : FAKE_ALBUMS.get(artist_id, [])})
+        if url.endswith("/v1/artists"):
+            ids = params["ids"].split(",")
+            return FakeResponse({"artists" : [None if i not in by_id else {"id" : i, "genres" : by_id[i][2]} for i in ids]})
+        artist_id = url.rsplit("/", 1)[-1]
+        if artist_id not in by_id:
+            return FakeResponse({"error" : "invalid id"}, status_code=400)
+        return FakeResponse({"id" : artist_id, "genres" : by_id[artist_id][2]})
+    return get
+
+@pytest.fixture
+def offline_client(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setenv("CLIENT_ID", "client_id")
+    monkeypatch.setenv("CLIENT_SECRET", "client_secret")
+    monkeypatch.setattr(spotify_client.requests.Session, "request", fake_spotify_get(calls))
+    return SpotifyClient(use_cache=False, artwork_cache=ArtworkCache(str(tmp_path/"artwork"))), calls
+
+def test_batched_genres_match_per_artist(offline_client):
+    """
+    The batched genre lookup gives the same output as the per artist lookup
+    but with one artists request rather than one per artist.
+    """
+    client, calls = offline_client
+    artist_list = ["dave", "spice", "beck", "dave", "arctic monkeys", "not an artist"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        per_artist = client.get_genres_from_artist_list(artist_list, batched=False)
+        n_per_artist_calls = len(calls)
+        calls.clear()
+        batched = client.get_genres_from_artist_list(artist_list, batched=True)
+    assert batched == per_artist
+    assert list(batched) == list(per_artist)
+    assert batched["dave"]["count"] == 2
+    assert batched["not an artist"]["genres"] == []
+    assert sum(url.endswith("/v1/artists") for url in calls) == 1
+    assert len(calls) < n_per_artist_calls
+
+def test_batched_genres_chunks_of_50(offline_client):
+    client, calls = offline_client
+    ids = [f"id_{i}" for i in range(120)] + ["id_dave"]
+    genres = client.get_genres_from_artist_ids(ids)
+    assert len(calls) == 3
+    assert genres["id_dave"] == ["uk hip hop", "rap"]
+    assert genres["id_0"] == []
+
+def test_batched_tracks(offline_client):
+    client, calls = offline_client
+    ids = ["t_streatham", "t_loser", "t_unknown"] + [f"t_{i}" for i in range(60)] + ["t_streatham"]
+    tracks = client.get_tracks(ids)
+    assert len(calls) == 2
+    assert tracks["t_streatham"] == {"album" : "PSYCHODRAMA", "artists" : ["Dave"], "artist_ids" : ["id_dave"]}
+    assert tracks["t_unknown"] is None
+
+    # an invalid id falls back to one request per id
+    tracks = client.get_tracks(["t_loser", "invalid"])
+    assert tracks == {"t_loser" : {"album" : "Mellow Gold", "artists" : ["Beck"], "artist_ids" : ["id_beck"]}, "invalid" : None}
+
+def test_known_ids_skip_search(offline_client):
+    client, calls = offline_client
+    genres = client.get_genres_from_artist_list(["dave", "beck"], known_ids={"dave" : "id_dave"})
+    assert sum(url.endswith("/v1/search") for url in calls) == 1
+    assert genres["dave"]["genres"] == ["uk hip hop", "rap"]
+
+def test_known_ids_outside_the_list_are_not_fetched(offline_client, monkeypatch):
+    client, _ = offline_client
+    fetched = []
+    get_genres_from_artist_ids = client.get_genres_from_artist_ids
+    def recording(ids):
+        fetched.extend(ids)
+        return get_genres_from_artist_ids(ids)
+    monkeypatch.setattr(client, "get_genres_from_artist_ids", recording)
+    genres = client.get_genres_from_artist_list(["dave"], known_ids={"dave" : "id_dave", "spice" : "id_spice"})
+    assert fetched == ["id_dave"] and list(genres) == ["dave"]
+
+def test_album_artwork_downloads_once(offline_client):
+    client, calls = offline_client
+    pairs = [("Dave", "PSYCHODRAMA"), ("Dave", "PSYCHODRAMA"), ("Beck", "Odelay")]
+    artwork = client.get_album_artwork(pairs)
+    assert list(artwork) == [("Dave", "PSYCHODRAMA"), ("Beck", "Odelay")]
+    assert artwork[("Beck", "Odelay")] is None
+    with open(artwork[("Dave", "PSYCHODRAMA")], "rb") as f:
+        assert f.read() == b"psychodrama_300" # smallest image at least 125 pixels wide
+    assert sum("i.scdn.co" in url for url in calls) == 1
+
+    # the image is already stored so a repeat render makes no download
+    calls.clear()
+    assert client.get_album_artwork(pairs) == artwork
+    assert sum("i.scdn.co" in url for url in calls) == 0
+
+@pytest.fixture
+def indexed_client(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setenv("CLIENT_ID", "client_id")
+    monkeypatch.setenv("CLIENT_SECRET", "client_secret")
+    monkeypatch.setattr(spotify_client.requests.Session, "request", fake_spotify_get(calls))
+    def make_client():
+        return SpotifyClient(cache=MetadataCache(str(tmp_path/"metadata.sqlite")), artwork_cache=ArtworkCache(str(tmp_path/"artwork")),
+                             entity_index=EntityIndex(str(tmp_path/"entities.sqlite")))
+    return make_client, calls
+
+def test_entity_index_answers_second_run(indexed_client):
+    make_client, calls = indexed_client
+    client = make_client()
+    client.get_tracks(["t_streatham"])
+    assert client.search_for_artist_id("dave") == ("Dave", "id_dave")
+    # dave was resolved from the track response, only beck needs a search
+    assert client.search_for_artist_ids(["dave", "beck"]) == {"dave" : ("Dave", "id_dave"), "beck" : ("Beck", "id_beck")}
+    assert sum(url.endswith("/v1/search") for url in calls) == 1
+
+    # a new client (eg. the next run) resolves the names and the indexed track from the persisted index
+    calls.clear()
+    client = make_client()
+    client.cache.clear()
+    assert client.search_for_artist_id("BECK") == ("Beck", "id_beck")
+    assert client.get_albums_for_tracks([("Dave", "Streatham")]) == ["PSYCHODRAMA"]
+    assert not any(url.endswith("/v1/search") for url in calls)
+
 def main():
     #test_album_lookup_from_song()
     #test_genre_lookup_from_song()
@@ -0,0 +1,38 @@
+import pandas as pd
+from spotify_stream_analyser import SpotifyStreamAnalyser
+from conftest import assert_top_k_equal, finalised, write_histories
+
+def test_matches_exact_top_k(tmp_path):
+    fnames = write_histories(tmp_path, n_files=3, n=1500)
+    unwrapped = finalised(fnames)
+    analyser = SpotifyStreamAnalyser()
+    for f in fnames:
+        analyser.update_file(f, chunk_rows=500)
+    for method in ["get_yearly_top_artists", "get_yearly_top_songs", "get_yearly_top_podcasts"]:
+        for expected, result in zip(getattr(unwrapped, method)(), getattr(analyser, method)()):
+            assert_top_k_equal(expected, result)
+
+def test_merge_and_serialize(tmp_path):
+    fnames = write_histories(tmp_path, n_files=3, n=1500)
+    single = SpotifyStreamAnalyser()
+    for f in fnames:
+        single.update_file(f)
+    merged = SpotifyStreamAnalyser()
+    for f in fnames:
+        part = SpotifyStreamAnalyser()
+        part.update_file(f)
+        merged.merge(SpotifyStreamAnalyser.deserialize(part.serialize()))
+    for a, b in zip(single.get_yearly_top_songs(), merged.get_yearly_top_songs()):
+        pd.testing.assert_frame_equal(a, b)
+
+def test_error_bounds_hold_with_small_sketch(tmp_path):
+    fnames = write_histories(tmp_path, n_files=3, n=1500)
+    unwrapped = finalised(fnames)
+    analyser = SpotifyStreamAnalyser(lg_max_k=3) # far fewer counters than distinct tracks
+    for f in fnames:
+        analyser.update_file(f)
+    exact = unwrapped.song_df["trackName"].value_counts()
+    bounds = analyser.get_top_k("song", "plays", k=5)
+    assert len(bounds) == 5
+    for _, row in bounds.iterrows():
+        assert row["lower_bound"] <= exact[row["item"]] <= row["upper_bound"]
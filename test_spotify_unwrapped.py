@@ -1,5 +1,55 @@
 from spotify_unwrapped import SpotifyUnwrapped
+import json
+import numpy as np
 import pandas as pd
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+from conftest import OfflineClient, to_extended
+
+def test_streaming_update_matches_batch(history_file):
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient())
+    batch = unwrapped.json_batch_update(history_file)
+    streamed = unwrapped.json_batch_update(history_file, streaming=True, chunk_rows=128)
+    assert len(batch) > 0
+    pd.testing.assert_frame_equal(batch, streamed)
+
+def test_streaming_update_uploaded_file(history_file):
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient())
+    with open(history_file, "rb") as f:
+        data = f.read()
+    uploaded = UploadedFile(UploadedFileRec("id", "StreamingHistory0.json", "application/json", data), None)
+    streamed = unwrapped.json_batch_update(uploaded, streaming=True, chunk_rows=100)
+    pd.testing.assert_frame_equal(unwrapped.json_batch_update(history_file), streamed)
+
+def test_compact_matches_default(history_file):
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient())
+    df = unwrapped.json_batch_update(history_file)
+    unwrapped.finalise_dataframes([df])
+    default_bytes = unwrapped.memory_usage()
+    expected = [unwrapped.get_yearly_top_artists(), unwrapped.get_yearly_top_songs(), unwrapped.get_yearly_top_podcasts()]
+    unwrapped.finalise_dataframes([df], compact=True)
+    result = [unwrapped.get_yearly_top_artists(), unwrapped.get_yearly_top_songs(), unwrapped.get_yearly_top_podcasts()]
+    for e, r in zip(expected, result):
+        for a, b in zip(e, r):
+            pd.testing.assert_frame_equal(a, b, check_exact=True)
+    assert unwrapped.memory_usage() * 5 < default_bytes
+    # the song and podcast frames are slices of the compact frame, made once
+    assert unwrapped.song_df is unwrapped.song_df
+    assert np.shares_memory(unwrapped.song_df["msPlayed"].to_numpy(), unwrapped.df["msPlayed"].to_numpy())
+    assert np.shares_memory(unwrapped.podcast_df["msPlayed"].to_numpy(), unwrapped.df["msPlayed"].to_numpy())
+    assert unwrapped.get_total_num_songs(unwrapped.song_df) == df[df["minsPlayed"] <= 10]["trackName"].nunique()
+
+def test_extended_history_matches_basic(history_file, tmp_path):
+    with open(history_file) as f:
+        records = json.load(f)
+    extended_file = tmp_path / "Streaming_History_Audio_2023.json"
+    extended_file.write_text(json.dumps(to_extended(records)))
+    unwrapped = SpotifyUnwrapped(spotify_client=OfflineClient())
+    basic = unwrapped.json_batch_update(history_file)
+    extended = unwrapped.json_batch_update(str(extended_file))
+    streamed = unwrapped.json_batch_update(str(extended_file), streaming=True, chunk_rows=100)
+    pd.testing.assert_frame_equal(extended, streamed)
+    pd.testing.assert_frame_equal(basic, extended.drop(columns=["trackUri"]))
+    assert extended["trackUri"].notna().sum() > 0
 
 def main():
     unwrapped = SpotifyUnwrapped()
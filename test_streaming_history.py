@@ -0,0 +1,33 @@
+import io
+import json
+import pytest
+from streaming_history import iter_json_array, iter_record_chunks
+
+RECORDS = [
+    {"endTime" : "2023-01-01 10:00", "artistName" : "Beyoncé", "trackName" : "[brackets], {braces}", "msPlayed" : 1},
+    {"endTime" : "2023-01-02 10:00", "artistName" : "Sigur Rós", "trackName" : "Hoppípolla \"quoted\"", "msPlayed" : 200000},
+    {"endTime" : "2023-01-03 10:00", "artistName" : "宇多田ヒカル", "trackName" : "First Love", "msPlayed" : 3000000},
+]
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_iter_json_array_bytes(chunk_size):
+    data = json.dumps(RECORDS, indent=2, ensure_ascii=False).encode("utf-8")
+    assert list(iter_json_array(io.BytesIO(data), chunk_size)) == RECORDS
+
+@pytest.mark.parametrize("chunk_size", [3, 1 << 20])
+def test_iter_json_array_text(chunk_size):
+    data = json.dumps(RECORDS)
+    assert list(iter_json_array(io.StringIO(data), chunk_size)) == RECORDS
+
+def test_empty_and_invalid():
+    assert list(iter_json_array(io.BytesIO(b" [ ] "))) == []
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(b'{"not" : "an array"}')))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(json.dumps(RECORDS).encode("utf-8")[:-20]), 16))
+
+def test_iter_record_chunks():
+    data = json.dumps(RECORDS * 5).encode("utf-8")
+    chunks = list(iter_record_chunks(io.BytesIO(data), chunk_rows=4, chunk_size=32))
+    assert [len(c) for c in chunks] == [4, 4, 4, 3]
+    assert sum(chunks, []) == RECORDS * 5
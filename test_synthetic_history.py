@@ -0,0 +1,46 @@
+import json
+import numpy as np
+import pandas as pd
+from synthetic_history import iter_synthetic_frames, synthetic_frame, write_history, synthetic_album
+from streaming_history import records_to_frame
+
+def test_deterministic_and_in_time_order():
+    a = synthetic_frame(5000, seed=1, chunk_rows=1000)
+    assert len(a) == 5000
+    pd.testing.assert_frame_equal(a, synthetic_frame(5000, seed=1, chunk_rows=1000))
+    assert not a["artistName"].equals(synthetic_frame(5000, seed=2, chunk_rows=1000)["artistName"])
+    assert a["endTime"].is_monotonic_increasing
+    assert list(a.index) == list(range(5000))
+
+def test_popularity_and_mix():
+    df = synthetic_frame(50_000, podcast_fraction=0.05, skip_fraction=0.2)
+    counts = df[df["trackUri"].notna()]["artistName"].value_counts()
+    assert counts.index[0] == "Artist 0"
+    assert counts.iloc[0] > 10*counts.iloc[50] # Zipfian skew
+    podcasts = df["trackUri"].isna()
+    assert np.isclose(podcasts.mean(), 0.05, atol=0.01)
+    assert (df.loc[podcasts, "minsPlayed"] > 10).all()
+    assert np.isclose((df.loc[~podcasts, "msPlayed"] < 30_000).mean(), 0.2, atol=0.02)
+
+def test_written_files_parse_to_the_frame(tmp_path):
+    expected = synthetic_frame(3000, seed=2, chunk_rows=1000)
+    fname = tmp_path/"basic.json"
+    assert write_history(str(fname), 3000, seed=2, chunk_rows=1000) == fname.stat().st_size
+    df = records_to_frame(json.loads(fname.read_text()))
+    pd.testing.assert_frame_equal(df, expected.drop(columns="trackUri"))
+
+    write_history(str(tmp_path/"extended.json"), 3000, extended=True, seed=2, chunk_rows=1000)
+    records = json.loads((tmp_path/"extended.json").read_text())
+    df = records_to_frame(records)
+    pd.testing.assert_frame_equal(df[["artistName", "trackName", "msPlayed"]], expected[["artistName", "trackName", "msPlayed"]])
+    song = next(r for r in records if r["spotify_track_uri"] is not None)
+    assert song["master_metadata_album_album_name"] == synthetic_album(song["master_metadata_album_artist_name"], song["master_metadata_track_name"])
+
+def test_chunks():
+    chunks = list(iter_synthetic_frames(2500, seed=3, chunk_rows=1000))
+    assert [len(c) for c in chunks] == [1000, 1000, 500]
+    # the index runs on across chunks and the whole history stays in time order
+    df = pd.concat(chunks, axis=0)
+    assert list(df.index) == list(range(2500))
+    assert df["endTime"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(df, synthetic_frame(2500, seed=3, chunk_rows=1000).drop(columns="minsPlayed"))
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from time_cube import TimeCube
+from streaming_history import records_to_frame, filter_plays
+from time_window import TimeWindow
+from conftest import make_history
+
+def make_plays(n=5000):
+    return filter_plays(records_to_frame(make_history(n)), TimeWindow.all_time())
+
+def with_dimensions(df):
+    return df.assign(entity=df["artistName"], month=df["endTime"].dt.to_period("M").dt.to_timestamp(),
+                     weekday=df["endTime"].dt.weekday, hour=df["endTime"].dt.hour)
+
+def test_rollups_match_groupby():
+    df = make_plays()
+    cube = TimeCube.from_plays(df)
+    assert len(cube) < len(df)
+    full = with_dimensions(df)
+    for by in (["entity"], ["month"], ["weekday", "hour"], ["entity", "month", "weekday", "hour"]):
+        expected = full.groupby(by)["minsPlayed"].agg(["size", "sum"])
+        result = cube.rollup(by)
+        assert list(result.index) == list(expected.index)
+        np.testing.assert_array_equal(result["plays"], expected["size"])
+        np.testing.assert_allclose(result["minutes"], expected["sum"])
+    total = cube.rollup([])
+    assert total["plays"][0] == len(df)
+
+def test_slices():
+    df = make_plays()
+    cube = TimeCube.from_plays(df)
+    full = with_dimensions(df)
+    artists = ["artist 1", "artist 2", "no such artist"]
+    sliced = full[full["artistName"].isin(artists) & (full["endTime"] >= "2023-03-01") & (full["endTime"] < "2023-07-01")
+                  & full["weekday"].isin([5, 6]) & full["hour"].isin(range(18, 24))]
+    result = cube.rollup(["month"], entities=artists, start="2023-03-01", end="2023-07-01", weekdays=[5, 6], hours=range(18, 24))
+    expected = sliced.groupby("month")["minsPlayed"].agg(["size", "sum"])
+    np.testing.assert_array_equal(result["plays"], expected["size"])
+    np.testing.assert_allclose(result["minutes"], expected["sum"])
+    grid = cube.grid("weekday", "hour")
+    assert grid.shape == (7, 24)
+    assert np.isclose(grid.to_numpy().sum(), df["minsPlayed"].sum())
+
+def test_top_k_by_month():
+    df = make_plays()
+    cube = TimeCube.from_plays(df)
+    top = cube.top_k_by_period(2, "month")
+    expected = with_dimensions(df).groupby(["month", "entity"]).size().rename("plays").reset_index()
+    for month, group in top.groupby("month"):
+        month_counts = expected[expected["month"] == month].sort_values(["plays", "entity"], ascending=[False, True])
+        assert list(group["entity"]) == list(month_counts["entity"][:2])
+        assert list(group["rank"]) == list(range(1, len(group) + 1))
+
+def test_longest_streak():
+    days = ["2023-01-01", "2023-01-02", "2023-01-05", "2023-01-06", "2023-01-07", "2023-01-09"]
+    df = pd.DataFrame({"endTime" : pd.to_datetime(days), "artistName" : "a", "minsPlayed" : 3.})
+    cube = TimeCube.from_plays(df)
+    assert cube.longest_streak() == (pd.Timestamp("2023-01-05"), pd.Timestamp("2023-01-07"), 3)
+    assert len(cube.daily()) == 6
+    assert TimeCube.from_plays(df.iloc[:0]).longest_streak() is None
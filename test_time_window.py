@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from time_window import TimeWindow, wrapped_windows
+from conftest import finalised, write_histories
+
+def random_times(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    minutes = rng.integers(0, 60*24*365*3, size=n)
+    return pd.Series(pd.Timestamp("2021-09-01") + pd.to_timedelta(minutes, unit="m"))
+
+def test_wrapped_matches_string_filter():
+    times = random_times()
+    expected = (times.dt.strftime("%Y") == "2023") & (times.dt.strftime("%m") < "11")
+    np.testing.assert_array_equal(TimeWindow.wrapped(2023).mask(times), expected.to_numpy())
+
+def test_bounds():
+    times = pd.Series(pd.to_datetime(["2022-12-31 23:59", "2023-01-01 00:00", "2023-12-31 23:59", "2024-01-01 00:00"]))
+    np.testing.assert_array_equal(TimeWindow.year(2023).mask(times), [False, True, True, False])
+    np.testing.assert_array_equal(TimeWindow(start="2023-06-01").mask(times), [False, False, True, True])
+    np.testing.assert_array_equal(TimeWindow.all_time().mask(times), [True]*4)
+    with pytest.raises(AssertionError):
+        TimeWindow("2024-01-01", "2023-01-01")
+
+def test_wrapped_windows():
+    windows = wrapped_windows(random_times())
+    assert list(windows) == [2021, 2022, 2023, 2024]
+    assert windows[2022] == TimeWindow.wrapped(2022)
+
+def test_wrapped_by_year(tmp_path):
+    fnames = write_histories(tmp_path, n=3000)
+    unwrapped = finalised(fnames, window=TimeWindow.all_time())
+    yearly = unwrapped.wrapped_by_year()
+    assert set(yearly) == {2022, 2023, 2024}
+
+    # the same as ingesting with the 2023 window directly
+    direct = finalised(fnames)
+    for a, b in zip(direct.get_yearly_top_artists(), yearly[2023].get_yearly_top_artists()):
+        pd.testing.assert_frame_equal(a, b)
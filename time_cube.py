@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+
+DIMENSIONS = ("entity", "month", "weekday", "hour")
+SIZES = {"weekday" : 7, "hour" : 24}
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+NS_PER_HOUR = 3600*10**9
+NS_PER_DAY = 24*NS_PER_HOUR
+
+
+class TimeCube:
+    """
+    Pre-aggregated plays and minutes keyed by (entity, month, weekday, hour), eg. with the artists
+    as the entities.  The cube is built with one pass over the plays and is stored as flat numpy
+    columns (one row per non empty cell), so slices and rollups are masks and bincounts over
+    the cells rather than groupbys over every play.
+    Also keeps the plays per calendar day for the listening streaks.
+    Months are counted from 1970-01, weekday 0 is Monday and the hours are those of endTime (UTC).
+    """
+
+    def __init__(self, entities:pd.Index, entity:np.ndarray, month:np.ndarray, weekday:np.ndarray, hour:np.ndarray,
+                 plays:np.ndarray, minutes:np.ndarray, days:np.ndarray, day_plays:np.ndarray, day_minutes:np.ndarray) -> None:
+        self.entities = entities
+        self.columns = {"entity" : entity, "month" : month, "weekday" : weekday, "hour" : hour}
+        self.plays = plays
+        self.minutes = minutes
+        self.days = days
+        self.day_plays = day_plays
+        self.day_minutes = day_minutes
+
+    @classmethod
+    def from_plays(cls, df:pd.DataFrame, entity:str="artistName") -> "TimeCube":
+        """
+        Builds the cube from the plays in df (endTime, minsPlayed and the entity column).
+        """
+        codes, entities = pd.factorize(df[entity], sort=True)
+        entities = pd.Index(entities).astype(object)
+        ns = df["endTime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        month = df["endTime"].to_numpy(dtype="datetime64[M]").astype(np.int64)
+        day = ns//NS_PER_DAY
+        weekday = (day + 3) % 7 # 1970-01-01 was a Thursday
+        hour = (ns//NS_PER_HOUR) % 24
+        minutes = df["minsPlayed"].to_numpy(dtype=np.float64)
+
+        month_min = month.min() if len(month) else 0
+        n_months = int(month.max() - month_min + 1) if len(month) else 1
+        key = ((codes.astype(np.int64)*n_months + (month - month_min))*7 + weekday)*24 + hour
+        cells, inverse = np.unique(key, return_inverse=True)
+        plays = np.bincount(inverse, minlength=len(cells)).astype(np.int64)
+        cell_minutes = np.bincount(inverse, weights=minutes, minlength=len(cells))
+        cell_hour = cells % 24
+        cell_weekday = (cells//24) % 7
+        cell_month = (cells//(24*7)) % n_months + month_min
+        cell_entity = cells//(24*7*n_months)
+
+        days, day_inverse = np.unique(day, return_inverse=True)
+        day_plays = np.bincount(day_inverse, minlength=len(days)).astype(np.int64)
+        day_minutes = np.bincount(day_inverse, weights=minutes, minlength=len(days))
+        return cls(entities, cell_entity.astype(np.int32), cell_month.astype(np.int32), cell_weekday.astype(np.int8),
+                   cell_hour.astype(np.int8), plays, cell_minutes, days.astype("datetime64[D]"), day_plays, day_minutes)
+
+    def __len__(self) -> int:
+        return len(self.plays)
+
+    def memory_usage(self) -> int:
+        arrays = [*self.columns.values(), self.plays, self.minutes, self.days, self.day_plays, self.day_minutes]
+        return int(sum(a.nbytes for a in arrays))
+
+    def mask(self, entities:List[str]=None, start:str | pd.Timestamp=None, end:str | pd.Timestamp=None,
+             weekdays:List[int]=None, hours:List[int]=None) -> np.ndarray:
+        """
+        Boolean mask of the cells in the slice: the given entities, the months in [start, end)
+        (a month is in the slice if its first day is), and the given weekdays and hours.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if entities is not None:
+            codes = self.entities.get_indexer(pd.Index(entities, dtype=object))
+            keep &= np.isin(self.columns["entity"], codes[codes >= 0])
+        if start is not None:
+            keep &= self.columns["month"] >= _first_month(pd.Timestamp(start))
+        if end is not None:
+            keep &= self.columns["month"] < _first_month(pd.Timestamp(end))
+        if weekdays is not None:
+            keep &= np.isin(self.columns["weekday"], weekdays)
+        if hours is not None:
+            keep &= np.isin(self.columns["hour"], hours)
+        return keep
+
+    def rollup(self, by:List[str], **slice_kwargs) -> pd.DataFrame:
+        """
+        plays and minutes of the slice (see mask) summed over every dimension not in by,
+        indexed by the by dimensions (entity names, month start timestamps, weekday and hour numbers).
+        Only the non empty groups are returned, sorted by the by dimensions.
+        """
+        assert all(d in DIMENSIONS for d in by), f"Unknown dimension in {by}, expected {DIMENSIONS}."
+        keep = self.mask(**slice_kwargs)
+        plays, minutes = self.plays[keep], self.minutes[keep]
+        if len(by) == 0:
+            return pd.DataFrame({"plays" : [int(plays.sum())], "minutes" : [float(minutes.sum())]})
+        columns = [self.columns[d][keep].astype(np.int64) for d in by]
+        offsets = [c.min() if len(c) else 0 for c in columns]
+        shape = [int(c.max() - o + 1) if len(c) else 1 for c, o in zip(columns, offsets)]
+        key = np.ravel_multi_index([c - o for c, o in zip(columns, offsets)], shape)
+        cells, inverse = np.unique(key, return_inverse=True)
+        groups = [g + o for g, o in zip(np.unravel_index(cells, shape), offsets)]
+        agg = pd.DataFrame({
+            "plays" : np.bincount(inverse, weights=plays, minlength=len(cells)).round().astype(np.int64),
+            "minutes" : np.bincount(inverse, weights=minutes, minlength=len(cells)),
+        })
+        levels = [self._labels(d, g) for d, g in zip(by, groups)]
+        agg.index = pd.MultiIndex.from_arrays(levels, names=by) if len(by) > 1 else pd.Index(levels[0], name=by[0])
+        return agg
+
+    def _labels(self, dimension:str, values:np.ndarray) -> np.ndarray:
+        if dimension == "entity":
+            return self.entities.to_numpy()[values]
+        if dimension == "month":
+            return values.astype("datetime64[M]").astype("datetime64[ns]")
+        return values
+
+    def grid(self, rows:str, columns:str, value:str="minutes", **slice_kwargs) -> pd.DataFrame:
+        """
+        Dense rows x columns table of a rollup, eg. grid("weekday", "hour") for the listening heatmap.
+        The weekday and hour axes always have all 7/24 entries.
+        """
+        table = self.rollup([rows, columns], **slice_kwargs)[value].unstack(columns, fill_value=0)
+        for axis, dimension in ((0, rows), (1, columns)):
+            if dimension in SIZES:
+                table = table.reindex(range(SIZES[dimension]), axis=axis, fill_value=0)
+        return table
+
+    def top_k_by_period(self, k:int, period:str="month", value:str="plays", **slice_kwargs) -> pd.DataFrame:
+        """
+        The top k entities of every period (month, weekday or hour) by value, as the long frame
+        (period, entity, plays, minutes, rank) sorted by period and rank.  Ties are broken by name.
+        """
+        agg = self.rollup([period, "entity"], **slice_kwargs).reset_index()
+        agg = agg.sort_values([period, value, "entity"], ascending=[True, False, True], kind="stable")
+        agg["rank"] = agg.groupby(period, sort=False).cumcount() + 1
+        return agg[agg["rank"] <= k].reset_index(drop=True)
+
+    def daily(self) -> pd.DataFrame:
+        """
+        plays and minutes per calendar day with plays.
+        """
+        return pd.DataFrame({"plays" : self.day_plays, "minutes" : self.day_minutes},
+                            index=pd.DatetimeIndex(self.days.astype("datetime64[ns]"), name="day"))
+
+    def longest_streak(self) -> Tuple[pd.Timestamp, pd.Timestamp, int] | None:
+        """
+        (first day, last day, number of days) of the longest run of consecutive days with plays
+        (the earliest if there are several), None if there are no plays.
+        """
+        if len(self.days) == 0:
+            return None
+        day_numbers = self.days.astype(np.int64)
+        breaks = np.flatnonzero(np.diff(day_numbers) != 1)
+        starts = np.concatenate([[0], breaks + 1])
+        ends = np.concatenate([breaks, [len(day_numbers) - 1]])
+        longest = int(np.argmax(ends - starts))
+        return pd.Timestamp(self.days[starts[longest]]), pd.Timestamp(self.days[ends[longest]]), int(ends[longest] - starts[longest] + 1)
+
+
+def _first_month(timestamp:pd.Timestamp) -> int:
+    """
+    Months since 1970-01 of the first month starting at or after timestamp.
+    """
+    month = (timestamp.year - 1970)*12 + timestamp.month - 1
+    if timestamp != pd.Timestamp(year=timestamp.year, month=timestamp.month, day=1):
+        month += 1
+    return month
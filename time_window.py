@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+WRAPPED_CUTOFF_MONTH = 11 # Wrapped only counts the plays before November
+
+
+class TimeWindow:
+    """
+    Half open [start, end) window on the endTime of the plays.
+    start or end of None leaves that side unbounded.
+    The filtering compares datetime64 values directly so no strings are formatted.
+    """
+
+    def __init__(self, start:str | pd.Timestamp=None, end:str | pd.Timestamp=None, label:str=None) -> None:
+        self.start = None if start is None else pd.Timestamp(start)
+        self.end = None if end is None else pd.Timestamp(end)
+        if self.start is not None and self.end is not None:
+            assert self.start < self.end, "The window start must be before its end."
+        self.label = label if label is not None else self._default_label()
+
+    @classmethod
+    def wrapped(cls, year:int=2023) -> "TimeWindow":
+        """
+        The Spotify Wrapped window: 1st January to the end of October.
+        """
+        return cls(pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year, month=WRAPPED_CUTOFF_MONTH, day=1), label=str(year))
+
+    @classmethod
+    def year(cls, year:int) -> "TimeWindow":
+        return cls(pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year + 1, month=1, day=1), label=f"{year} (full year)")
+
+    @classmethod
+    def all_time(cls) -> "TimeWindow":
+        return cls(label="all time")
+
+    def _default_label(self) -> str:
+        start = "" if self.start is None else self.start.strftime("%Y-%m-%d")
+        end = "" if self.end is None else self.end.strftime("%Y-%m-%d")
+        return f"{start} to {end}"
+
+    def mask(self, times:pd.Series) -> np.ndarray:
+        values = times.to_numpy(dtype="datetime64[ns]")
+        keep = np.ones(len(values), dtype=bool)
+        if self.start is not None:
+            keep &= values >= self.start.to_datetime64()
+        if self.end is not None:
+            keep &= values < self.end.to_datetime64()
+        return keep
+
+    def filter(self, df:pd.DataFrame, column:str="endTime") -> pd.DataFrame:
+        return df[self.mask(df[column])]
+
+    def params(self) -> dict:
+        return {"start" : None if self.start is None else str(self.start), "end" : None if self.end is None else str(self.end)}
+
+    def __eq__(self, other:object) -> bool:
+        return isinstance(other, TimeWindow) and self.params() == other.params()
+
+    def __hash__(self) -> int:
+        return hash((self.start, self.end))
+
+    def __repr__(self) -> str:
+        return f"TimeWindow({self.label})"
+
+
+def wrapped_windows(times:pd.Series, full_year:bool=False) -> Dict[int, TimeWindow]:
+    """
+    One window per year present in times, for making a Wrapped for every year from a single ingest.
+    """
+    years = np.unique(times.dt.year.to_numpy())
+    make = TimeWindow.year if full_year else TimeWindow.wrapped
+    return {int(year) : make(int(year)) for year in years}